@@ -1,55 +1,105 @@
-import json, os, boto3, faiss
+import os, time
 import numpy as np
 from typing import List, Tuple
+import indexer_path  # noqa: F401
+from bedrock_invoker import get_invoker
+from kb_store import load_meta, read_index
+from kb_filter import filtered_search
+import kb_lexical
+import claude_stream
+import agent_router  # 단계 모델/토큰 예산: AGENT_ANSWER_MODEL, AGENT_ANSWER_MAX_TOKENS
 
 REGION   = os.getenv("AWS_REGION", "us-east-1")
-LLM_ID   = os.getenv("BEDROCK_LLM_ID", "anthropic.claude-3-sonnet-20240229-v1:0")
-
-br = boto3.client("bedrock-runtime", region_name=REGION)
-
-def load_index(idx_path="kb.index", meta_path="kb_meta.json"):
-    index = faiss.read_index(idx_path)
-    raw = json.load(open(meta_path, encoding="utf-8"))
-    docs = []
-    for item in raw:
-        if isinstance(item, dict):
-            # 이미 {"doc_id":..,"text":..} 형태이면 그대로
-            docs.append(item)
-        else:
-            # ("doc1","text") 또는 ["doc1","text"] 형태 → dict로 정규화
-            doc_id, text = item[0], item[1]
-            docs.append({"doc_id": doc_id, "text": text})
+
+br = get_invoker(REGION)
+
+def load_index(idx_path="kb.index", meta_path="kb_meta.jsonl"):
+    index = read_index(idx_path)  # kb.index.json 의 nprobe/efSearch 적용
+    # {FAISS id: {"id","doc_id","text"}} — mmap 된 kb_meta.jsonl 에서 조회할 때만 디코딩 (예전 kb_meta.json 도 지원)
+    docs = load_meta(meta_path)
     return index, docs
 
-def search(index, docs, query_vec: List[float], k=4, min_score=0.2) -> List[Tuple[float, dict]]:
-    x = np.asarray(query_vec, dtype="float32")[None, :]
-    faiss.normalize_L2(x)  # IndexFlatIP를 cosine처럼 쓰려면 정규화
+def search(index, docs, query_vec: List[float], k=4, min_score=0.2, where=None, attrs=None,
+           query_text=None, lexical=None) -> List[Tuple[float, dict]]:
+    """
+    where 를 주면 attrs(kb_filter.load_attrs) 조건에 맞는 문서만으로 top-k.
+    lexical(kb_lexical.load_lexical) + query_text 를 주면 BM25 와 동시에 검색해 RRF 로 융합 (score = RRF 점수)
+    """
+    return search_many(index, docs, [query_vec], k, min_score, where, attrs,
+                       [query_text] if query_text else None, lexical)[0]
+
+def search_many(index, docs, query_vecs, k=4, min_score=0.2, where=None, attrs=None,
+                query_texts=None, lexical=None) -> List[List[Tuple[float, dict]]]:
+    """여러 질의 벡터를 질의 행렬 하나로 index.search 1회 → 질의별 [(score, doc)]"""
+    x = np.asarray(query_vecs, dtype="float32").reshape(len(query_vecs), -1)
+    x /= np.linalg.norm(x, axis=1, keepdims=True) + 1e-12  # IndexFlatIP를 cosine처럼 쓰려면 정규화
     assert x.shape[1] == index.d, f"dim mismatch: vec={x.shape[1]}, index={index.d}"
-    D, I = index.search(x, k)
-    hits = []
-    for score, idx in zip(D[0], I[0]):
-        if idx == -1:
-            continue
-        if float(score) >= min_score:
-            hits.append((float(score), docs[idx]))  # docs[idx]는 이제 dict
-    return hits
-
-def answer_with_context(question: str, retrieved: List[Tuple[float, dict]]) -> str:
-    ctx = "\n\n".join([f"[{i+1}] score={s:.3f} | {d['text']}" for i,(s,d) in enumerate(retrieved)])
+    if lexical is not None and query_texts:
+        ids = attrs.eligible_ids(where) if where and attrs is not None else None
+        depth = kb_lexical.depth_for(k)
+        futs = [kb_lexical.submit(lexical, q, depth, ids) for q in query_texts]  # 벡터 검색과 동시에
+        D, I = filtered_search(index, attrs, x, depth, where)
+        return [[(h["score"], docs[h["id"]]) for h in kb_lexical.fuse(D[r], I[r], futs[r].result(), k)
+                 if h["id"] in docs and (h["bm25_score"] is not None
+                                         or (h["vector_score"] is not None and h["vector_score"] >= min_score))]
+                for r in range(len(x))]
+    D, I = filtered_search(index, attrs, x, k, where)
+    out = []
+    for scores, ids in zip(D, I):
+        hits = []
+        for score, idx in zip(scores, ids):
+            if idx == -1:
+                continue
+            if float(score) >= min_score and idx in docs:
+                hits.append((float(score), docs[idx]))  # docs[idx]는 이제 dict
+        out.append(hits)
+    return out
+
+def doc_key(d: dict):
+    return d.get("doc_id") or d.get("id") or d.get("text")[:32]
+
+def merge_rrf(hit_lists: List[List[Tuple[float, dict]]], k=4) -> List[Tuple[float, dict]]:
+    """
+    질의별 결과(각각 점수순)를 Reciprocal Rank Fusion 으로 합쳐 상위 k (score = RRF 점수).
+    질의마다 코사인 점수 분포가 달라 raw score 로 정렬하면 한 질의가 결과를 독점하기 쉽다.
+    """
+    by_key = {}
+    rankings = []
+    for hits in hit_lists:
+        ranking = []
+        for _, d in hits:
+            key = doc_key(d)
+            if key not in by_key:
+                by_key[key] = d
+            if key not in ranking:
+                ranking.append(key)
+        rankings.append(ranking)
+    fused = kb_lexical.rrf(rankings)
+    return [(score, by_key[key]) for key, score in sorted(fused.items(), key=lambda x: -x[1])[:k]]
+
+def answer_with_context(question: str, retrieved: List[Tuple[float, dict]], on_delta=None, stats=None) -> str:
+    """
+    on_delta(text) 를 주면 invoke_model_with_response_stream 으로 받아 조각마다 호출.
+    stats(dict) 를 주면 usage 와 생성 시간(스트리밍이면 ttft_ms 도)을 채운다.
+    retrieved 의 score 는 코사인일 때만 넘긴다 (RRF 점수는 0.01~0.03 이라 관련도로 읽히면 안 됨) — None 이면 생략.
+    """
+    ctx = "\n\n".join([f"[{i+1}] score={s:.3f} | {d['text']}" if s is not None else f"[{i+1}] {d['text']}"
+                        for i,(s,d) in enumerate(retrieved)])
     prompt = (
         "You are a precise assistant. Answer the question ONLY using the context. "
         "If the context is insufficient, say so explicitly and propose what extra info is needed.\n\n"
         f"Context:\n{ctx}\n\nQuestion: {question}\nAnswer in Korean."
     )
-    payload = {
-        "anthropic_version": "bedrock-2023-05-31",
-        "max_tokens": 500,
-        "temperature": 0.3,
-        "messages": [{"role":"user","content":[{"type":"text","text":prompt}]}]
-    }
-    res = br.invoke_model(modelId=LLM_ID,
-                          contentType="application/json",
-                          accept="application/json",
-                          body=json.dumps(payload))
-    out = json.loads(res["body"].read().decode("utf-8"))
-    return out["content"][0]["text"]
+    payload = agent_router.payload("answer", prompt, 0.3)
+    model = agent_router.ROUTES["answer"]["model"]
+    if on_delta is not None:
+        res = claude_stream.complete(br, model, payload, on_delta)
+        agent_router.record("answer", model, res["total_ms"], res["usage"])
+        if stats is not None:
+            stats.update(model=model, usage=res["usage"], ttft_ms=res["ttft_ms"], total_ms=res["total_ms"])
+        return res["text"]
+    t = time.perf_counter()
+    text, usage, _ = agent_router.invoke("answer", payload)
+    if stats is not None:
+        stats.update(model=model, usage=usage, total_ms=round((time.perf_counter() - t) * 1000, 1))
+    return text
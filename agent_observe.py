@@ -1,31 +1,71 @@
-import json, boto3, os
+import os, re
+from collections import Counter
+from kb_lexical import tokenize
+import agent_router  # 단계 모델/토큰 예산: AGENT_OBSERVE_MODEL, AGENT_OBSERVE_MAX_TOKENS
 
-REGION   = os.getenv("AWS_REGION", "us-east-1")
-LLM_ID   = os.getenv("BEDROCK_LLM_ID", "anthropic.claude-3-sonnet-20240229-v1:0")
-
-br = boto3.client("bedrock-runtime", region_name=REGION)
+# 로컬 충분성 게이트: confidence 가 이 값 이상이면 observe(LLM) 없이 충분하다고 본다 (1 초과면 항상 LLM)
+GATE_THRESHOLD = float(os.getenv("AGENT_GATE_THRESHOLD", "0.75"))
+STRONG_SCORE = 0.8         # 이 코사인 이상인 문서를 "강한 근거"로 센다
+SCORE_FLOOR  = 0.5         # top-1 코사인이 이 값 이하면 점수 신호 0
+WEIGHTS = {"score": 0.45, "coverage": 0.3, "grounding": 0.25}
+# 답변이 모른다/컨텍스트 부족이라고 하면 로컬에서 받아들이지 않는다
+REFUSAL = re.compile(r"모르겠|알 수 없|컨텍스트에 없|정보가 (없|부족)|충분하지 않|찾을 수 없|"
+                     r"insufficient|not (enough|sufficient)|cannot answer|does not (contain|mention)", re.I)
+CITATION = re.compile(r"\[(\d+)\]")
+GATE_STATS = Counter()  # accepted / escalated
 
 EVAL_INST = (
     "Evaluate if the provided answer sufficiently addresses the user's question. "
-    "Output strict JSON: "
-    '{"sufficient": true|false, "reason":"...", "followup_queries":["kw1","kw2"]}'
+    "Also rate how confident you are in this judgment from 0 to 1. Output strict JSON: "
+    '{"sufficient": true|false, "reason":"...", "followup_queries":["kw1","kw2"], "confidence": 0.0-1.0}'
 )
 
 def observe(question: str, answer: str) -> dict:
-    payload = {
-        "anthropic_version": "bedrock-2023-05-31",
-        "max_tokens": 300,
-        "temperature": 0.2,
-        "messages": [{"role":"user","content":[{"type":"text","text":
-            f"{EVAL_INST}\n\nQuestion: {question}\n\nAnswer:\n{answer}"}]}]
-    }
-    res = br.invoke_model(modelId=LLM_ID,
-                          contentType="application/json",
-                          accept="application/json",
-                          body=json.dumps(payload))
-    out = json.loads(res["body"].read().decode("utf-8"))
-    txt = out["content"][0]["text"]
-    try:
-        return json.loads(txt)
-    except Exception:
+    obj, txt = agent_router.invoke_json("observe", f"{EVAL_INST}\n\nQuestion: {question}\n\nAnswer:\n{answer}", 0.2,
+                                        lambda o: isinstance(o, dict) and "sufficient" in o)
+    if not isinstance(obj, dict):
         return {"sufficient": False, "reason": txt, "followup_queries": []}
+    return obj
+
+def _share(terms, pool):
+    terms = {t for t in terms if len(t) > 1}
+    return sum(t in pool for t in terms) / len(terms) if terms else 0.0
+
+def estimate(question: str, answer: str, retrieved, scores=None) -> dict:
+    """
+    LLM 없이 답변 충분성 추정. retrieved: [(score, doc)], scores: 문서별 코사인 (없으면 점수 신호 제외)
+      score    : top-1 코사인과 STRONG_SCORE 이상 문서 수
+      coverage : 질문 토큰 중 컨텍스트에 나오는 비율
+      grounding: 답변이 [n] 으로 컨텍스트를 인용하면 1, 아니면 답변 토큰 중 컨텍스트에 있는 비율
+    거절/모름 답변은 confidence 0. 반환: {"confidence", "signals", "refusal"}
+    """
+    ctx = set(tokenize("\n".join(d["text"] for _, d in retrieved)))
+    signals = {"coverage": min(1.0, _share(tokenize(question), ctx) / 0.6)}
+    cited = {int(n) for n in CITATION.findall(answer)} & set(range(1, len(retrieved) + 1))
+    signals["grounding"] = 1.0 if cited else _share(tokenize(answer), ctx)
+    weights = dict(WEIGHTS)
+    if scores:
+        top = max(0.0, min(1.0, (max(scores) - SCORE_FLOOR) / (STRONG_SCORE - SCORE_FLOOR)))
+        strong = min(3, sum(s >= STRONG_SCORE for s in scores)) / 3
+        signals["score"] = 0.5 * top + 0.5 * strong
+    else:
+        weights.pop("score")
+    refusal = bool(REFUSAL.search(answer)) or not retrieved
+    conf = 0.0 if refusal else sum(weights[k] * signals[k] for k in weights) / sum(weights.values())
+    return {"confidence": round(conf, 3), "signals": {k: round(v, 3) for k, v in signals.items()}, "refusal": refusal}
+
+def observe_gated(question: str, answer: str, retrieved, scores=None, threshold=None):
+    """
+    estimate 가 threshold 이상이면 LLM 호출 없이 sufficient, 아니면 observe 로 넘긴다.
+    반환: (observe 결과, estimate 결과 + "gate": "accepted" | "escalated")
+    """
+    threshold = GATE_THRESHOLD if threshold is None else threshold
+    est = estimate(question, answer, retrieved, scores)
+    if est["confidence"] >= threshold:
+        GATE_STATS["accepted"] += 1
+        est["gate"] = "accepted"
+        return {"sufficient": True, "reason": f"local gate (confidence={est['confidence']})",
+                "followup_queries": []}, est
+    GATE_STATS["escalated"] += 1
+    est["gate"] = "escalated"
+    return observe(question, answer), est
@@ -1,37 +1,20 @@
-import json, boto3, os
-
-REGION   = os.getenv("AWS_REGION", "us-east-1")
-LLM_ID   = os.getenv("BEDROCK_LLM_ID", "anthropic.claude-3-sonnet-20240229-v1:0")
-
-br = boto3.client("bedrock-runtime", region_name=REGION)
+import agent_router  # 단계 모델/토큰 예산: AGENT_PLAN_MODEL, AGENT_PLAN_MAX_TOKENS
 
 SYSTEM = (
     "You are a planning assistant. Given a user question, produce a concise plan "
     "for how to answer it. Decide whether retrieval is needed, and if so, propose 1-3 "
-    "search queries. Respond as strict JSON: "
-    '{"plan":"...", "need_retrieval": true|false, "queries": ["q1","q2"]}'
+    "search queries. Also rate how confident you are in the plan from 0 to 1. Respond as strict JSON: "
+    '{"plan":"...", "need_retrieval": true|false, "queries": ["q1","q2"], "confidence": 0.0-1.0}'
 )
 
+def _valid(p) -> bool:
+    # 싼 모델이 JSON 은 냈지만 질의 형식이 틀리면 승격
+    return isinstance(p, dict) and isinstance(p.get("queries", []), list) \
+        and all(isinstance(q, str) for q in p.get("queries", []))
+
 def plan(question: str) -> dict:
-    payload = {
-        "anthropic_version": "bedrock-2023-05-31",
-        "max_tokens": 400,
-        "temperature": 0.2,
-        "messages": [
-            {"role": "user", "content": [
-                {"type": "text", "text": f"{SYSTEM}\n\nUser question: {question}"}
-            ]}
-        ]
-    }
-    res = br.invoke_model(modelId=LLM_ID,
-                          contentType="application/json",
-                          accept="application/json",
-                          body=json.dumps(payload))
-    out = json.loads(res["body"].read().decode("utf-8"))
-    # Out format from Bedrock Claude: {"content":[{"type":"text","text":"..."}], ...}
-    txt = out["content"][0]["text"]
-    try:
-        return json.loads(txt)
-    except Exception:
+    obj, txt = agent_router.invoke_json("plan", f"{SYSTEM}\n\nUser question: {question}", 0.2, _valid)
+    if obj is None or not _valid(obj):
         # fallback: wrap raw text
         return {"plan": txt, "need_retrieval": True, "queries": []}
+    return obj
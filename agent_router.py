@@ -0,0 +1,127 @@
+# file: agent_router.py
+"""
+에이전트 단계별 모델 라우팅 (plan / answer / observe)
+
+plan 과 observe 는 작은 JSON 만 내므로 Haiku 급 모델로, answer 는 Sonnet 으로 보낸다.
+싼 모델의 JSON 이 파싱되지 않거나 confidence 가 낮으면 escalate 모델로 한 번 다시 호출한다.
+단계별 호출 수 / 승격 수 / 지연(p50, p95) / 입출력 토큰을 모델별로 모아 라우팅을 데이터로 조정할 수 있게 한다.
+
+환경 변수 (단계: PLAN, ANSWER, OBSERVE)
+  AGENT_<단계>_MODEL       : 단계 모델 (기본: plan/observe=Haiku, answer=BEDROCK_LLM_ID 또는 Sonnet)
+  AGENT_<단계>_MAX_TOKENS  : 단계 토큰 예산
+  AGENT_ESCALATE_MODEL     : 승격 모델 (기본: answer 모델)
+  AGENT_ESCALATE_CONFIDENCE: JSON 의 confidence 가 이 값 미만이면 승격 (기본 0.5)
+"""
+
+import json, os, threading, time
+from collections import deque
+import indexer_path  # noqa: F401
+from bedrock_invoker import get_invoker
+
+REGION = os.getenv("AWS_REGION", "us-east-1")
+HAIKU  = "anthropic.claude-3-haiku-20240307-v1:0"
+SONNET = os.getenv("BEDROCK_LLM_ID", "anthropic.claude-3-sonnet-20240229-v1:0")
+
+ROUTES = {
+    "plan":    {"model": os.getenv("AGENT_PLAN_MODEL", HAIKU),
+                "max_tokens": int(os.getenv("AGENT_PLAN_MAX_TOKENS", "400"))},
+    "answer":  {"model": os.getenv("AGENT_ANSWER_MODEL", SONNET),
+                "max_tokens": int(os.getenv("AGENT_ANSWER_MAX_TOKENS", "500"))},
+    "observe": {"model": os.getenv("AGENT_OBSERVE_MODEL", HAIKU),
+                "max_tokens": int(os.getenv("AGENT_OBSERVE_MAX_TOKENS", "300"))},
+}
+ESCALATE_MODEL = os.getenv("AGENT_ESCALATE_MODEL", ROUTES["answer"]["model"])
+ESCALATE_CONFIDENCE = float(os.getenv("AGENT_ESCALATE_CONFIDENCE", "0.5"))
+
+br = get_invoker(REGION)
+
+_lock = threading.Lock()
+_stats = {}
+
+
+def payload(stage, prompt, temperature):
+    """단계 토큰 예산을 적용한 Messages API 요청 본문"""
+    return {
+        "anthropic_version": "bedrock-2023-05-31",
+        "max_tokens": ROUTES[stage]["max_tokens"],
+        "temperature": temperature,
+        "messages": [{"role": "user", "content": [{"type": "text", "text": prompt}]}],
+    }
+
+
+def record(stage, model, ms, usage=None, key=None):
+    """단계/모델별 호출 1회 기록. key: 추가로 셀 카운터 (escalations, parse_failures, low_confidence)"""
+    usage = usage or {}
+    with _lock:
+        st = _stats.setdefault(stage, {"calls": 0, "escalations": 0, "parse_failures": 0, "low_confidence": 0,
+                                       "input_tokens": 0, "output_tokens": 0, "models": {},
+                                       "latency": deque(maxlen=1000)})
+        if key:
+            st[key] += 1
+        if model is None:
+            return
+        st["calls"] += 1
+        st["models"][model] = st["models"].get(model, 0) + 1
+        st["input_tokens"] += usage.get("input_tokens") or 0
+        st["output_tokens"] += usage.get("output_tokens") or 0
+        st["latency"].append(ms)
+
+
+def invoke(stage, body, model=None):
+    """route 모델(또는 model)로 invoke_model. 반환: (text, usage, model)"""
+    model = model or ROUTES[stage]["model"]
+    t = time.perf_counter()
+    res = br.invoke_model(modelId=model, contentType="application/json", accept="application/json",
+                          body=json.dumps(body))
+    out = json.loads(res["body"].read().decode("utf-8"))
+    usage = out.get("usage") or {}
+    record(stage, model, (time.perf_counter() - t) * 1000, usage)
+    return "".join(p.get("text", "") for p in out.get("content", []) if p.get("type") == "text"), usage, model
+
+
+def invoke_json(stage, prompt, temperature=0.2, check=None):
+    """
+    JSON 단계 호출. 싼 모델 결과가 JSON 이 아니거나 check(obj) 가 False 이거나
+    confidence < ESCALATE_CONFIDENCE 면 ESCALATE_MODEL 로 한 번 더 호출한다.
+    반환: (obj 또는 None, 마지막 응답 text)
+    """
+    body = payload(stage, prompt, temperature)
+    models = [ROUTES[stage]["model"]]
+    if ESCALATE_MODEL != models[0]:
+        models.append(ESCALATE_MODEL)
+    txt = ""
+    for n, model in enumerate(models):
+        if n:
+            record(stage, None, 0, key="escalations")
+        txt, _, _ = invoke(stage, body, model)
+        try:
+            obj = json.loads(txt)
+        except ValueError:
+            record(stage, None, 0, key="parse_failures")
+            continue
+        conf = obj.get("confidence") if isinstance(obj, dict) else None
+        if (check is not None and not check(obj)) or (isinstance(conf, (int, float)) and conf < ESCALATE_CONFIDENCE):
+            record(stage, None, 0, key="low_confidence")
+            if n + 1 < len(models):
+                continue
+        return obj, txt
+    return None, txt
+
+
+def _pct(values, p):
+    if not values:
+        return None
+    s = sorted(values)
+    return round(s[min(len(s) - 1, int(len(s) * p))], 1)
+
+
+def stats():
+    with _lock:
+        return {stage: dict({k: v for k, v in st.items() if k != "latency"}, models=dict(st["models"]),
+                            p50_ms=_pct(list(st["latency"]), 0.5), p95_ms=_pct(list(st["latency"]), 0.95))
+                for stage, st in _stats.items()}
+
+
+def log(prefix="[ROUTER]", file=None):
+    for stage, s in stats().items():
+        print(f"{prefix} {stage} {s}", file=file)
@@ -1,10 +1,21 @@
 # file: aoss_index_docs.py
 import os, json, boto3, uuid
 from opensearchpy import OpenSearch, RequestsHttpConnection, AWSV4SignerAuth
+import indexer_path  # noqa: F401
+from aoss_bulk import BulkWriter
+from embed_cache import EmbeddingCache, SQLiteCache
+from bedrock_invoker import get_invoker
+from embed_parallel import EmbedProgress, embed_ordered
 
 region = "us-east-1"
 host = os.environ.get("AOSS_HOST")  # e.g. iwvt29rkcwesncyf8sw8.us-east-1.aoss.amazonaws.com
 index_name = "kb-rag"
+embed_model = "amazon.titan-embed-text-v1"
+# 동시 임베딩 수 (Titan 호출은 대부분 네트워크 대기)
+embed_concurrency = int(os.getenv("EMBED_CONCURRENCY", "8"))
+
+# 같은 문서 재색인 시 Bedrock 호출을 건너뛰는 로컬 임베딩 캐시
+cache = EmbeddingCache([SQLiteCache(os.getenv("EMBED_CACHE_PATH", ".embed_cache.sqlite"))], embed_model, 1536)
 
 # AWS SigV4 인증
 session = boto3.Session()
@@ -21,10 +32,9 @@ client = OpenSearch(
 )
 
 # Bedrock embed
-def embed_text(text: str):
-    br = boto3.client("bedrock-runtime", region_name=region)
-    resp = br.invoke_model(
-        modelId="amazon.titan-embed-text-v1",
+def _embed_raw(text: str):
+    resp = get_invoker(region).invoke_model(
+        modelId=embed_model,
         contentType="application/json",
         accept="application/json",
         body=json.dumps({"inputText": text})
@@ -32,15 +42,31 @@ def embed_text(text: str):
     out = json.loads(resp["body"].read())
     return out["embedding"]
 
-def index_documents(docs):
-    for text in docs:
-        vec = embed_text(text)
-        body = {
-            "text": text,
-            "embedding": vec
-        }
-        resp = client.index(index=index_name, body=body)
-        print(f"Indexed text='{text[:20]}...', result={resp['result']}")
+def embed_text(text: str):
+    return cache.get_or_embed(text, _embed_raw)
+
+def index_documents(docs, max_docs=200, max_bytes=5 * 1024 * 1024, concurrency=embed_concurrency):
+    # 문서마다 client.index 를 부르는 대신 _bulk 로 모아서 전송
+    # 임베딩은 concurrency 개씩 동시에, 끝난 묶음은 입력 순서대로 바로 writer 로 흘려보낸다
+    docs = list(docs)
+    get_invoker(region).tune(embed_model, concurrency)  # 호출기 동시성/초기 속도를 concurrency 에 맞춤
+    progress = EmbedProgress(total=len(docs))
+    with BulkWriter(lambda body: client.bulk(body=body), index_name,
+                    max_docs=max_docs, max_bytes=max_bytes) as writer:
+        for start, vecs in embed_ordered(docs, embed_text, concurrency, batch_size=max_docs, progress=progress):
+            for text, vec in zip(docs[start:start + len(vecs)], vecs):
+                body = {
+                    "text": text,
+                    "embedding": vec
+                }
+                writer.add(body)
+            print(f"Queued {start + len(vecs)}/{len(docs)} docs")
+    print(f"Bulk result: {writer.stats}")
+    cache.log()
+    get_invoker(region).log()
+    for f in writer.failed:
+        print(f"Failed: {f}")
+    return writer.failed
 
 if __name__ == "__main__":
     # 데모용 문서
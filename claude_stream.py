@@ -0,0 +1,63 @@
+# file: claude_stream.py
+"""
+Claude 답변 스트리밍 (Bedrock invoke_model_with_response_stream)
+
+답변 전체를 기다리지 않고 텍스트 조각(delta)을 받는 대로 CLI / kb_server 로 흘려보낸다.
+끝나면 전체 답변, usage, 첫 토큰까지 시간(ttft_ms)과 전체 생성 시간(total_ms)을 따로 남긴다.
+
+    result = {}
+    for delta in stream_text(br, LLM_ID, payload, result):
+        print(delta, end="", flush=True)
+    result  # {"text", "usage": {"input_tokens", "output_tokens"}, "stop_reason", "ttft_ms", "total_ms"}
+
+br 는 bedrock_invoker 호출기 또는 boto3 bedrock-runtime 클라이언트.
+"""
+
+import json, time
+
+
+def stream_text(br, model_id, payload, result=None):
+    """text delta 를 yield. 다 읽으면 result 에 최종 답변/usage/시간을 채운다"""
+    result = {} if result is None else result
+    t0 = time.perf_counter()
+    res = br.invoke_model_with_response_stream(modelId=model_id, contentType="application/json",
+                                               accept="application/json", body=json.dumps(payload))
+    parts, usage, stop_reason, ttft = [], {}, None, None
+    for event in res["body"]:
+        chunk = event.get("chunk")
+        if chunk is None:
+            # internalServerException / modelStreamErrorException / throttlingException ...
+            raise RuntimeError(f"Bedrock stream error: {event}")
+        ev = json.loads(chunk["bytes"])
+        kind = ev.get("type")
+        if kind == "message_start":
+            usage["input_tokens"] = ev["message"].get("usage", {}).get("input_tokens")
+        elif kind == "content_block_delta" and ev["delta"].get("type") == "text_delta":
+            text = ev["delta"].get("text", "")
+            if text:
+                if ttft is None:
+                    ttft = time.perf_counter() - t0
+                parts.append(text)
+                yield text
+        elif kind == "message_delta":
+            stop_reason = ev.get("delta", {}).get("stop_reason")
+            usage["output_tokens"] = ev.get("usage", {}).get("output_tokens")
+        elif kind == "message_stop":
+            # Bedrock 이 마지막 이벤트에 붙여 주는 집계 (message_start/delta 에 usage 가 없을 때 대비)
+            m = ev.get("amazon-bedrock-invocationMetrics") or {}
+            if usage.get("input_tokens") is None:
+                usage["input_tokens"] = m.get("inputTokenCount")
+            if usage.get("output_tokens") is None:
+                usage["output_tokens"] = m.get("outputTokenCount")
+    result.update(text="".join(parts), usage=usage, stop_reason=stop_reason,
+                  ttft_ms=round(ttft * 1000, 1) if ttft is not None else None,
+                  total_ms=round((time.perf_counter() - t0) * 1000, 1))
+
+
+def complete(br, model_id, payload, on_delta=None):
+    """스트림을 끝까지 읽고 stream_text 의 result 를 반환. on_delta(text) 는 조각마다 호출"""
+    result = {}
+    for delta in stream_text(br, model_id, payload, result):
+        if on_delta is not None:
+            on_delta(delta)
+    return result
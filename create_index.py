@@ -1,5 +1,6 @@
-import argparse, json, requests, boto3
-from requests_aws4auth import AWS4Auth
+import argparse, boto3
+import indexer_path  # noqa: F401
+from aoss_transport import AOSSTransport
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--endpoint", required=True)         # e.g. https://iwvt29rkcwesncyf8sw8.us-east-1.aoss.amazonaws.com
@@ -10,26 +11,23 @@ parser.add_argument("--dim", type=int, default=1536)     # Titan v2 = 1536
 args = parser.parse_args()
 
 session = boto3.Session(region_name=args.region)
-creds = session.get_credentials().get_frozen_credentials()
-awsauth = AWS4Auth(creds.access_key, creds.secret_key, args.region, "aoss", session_token=creds.token)
+aoss = AOSSTransport(args.endpoint, args.collection, region=args.region, session=session)
 
-url = f"{args.endpoint.rstrip('/')}/{args.index}"
 payload = {
     "mappings": {
         "properties": {
             "id": {"type": "keyword"},
+            "parent_id": {"type": "keyword"},
+            "chunk_no": {"type": "integer"},
+            "chunk_start": {"type": "integer"},
+            "chunk_end": {"type": "integer"},
             "content": {"type": "text"},
             "embedding": {"type": "knn_vector", "dimension": args.dim}
         }
     }
 }
 
-r = requests.put(
-    url,
-    auth=awsauth,
-    headers={"Content-Type": "application/json", "x-amz-collection-name": args.collection},
-    data=json.dumps(payload),
-)
+r = aoss.put(f"/{args.index}", data=payload)
 print(r.status_code, r.text)
 r.raise_for_status()
 print("Index created or already exists.")
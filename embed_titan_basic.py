@@ -1,10 +1,12 @@
 # file: embed_titan_basic.py
-import json, boto3
+import json
+import indexer_path  # noqa: F401
+from bedrock_invoker import get_invoker
 
 REGION   = "us-east-1"
 MODEL_ID = "amazon.titan-embed-text-v1"   # list-foundation-models 로 확인해도 됨
 
-br = boto3.client("bedrock-runtime", region_name=REGION)
+br = get_invoker(REGION)
 
 def embed(text: str):
     payload = {"inputText": text}
@@ -1,33 +1,294 @@
-import json, faiss, boto3
+import os, json, argparse, time, faiss
 import numpy as np
+import indexer_path  # noqa: F401
+from embed_cache import EmbeddingCache, SQLiteCache
+from bedrock_invoker import get_invoker
+from embed_parallel import EmbedProgress, embed_ordered
+from text_decode import detect_encoding
+from kb_store import (VectorStore, new_index, rebuild_index, publish_index, publish_generation, write_meta,
+                      read_info, apply_search_params, sample_vectors, is_manifest)
+from kb_shards import build_shards, read_manifest, remove_shard_dir
+from kb_filter import ATTR_KEYS, default_attrs, write_attrs
+from kb_lexical import write_lexical
 
 REGION = "us-east-1"
 EMBED_MODEL = "amazon.titan-embed-text-v1"
-br = boto3.client("bedrock-runtime", region_name=REGION)
+EMBED_DIM = 1536
+# 동시 임베딩 수 / 저장소·인덱스에 한 번에 반영할 묶음 크기
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "8"))
+EMBED_BATCH = int(os.getenv("EMBED_BATCH", "256"))
+br = get_invoker(REGION)
 
-def embed(t:str):
+# 내용이 바뀌지 않은 문서는 재임베딩하지 않도록 로컬 SQLite 캐시 사용
+cache = EmbeddingCache([SQLiteCache(os.getenv("EMBED_CACHE_PATH", ".embed_cache.sqlite"))], EMBED_MODEL, EMBED_DIM)
+
+def _embed_raw(t:str):
     body={"inputText":t}
     r=br.invoke_model(modelId=EMBED_MODEL,contentType="application/json",accept="application/json",body=json.dumps(body))
-    return np.array(json.loads(r["body"].read().decode())["embedding"], dtype="float32")
+    return json.loads(r["body"].read().decode())["embedding"]
+
+def embed(t:str):
+    return np.array(cache.get_or_embed(t, _embed_raw), dtype="float32")
 
-# ▶ 여기에 본인 문서들 계속 추가
+def embed_batches(todo, concurrency=EMBED_CONCURRENCY, batch_size=EMBED_BATCH):
+    """
+    todo [(doc_id, text, hash)] 를 병렬 임베딩해 입력 순서대로 (todo 묶음, 정규화된 float32 행렬) 을 yield.
+    진행률/처리량(docs/s, p95)은 [EMBED] 로 출력.
+    """
+    if not todo:
+        return
+    br.tune(EMBED_MODEL, concurrency)  # 호출기 동시성/초기 속도를 요청한 동시성에 맞춤 (이후 스로틀에 따라 AIMD)
+    progress = EmbedProgress(total=len(todo))
+    for start, vecs in embed_ordered([t for _, t, _ in todo], embed, concurrency, batch_size, progress):
+        x = np.vstack(vecs).astype("float32")
+        x /= np.linalg.norm(x, axis=1, keepdims=True) + 1e-12  # 코사인 유사도 = 내적용 정규화
+        yield todo[start:start + len(vecs)], x
+
+# ▶ 여기에 본인 문서들 계속 추가 (--source 를 주지 않으면 이 목록으로 빌드)
 docs = [
   ("doc1","Agentic AI는 Plan-Act-Observe 루프를 따른다."),
   ("doc2","AWS RAG는 Titan Embeddings와 OpenSearch Serverless를 함께 사용하면 좋다."),
   ("doc3","EKS는 LLM 서빙/에이전트 마이크로서비스 운영에 적합하다."),
 ]
 
-vecs = [embed(t) for _,t in docs]
-dim  = vecs[0].shape[0]
-xb   = np.vstack(vecs)
+def load_source(source=None):
+    """
+    문서 목록 [(doc_id, text, attrs)]
+      - None: 위 docs
+      - *.jsonl: 줄마다 {"doc_id": .., "text": .., "source"/"doc_type"/"timestamp"/"tenant": ..(선택)}
+      - 디렉터리: 하위 .txt/.md 파일 (doc_id = 상대 경로, source = 상대 디렉터리, doc_type = 확장자,
+        timestamp = 수정 시각)
+    attrs 에 source 가 없으면 doc_id 의 디렉터리 부분 (kb_filter.default_attrs)
+    """
+    if not source:
+        return [(d, t, default_attrs(d)) for d, t in docs]
+    if os.path.isdir(source):
+        out = []
+        for root, _, files in os.walk(source):
+            for name in sorted(files):
+                if not name.lower().endswith((".txt", ".md")):
+                    continue
+                path = os.path.join(root, name)
+                data = open(path, "rb").read()
+                enc, _ = detect_encoding(data)
+                doc_id = os.path.relpath(path, source).replace(os.sep, "/")
+                attrs = {"doc_type": os.path.splitext(name)[1][1:].lower(), "timestamp": int(os.path.getmtime(path))}
+                out.append((doc_id, data.decode(enc, errors="ignore"), default_attrs(doc_id, attrs)))
+        return out
+    out = []
+    with open(source, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                item = json.loads(line)
+                doc_id = str(item.get("doc_id") or item["id"])
+                out.append((doc_id, item["text"], default_attrs(doc_id, {k: item.get(k) for k in ATTR_KEYS})))
+    return out
+
+def _open_index(path, store, factory):
+    """기존 인덱스가 저장소/factory 와 맞으면 재사용, 아니면 None (→ 저장소로 재구성)"""
+    if not os.path.exists(path):
+        return None
+    if is_manifest(path):
+        print(f"[BUILD] {path} is a shard manifest, rebuilding as a single index")
+        return None
+    index = faiss.read_index(path)
+    if read_info(path).get("factory", "Flat") != factory:
+        print(f"[BUILD] {path} was built with a different factory, rebuilding as {factory}")
+        return None
+    if not isinstance(index, faiss.IndexIDMap2) or index.d != store.dim or index.ntotal != store.count():
+        print(f"[BUILD] {path} does not match the store (type/dim/ntotal), rebuilding from stored vectors")
+        return None
+    return index
+
+def _percentile_ms(values, p):
+    return round(float(np.percentile(values, p)) * 1000, 3) if len(values) else None
+
+def evaluate(index, store, k=10, n_queries=200, seed=0):
+    """
+    exact flat 검색 대비 recall@k, 단건 검색 p50/p99 지연, 디스크/메모리 크기.
+    메모리 크기는 직렬화 크기 + IndexIDMap2 역방향 맵(항목당 약 16B) 추정치.
+    질의 = 저장된 벡터 표본 + 작은 잡음 (자기 자신만 맞히는 평가가 되지 않도록)
+    """
+    xq = sample_vectors(store, n_queries, seed=seed)
+    if not len(xq):
+        return {}
+    xq = xq + np.random.default_rng(seed).normal(0, 0.01, xq.shape).astype("float32")
+    faiss.normalize_L2(xq)
+    exact = rebuild_index(store, new_index(store.dim, "Flat"))
+    _, gt = exact.search(xq, k)
+    _, got = index.search(xq, k)
+    hits = sum(len(set(g[g >= 0]) & set(a[a >= 0])) for g, a in zip(gt, got))
+    total = int((gt >= 0).sum())
+    lat = []
+    for i in range(len(xq)):
+        t = time.perf_counter()
+        index.search(xq[i:i + 1], k)
+        lat.append(time.perf_counter() - t)
+    blob = faiss.serialize_index(index)
+    return {
+        f"recall@{k}": round(hits / total, 4) if total else None,
+        "queries": len(xq),
+        "p50_ms": _percentile_ms(lat, 50),
+        "p99_ms": _percentile_ms(lat, 99),
+        "disk_bytes": int(blob.size),
+        "ram_bytes_est": int(blob.size) + 16 * int(index.ntotal),
+        "flat_disk_bytes": int(faiss.serialize_index(exact).size),
+    }
+
+def build(source=None, full=False, store_path="kb_store.sqlite", index_path="kb.index", meta_path="kb_meta.jsonl",
+          factory="Flat", search_params=None, train_size=100000, report=False, k=10, attrs_path="kb_attrs.npz",
+          lexical_path="kb_lexical.npz", shard_size=None, workers=None,
+          embed_concurrency=EMBED_CONCURRENCY, embed_batch=EMBED_BATCH):
+    t0 = time.perf_counter()
+    items = load_source(source)
+    store = VectorStore(store_path, EMBED_DIM)
+    known = store.rows()
+    known_attrs = store.attrs()
+    current, attrs = {}, {}
+    for doc_id, text, a in items:
+        current[doc_id] = (text, cache.key(text))  # 콘텐츠 해시 (정규화 텍스트 + 모델 + 차원)
+        attrs[doc_id] = a
+
+    todo = [(d, t, h) for d, (t, h) in current.items() if full or known.get(d, (None, None))[1] != h]
+    gone = [d for d in known if d not in current]
+    # 텍스트는 같고 속성만 바뀐 문서: 재임베딩/인덱스 변경 없이 속성 테이블만 갱신
+    todo_ids = {d for d, _, _ in todo}
+    retagged = [d for d in current if d in known and d not in todo_ids and known_attrs.get(d) != attrs[d]]
+    changed_ids = [known[d][0] for d, _, _ in todo if d in known]
+    batches = embed_batches(todo, embed_concurrency, embed_batch)
+
+    if shard_size:
+        return _build_sharded(store, store_path, index_path, meta_path, attrs_path, lexical_path, factory,
+                              search_params, train_size, shard_size, workers, full, report,
+                              todo, batches, attrs, retagged, gone, changed_ids, len(current), t0)
+
+    index = None if full else _open_index(index_path, store, factory)
+    # 검색 파라미터는 명시하지 않으면 이전 빌드 값을 유지
+    params = dict(read_info(index_path).get("search_params") or {}) if index is not None else {}
+    params.update(search_params or {})
+    if index is not None and not todo and not gone and not retagged and not search_params and not report \
+            and os.path.exists(attrs_path) and os.path.exists(lexical_path):
+        print(f"[BUILD] docs={len(current)} unchanged, {index_path} is up to date")
+        return index
+    try:
+        for d in retagged:
+            store.set_attrs(d, attrs[d])
+        removed = store.delete(gone)
+        stale = changed_ids + removed
+        if index is not None and stale:
+            try:
+                index.remove_ids(np.array(stale, dtype="int64"))
+            except RuntimeError:
+                # HNSW 등 삭제를 지원하지 않는 인덱스는 저장소로 재구성
+                print(f"[BUILD] {factory} does not support remove_ids, rebuilding from stored vectors")
+                index = None
+        # 임베딩 묶음이 끝나는 대로 저장소/인덱스에 반영. Bedrock 오류 시 rollback 되고
+        # 인덱스는 게시 전이므로 버려진다 (이미 받은 임베딩은 캐시에 남아 다음 빌드에서 재사용)
+        for rows, vecs in batches:
+            ids = [store.upsert(d, h, t, v, attrs[d]) for (d, t, h), v in zip(rows, vecs)]
+            if index is not None:
+                index.add_with_ids(vecs, np.array(ids, dtype="int64"))
+        if index is None:
+            index = rebuild_index(store, new_index(EMBED_DIM, factory), train_size)
+        apply_search_params(index, params)
+        info = {"factory": factory, "metric": "inner_product", "dim": EMBED_DIM,
+                "ntotal": int(index.ntotal), "search_params": params}
+        if report:
+            info["report"] = evaluate(index, store, k=k)
+            print(f"[REPORT] {factory} {json.dumps(info['report'])}")
+        publish_index(index, index_path, info)
+        write_meta(store, meta_path)
+        write_attrs(store, attrs_path)
+        write_lexical(store, lexical_path)
+        publish_generation(index_path)
+        store.commit()
+    except Exception:
+        store.rollback()
+        raise
+    # 샤드 → 단일로 바꾼 경우 남은 샤드 파일 정리
+    remove_shard_dir(index_path)
+
+    cache.log()
+    br.log()
+    print(f"[BUILD] docs={len(current)} embedded={len(todo)} (changed={len(changed_ids)}) "
+          f"deleted={len(gone)} retagged={len(retagged)} ntotal={index.ntotal} in {time.perf_counter() - t0:.2f}s")
+    print(f"saved: {index_path}, {meta_path}, {attrs_path}, {lexical_path}")
+    return index
+
+def _build_sharded(store, store_path, index_path, meta_path, attrs_path, lexical_path, factory, search_params,
+                   train_size, shard_size, workers, full, report, todo, batches, attrs, retagged, gone, changed_ids,
+                   n_docs, t0):
+    """
+    샤드 모드 (kb_shards): 저장소를 먼저 커밋한 뒤 바뀐 샤드만 프로세스 풀에서 다시 만든다.
+    샤드 작업 프로세스가 저장소를 직접 읽으므로 커밋이 먼저이고,
+    중간에 실패해도 다음 빌드에서 체크섬이 다른 샤드가 다시 만들어진다.
+    """
+    try:
+        for rows, vecs in batches:
+            for (d, t, h), v in zip(rows, vecs):
+                store.upsert(d, h, t, v, attrs[d])
+        for d in retagged:
+            store.set_attrs(d, attrs[d])
+        store.delete(gone)
+        store.commit()
+    except Exception:
+        store.rollback()
+        raise
+    if report:
+        print("[BUILD] --report is not supported for sharded indexes, skipped")
+    params = dict((read_manifest(index_path) or {}).get("search_params") or {})
+    params.update(search_params or {})
+    manifest, rebuilt = build_shards(store_path, index_path, EMBED_DIM, factory, params, shard_size, train_size,
+                                     workers, full)
+    if not (todo or gone or retagged or rebuilt or search_params) \
+            and os.path.exists(attrs_path) and os.path.exists(lexical_path):
+        print(f"[BUILD] docs={n_docs} unchanged, {index_path} is up to date")
+        return manifest
+    write_meta(store, meta_path)
+    write_attrs(store, attrs_path)
+    write_lexical(store, lexical_path)
+    publish_generation(index_path)
 
-# 코사인 유사도 = 내적용 → 벡터 정규화
-xb = xb / (np.linalg.norm(xb, axis=1, keepdims=True) + 1e-12)
+    cache.log()
+    br.log()
+    print(f"[BUILD] docs={n_docs} embedded={len(todo)} (changed={len(changed_ids)}) deleted={len(gone)} "
+          f"retagged={len(retagged)} shards={len(manifest['shards'])} rebuilt={len(rebuilt)} "
+          f"ntotal={manifest['ntotal']} in {time.perf_counter() - t0:.2f}s")
+    print(f"saved: {index_path} (manifest), {meta_path}, {attrs_path}, {lexical_path}")
+    return manifest
 
-index = faiss.IndexFlatIP(dim)     # 내적
-index.add(xb)
+def main():
+    ap = argparse.ArgumentParser(description="FAISS 인덱스 (증분) 빌드")
+    ap.add_argument("--source", help="문서 소스: .jsonl 파일 또는 .txt/.md 디렉터리 (기본: 코드 내 docs)")
+    ap.add_argument("--full", action="store_true", help="저장소/인덱스를 무시하고 전체 재임베딩")
+    ap.add_argument("--store", default="kb_store.sqlite")
+    ap.add_argument("--index", default="kb.index")
+    ap.add_argument("--meta", default="kb_meta.jsonl")
+    ap.add_argument("--attrs", default="kb_attrs.npz", help="필터 검색용 속성 테이블")
+    ap.add_argument("--lexical", default="kb_lexical.npz", help="하이브리드 검색용 BM25 색인")
+    ap.add_argument("--index-factory", default="Flat",
+                    help="faiss index_factory 문자열: Flat, HNSW32, IVF1024,Flat, IVF1024,PQ64, SQ8, OPQ64,IVF1024,PQ64")
+    ap.add_argument("--nprobe", type=int, help="IVF 검색 시 조회할 리스트 수 (kb.index.json 에 기록)")
+    ap.add_argument("--ef-search", type=int, help="HNSW 검색 폭 (kb.index.json 에 기록)")
+    ap.add_argument("--train-size", type=int, default=100000, help="IVF/PQ 학습 표본 수")
+    ap.add_argument("--report", action="store_true", help="exact 검색 대비 recall@k / 지연 / 크기 리포트")
+    ap.add_argument("--k", type=int, default=10, help="리포트의 recall@k")
+    ap.add_argument("--shard-size", type=int,
+                    help="저장소 id 구간 크기별로 샤드 인덱스를 만든다 (kb.index 는 매니페스트가 됨, kb_shards.py)")
+    ap.add_argument("--workers", type=int, help="샤드 동시 빌드 프로세스 수 (기본: CPU 수)")
+    ap.add_argument("--embed-concurrency", type=int, default=EMBED_CONCURRENCY, help="동시 Titan 임베딩 호출 수")
+    ap.add_argument("--embed-batch", type=int, default=EMBED_BATCH, help="저장소/인덱스에 한 번에 반영할 문서 수")
+    args = ap.parse_args()
+    params = {}
+    if args.nprobe:
+        params["nprobe"] = args.nprobe
+    if args.ef_search:
+        params["efSearch"] = args.ef_search
+    build(args.source, args.full, args.store, args.index, args.meta,
+          factory=args.index_factory, search_params=params, train_size=args.train_size,
+          report=args.report, k=args.k, attrs_path=args.attrs,
+          lexical_path=args.lexical, shard_size=args.shard_size, workers=args.workers,
+          embed_concurrency=args.embed_concurrency, embed_batch=args.embed_batch)
 
-faiss.write_index(index, "kb.index")
-with open("kb_meta.json","w",encoding="utf-8") as f:
-    json.dump(docs, f, ensure_ascii=False)
-print("saved: kb.index, kb_meta.json")
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,19 @@
 # file: faiss_query.py
-import json, math, argparse
+import json, math, argparse, os, sys, time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import numpy as np
-import faiss, boto3
+import indexer_path  # noqa: F401
+from bedrock_invoker import get_invoker
+from kb_store import load_meta, read_index
+from kb_filter import add_filter_args, filtered_search, load_attrs, where_from_args
+import kb_lexical
+import claude_stream
 
 REGION = "us-east-1"
 EMBED_MODEL = "amazon.titan-embed-text-v1"
 LLM_MODEL   = "anthropic.claude-3-sonnet-20240229-v1:0"
 
-br = boto3.client("bedrock-runtime", region_name=REGION)
+br = get_invoker(REGION)
 
 def _norm(v: np.ndarray) -> np.ndarray:
     return v / (np.linalg.norm(v) + 1e-12)
@@ -24,25 +30,48 @@ def embed(text: str) -> np.ndarray:
     return _norm(v)
 
 def load_index():
-    index = faiss.read_index("kb.index")
-    docs  = json.load(open("kb_meta.json", encoding="utf-8"))
+    index = read_index("kb.index")  # kb.index.json 의 nprobe/efSearch 적용
+    docs  = load_meta("kb_meta.jsonl")  # {FAISS id: {"id","doc_id","text"}}, top-k 만 디코딩
     return index, docs
 
-def retrieve(index, docs, query: str, k: int, min_score: float):
-    qv = embed(query).reshape(1, -1)
-    # FAISS IndexFlatIP 이므로 입력도 정규화된 벡터여야 코사인 유사도와 동일
-    D, I = index.search(qv, k)
+def _hits(docs, scores, ids, min_score):
     out = []
-    for score, idx in zip(D[0].tolist(), I[0].tolist()):
+    for score, idx in zip(scores.tolist(), ids.tolist()):
         if idx == -1:  # 검색 결과 부족 시
             continue
-        if score < min_score:
+        if score < min_score or idx not in docs:
             continue
-        doc_id, text = docs[idx][0], docs[idx][1]
+        doc_id, text = docs[idx]["doc_id"], docs[idx]["text"]
         out.append({"score": float(score), "doc_id": doc_id, "text": text})
     return out
 
-def ask_with_context(question: str, contexts: list[dict]) -> dict:
+def _fused_hits(docs, fused, min_score):
+    """하이브리드 결과: BM25 로 잡힌 문서는 코사인 점수가 낮아도 남긴다. score = RRF 점수"""
+    out = []
+    for h in fused:
+        vs = h["vector_score"]
+        if h["id"] not in docs or (h["bm25_score"] is None and (vs is None or vs < min_score)):
+            continue
+        d = docs[h["id"]]
+        out.append({"score": h["score"], "doc_id": d["doc_id"], "text": d["text"],
+                    "vector_score": vs, "bm25_score": h["bm25_score"]})
+    return out
+
+def retrieve(index, docs, query: str, k: int, min_score: float, where=None, attrs=None, lexical=None):
+    if lexical is not None:
+        # 하이브리드: BM25 를 먼저 띄워 두고 (질의 임베딩과 겹침) 벡터 검색과 RRF 로 융합
+        ids = attrs.eligible_ids(where) if where and attrs is not None else None
+        fused = kb_lexical.hybrid_search(
+            lambda n: filtered_search(index, attrs, embed(query).reshape(1, -1), n, where), lexical, query, k, ids)
+        return _fused_hits(docs, fused, min_score)
+    qv = embed(query).reshape(1, -1)
+    # FAISS IndexFlatIP 이므로 입력도 정규화된 벡터여야 코사인 유사도와 동일
+    # where: 속성 필터 (kb_filter). 조건에 맞는 문서만 FAISS 안에서 검색
+    D, I = filtered_search(index, attrs, qv, k, where)
+    return _hits(docs, D[0], I[0], min_score)
+
+def ask_with_context(question: str, contexts: list[dict], on_delta=None) -> dict:
+    """on_delta(text) 를 주면 스트리밍으로 생성하며 조각마다 호출하고 timing(ttft_ms, generate_ms)을 붙인다"""
     ctx_block = "\n\n".join(f"[{i+1}] {c['text']}" for i, c in enumerate(contexts))
     user_txt = (
         "아래 컨텍스트만 참고해서 질문에 답해줘. "
@@ -57,6 +86,15 @@ def ask_with_context(question: str, contexts: list[dict]) -> dict:
             {"role": "user", "content": [{"type": "text", "text": user_txt}]}
         ]
     }
+    if on_delta is not None:
+        res = claude_stream.complete(br, LLM_MODEL, payload, on_delta)
+        usage = res["usage"]
+        return {
+            "answer": res["text"].strip(),
+            "contexts": contexts,
+            "usage": {"input_tokens": usage.get("input_tokens"), "output_tokens": usage.get("output_tokens")},
+            "timing": {"ttft_ms": res["ttft_ms"], "generate_ms": res["total_ms"]},
+        }
     res = br.invoke_model(
         modelId=LLM_MODEL,
         contentType="application/json",
@@ -79,16 +117,160 @@ def ask_with_context(question: str, contexts: list[dict]) -> dict:
         "usage": {"input_tokens": usage.get("input_tokens"), "output_tokens": usage.get("output_tokens")}
     }
 
+def _read_questions(path):
+    with open(path, encoding="utf-8") as f:
+        for n, line in enumerate(f):
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            if isinstance(item, str):
+                item = {"question": item}
+            item.setdefault("id", n)
+            yield item
+
+def _batches(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _timed(fn, *args):
+    t = time.perf_counter()
+    out = fn(*args)
+    return out, round((time.perf_counter() - t) * 1000, 1)
+
+def _try_embed(question):
+    """반환: (벡터 또는 None, ms, 오류 또는 None)"""
+    t = time.perf_counter()
+    try:
+        vec, err = embed(question), None
+    except Exception as e:
+        vec, err = None, str(e)
+    return vec, round((time.perf_counter() - t) * 1000, 1), err
+
+def _emit(out, record):
+    out.write(json.dumps(record, ensure_ascii=False) + "\n")
+    out.flush()
+
+def run_batch(path, k=3, min_score=0.15, batch_size=32, workers=8, answer=False, answer_workers=4, out=sys.stdout,
+              where=None, hybrid=False):
+    """
+    questions.jsonl (줄마다 {"id":.., "question":..} 또는 문자열)을 인덱스 1회 로드로 처리.
+    배치마다 질의 임베딩은 동시에, 검색은 질의 행렬로 index.search 1회, 답변 생성은 answer_workers 개까지 동시에.
+    결과는 완료되는 대로 JSONL 로 출력 (각 줄에 단계별 ms).
+    hybrid=True 면 배치의 BM25 검색을 임베딩과 동시에 돌려 두고 행마다 RRF 로 융합.
+    """
+    t0 = time.perf_counter()
+    index, docs = load_index()
+    attrs = load_attrs() if where else None
+    lexical = kb_lexical.LexicalIndex.load() if hybrid else None
+    ids = attrs.eligible_ids(where) if where and attrs is not None else None
+    depth = kb_lexical.depth_for(k) if hybrid else k
+    load_ms = round((time.perf_counter() - t0) * 1000, 1)
+    n = 0
+    with ThreadPoolExecutor(workers) as embed_pool, ThreadPoolExecutor(answer_workers) as answer_pool:
+        for batch in _batches(_read_questions(path), batch_size):
+            lex = [kb_lexical.submit(lexical, it["question"], depth, ids) for it in batch] if hybrid else None
+            embedded = list(embed_pool.map(lambda it: _try_embed(it["question"]), batch))
+            # 임베딩에 실패한 질문은 오류 레코드로 내보내고 나머지만 검색 (하나 때문에 배치 전체를 잃지 않게)
+            for item, (_, embed_ms, err) in zip(batch, embedded):
+                if err is not None:
+                    _emit(out, {"id": item["id"], "question": item["question"], "error": f"embed: {err}",
+                                "timing": {"embed_ms": embed_ms}})
+            ok = [row for row, (_, _, err) in enumerate(embedded) if err is None]
+            n += len(batch)
+            if not ok:
+                continue
+            xq = np.vstack([embedded[row][0] for row in ok]).astype("float32")
+            (D, I), search_ms = _timed(filtered_search, index, attrs, xq, depth, where)
+            records = []
+            for r, row in enumerate(ok):
+                item, embed_ms = batch[row], embedded[row][1]
+                contexts = _fused_hits(docs, kb_lexical.fuse(D[r], I[r], lex[row].result(), k), min_score) \
+                    if hybrid else _hits(docs, D[r], I[r], min_score)
+                records.append({
+                    "id": item["id"],
+                    "question": item["question"],
+                    "contexts": contexts,
+                    # search_ms 는 배치 전체 1회 검색 시간 (batch_size 로 나누면 질의당)
+                    "timing": {"embed_ms": embed_ms, "search_ms": search_ms, "batch_size": len(ok)},
+                })
+            if answer:
+                futs = {answer_pool.submit(_timed, ask_with_context, r["question"], r["contexts"]): r
+                        for r in records if r["contexts"]}
+                for r in records:
+                    if not r["contexts"]:
+                        r["answer"] = "관련 컨텍스트가 없어 답변할 수 없습니다."
+                        _emit(out, r)
+                for fut in as_completed(futs):
+                    r = futs[fut]
+                    try:
+                        res, r["timing"]["answer_ms"] = fut.result()
+                        r["answer"], r["usage"] = res["answer"], res["usage"]
+                    except Exception as e:
+                        r["error"] = str(e)
+                    _emit(out, r)
+            else:
+                for r in records:
+                    _emit(out, r)
+    total = time.perf_counter() - t0
+    print(f"[BATCH] questions={n} load_ms={load_ms} total_s={total:.2f} qps={n / total if total else 0:.1f}", file=sys.stderr)
+    br.log(file=sys.stderr)  # stdout 은 JSONL 결과 전용
+
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("question", nargs="*", help="질문 문장")
     ap.add_argument("--k", type=int, default=3, help="Top-k 문맥 개수 (default: 3)")
     ap.add_argument("--min-score", type=float, default=0.15, help="코사인 유사도 임계값 (0~1, default: 0.15)")
+    ap.add_argument("--batch", help="questions.jsonl 일괄 처리 (결과는 stdout 에 JSONL)")
+    ap.add_argument("--batch-size", type=int, default=32, help="index.search 1회에 묶을 질의 수")
+    ap.add_argument("--workers", type=int, default=8, help="동시 임베딩 수")
+    ap.add_argument("--answer", action="store_true", help="--batch 에서 Claude 답변도 생성")
+    ap.add_argument("--answer-workers", type=int, default=4, help="동시 답변 생성 수")
+    ap.add_argument("--server", default=os.getenv("KB_SERVER"),
+                    help="kb_server.py 주소 (예: http://127.0.0.1:8765). 주면 인덱스를 직접 읽지 않고 데몬에 질의")
+    ap.add_argument("--hybrid", action="store_true",
+                    help="BM25(kb_lexical.npz) + 벡터 검색을 동시에 돌려 RRF 로 융합")
+    ap.add_argument("--stream", action="store_true",
+                    help="답변을 생성되는 대로 stderr 에 출력 (stdout 의 최종 JSON 은 그대로, timing 에 ttft_ms)")
+    add_filter_args(ap)
     args = ap.parse_args()
+    where = where_from_args(args)
+
+    if args.batch:
+        run_batch(args.batch, k=args.k, min_score=args.min_score, batch_size=args.batch_size,
+                  workers=args.workers, answer=args.answer, answer_workers=args.answer_workers, where=where,
+                  hybrid=args.hybrid)
+        return
 
     question = " ".join(args.question) if args.question else "Agentic AI 루프와 AWS 구현 요소를 요약해줘."
+    on_delta = (lambda d: print(d, end="", file=sys.stderr, flush=True)) if args.stream else None
+    if args.server:
+        from kb_server import call, call_stream
+        payload = {"question": question, "k": args.k, "min_score": args.min_score,
+                   "where": where, "hybrid": args.hybrid}
+        if not args.stream:
+            print(json.dumps(call(args.server, "/answer", payload), ensure_ascii=False))
+            return
+        for line in call_stream(args.server, "/answer", payload):
+            if "error" in line:
+                raise SystemExit(f"\n[SERVER] {line['error']}")
+            if "delta" in line:
+                on_delta(line["delta"])
+            elif line.get("done"):
+                line.pop("done")
+                print(file=sys.stderr)
+                print(json.dumps(line, ensure_ascii=False))
+        return
     index, docs = load_index()
-    hits = retrieve(index, docs, question, k=args.k, min_score=args.min_score)
+    hits = retrieve(index, docs, question, k=args.k, min_score=args.min_score,
+                    where=where, attrs=load_attrs() if where else None,
+                    lexical=kb_lexical.LexicalIndex.load() if args.hybrid else None)
 
     # 컨텍스트가 없을 때도 JSON으로 응답
     if not hits:
@@ -96,7 +278,9 @@ def main():
                           "contexts": [], "usage": None}, ensure_ascii=False))
         return
 
-    result = ask_with_context(question, hits)
+    result = ask_with_context(question, hits, on_delta)
+    if on_delta is not None:
+        print(file=sys.stderr)
     print(json.dumps(result, ensure_ascii=False))
 
 if __name__ == "__main__":
@@ -0,0 +1,10 @@
+# file: indexer_path.py
+# lambda/kb-rag-indexer/ 의 공용 모듈(aoss_bulk 등)을 로컬 CLI 스크립트에서도 import 할 수 있게 경로 추가
+# 사용: import indexer_path  # noqa: F401
+import os, sys
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "lambda", "kb-rag-indexer")
+
+# append: 로컬에 설치된 boto3/requests 가 Lambda 번들 복사본보다 우선하도록
+if LAMBDA_DIR not in sys.path:
+    sys.path.append(LAMBDA_DIR)
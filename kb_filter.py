@@ -0,0 +1,172 @@
+# file: kb_filter.py
+"""
+메타데이터 필터 검색 (로컬 FAISS)
+
+문서 속성(source, doc_type, timestamp, tenant)을 kb_attrs.npz 컬럼 테이블로 저장한다.
+  - 범주형 컬럼: 정렬된 사전 + int32 코드. 값 종류가 적으면(≤ BITMAP_MAX_VALUES) 값별 비트맵도 저장
+  - source 접두사 필터는 정렬된 사전에서 코드 구간으로 바꿔 비교
+  - timestamp: int64 epoch 초 (없으면 -1)
+필터에 맞는 id 를 id 공간 비트맵으로 만들어 faiss.IDSelectorBitmap + SearchParameters 로 검색에 넘기므로
+먼저 많이 뽑고 Python 에서 거르는 방식과 달리 조건에 맞는 문서만으로 top-k 를 채운다.
+근사 인덱스(IVF/HNSW)가 k 개를 못 채우면 탐색 폭을 최대로 늘려 한 번 더 검색한다.
+
+where 예: {"source_prefix": "docs/aws", "doc_type": ["md"], "tenant": "acme", "after": "2024-01-01", "before": 1735689600}
+"""
+
+import os, posixpath
+from datetime import datetime, timezone
+import numpy as np
+from vector_table import VectorTable
+
+ATTR_KEYS = ("source", "doc_type", "timestamp", "tenant")
+CATEGORICAL = ("source", "doc_type", "tenant")
+BITMAP_MAX_VALUES = 64
+
+
+def default_attrs(doc_id, attrs=None):
+    """source 가 없으면 doc_id 의 디렉터리 부분을 source 로"""
+    out = {k: v for k, v in (attrs or {}).items() if k in ATTR_KEYS and v is not None}
+    out.setdefault("source", posixpath.dirname(doc_id))
+    return out
+
+
+def parse_time(value):
+    """epoch 초(int/float) 또는 ISO 날짜/시각 문자열 → epoch 초, 없으면 -1"""
+    if value is None or value == "":
+        return -1
+    if isinstance(value, (int, float)):
+        return int(value)
+    dt = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp())
+
+
+def write_attrs(store, path="kb_attrs.npz"):
+    """VectorStore 의 속성을 id 순 컬럼 테이블로 저장 (임시 파일 → rename)"""
+    ids, rows = [], []
+    for i, attrs in store.iter_attrs():
+        ids.append(i)
+        rows.append(attrs)
+    cols = {"ids": np.array(ids, dtype="int64"),
+            "timestamp": np.array([parse_time(r.get("timestamp")) for r in rows], dtype="int64")}
+    for name in CATEGORICAL:
+        values = [str(r.get(name, "")) for r in rows]
+        vocab = sorted(set(values))
+        codes = np.searchsorted(np.array(vocab), np.array(values)).astype("int32") if values else np.zeros(0, "int32")
+        cols[f"{name}_vocab"] = np.array(vocab, dtype=str)
+        cols[f"{name}_codes"] = codes
+        if len(vocab) <= BITMAP_MAX_VALUES:
+            cols[f"{name}_bitmap"] = np.packbits(codes[None, :] == np.arange(len(vocab))[:, None], axis=1)
+    tmp = f"{path}.tmp.npz"
+    np.savez(tmp, **cols)
+    os.replace(tmp, path)
+
+
+class AttrTable:
+    def __init__(self, cols):
+        self.ids = cols["ids"]
+        self.timestamp = cols["timestamp"]
+        self.n = len(self.ids)
+        self.vocab = {c: list(cols[f"{c}_vocab"]) for c in CATEGORICAL}
+        self.codes = {c: cols[f"{c}_codes"] for c in CATEGORICAL}
+        self.bitmaps = {c: cols[f"{c}_bitmap"] for c in CATEGORICAL if f"{c}_bitmap" in cols}
+
+    @classmethod
+    def load(cls, path="kb_attrs.npz"):
+        with np.load(path) as z:
+            return cls({k: z[k] for k in z.files})
+
+    def _equals(self, col, values):
+        values = [values] if isinstance(values, str) else list(values)
+        codes = [self.vocab[col].index(v) for v in values if v in self.vocab[col]]
+        if col in self.bitmaps:
+            bits = np.zeros(self.bitmaps[col].shape[1], dtype="uint8")
+            for c in codes:
+                bits |= self.bitmaps[col][c]
+            return np.unpackbits(bits, count=self.n).astype(bool)
+        return np.isin(self.codes[col], codes)
+
+    def _prefix(self, col, prefix):
+        vocab = self.vocab[col]
+        lo = int(np.searchsorted(vocab, prefix, side="left"))
+        hi = int(np.searchsorted(vocab, prefix + "\U0010ffff", side="left"))
+        codes = self.codes[col]
+        return (codes >= lo) & (codes < hi)
+
+    def mask(self, where):
+        m = np.ones(self.n, dtype=bool)
+        if where.get("source_prefix") is not None:
+            m &= self._prefix("source", where["source_prefix"])
+        for col in ("source", "doc_type", "tenant"):
+            if where.get(col) is not None:
+                m &= self._equals(col, where[col])
+        if where.get("after") is not None:
+            m &= self.timestamp >= parse_time(where["after"])
+        if where.get("before") is not None:
+            m &= (self.timestamp >= 0) & (self.timestamp < parse_time(where["before"]))
+        return m
+
+    def eligible_ids(self, where):
+        return self.ids[self.mask(where)]
+
+
+def where_from_args(args):
+    """faiss_query 등 CLI 의 --prefix/--doc-type/--tenant/--after/--before → where (없으면 None)"""
+    where = {"source_prefix": args.prefix, "doc_type": args.doc_type, "tenant": args.tenant,
+             "after": args.after, "before": args.before}
+    where = {k: v for k, v in where.items() if v is not None}
+    return where or None
+
+
+def add_filter_args(ap):
+    ap.add_argument("--prefix", help="source 접두사 필터 (예: docs/aws)")
+    ap.add_argument("--doc-type", action="append", help="doc_type 필터 (여러 번 지정 = OR)")
+    ap.add_argument("--tenant", help="tenant 필터")
+    ap.add_argument("--after", help="timestamp >= (epoch 초 또는 ISO 날짜)")
+    ap.add_argument("--before", help="timestamp < (epoch 초 또는 ISO 날짜)")
+
+
+def load_attrs(path="kb_attrs.npz"):
+    return AttrTable.load(path) if os.path.exists(path) else None
+
+
+def _params(index, sel, exhaustive=False):
+    """인덱스 종류에 맞는 SearchParameters (kb.index.json 으로 적용된 nprobe/efSearch 유지)"""
+    import faiss
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    ivf = faiss.try_extract_index_ivf(inner)
+    if ivf is not None:
+        return faiss.SearchParametersIVF(sel=sel, nprobe=ivf.nlist if exhaustive else ivf.nprobe)
+    if isinstance(inner, faiss.IndexHNSW):
+        ef = inner.hnsw.efSearch
+        return faiss.SearchParametersHNSW(sel=sel, efSearch=max(ef * 8, 1024) if exhaustive else ef)
+    return faiss.SearchParameters(sel=sel)
+
+
+def filtered_search(index, attrs, xq, k, where=None):
+    """where 가 없으면 index.search 와 같다. 반환 (D, I)"""
+    xq = np.atleast_2d(np.asarray(xq, dtype="float32"))
+    if not where:
+        return index.search(xq, k)
+    if attrs is None:
+        raise RuntimeError("Filtered search needs kb_attrs.npz (rebuild with faiss_build.py)")
+    ids = attrs.eligible_ids(where)
+    if not len(ids):
+        return np.full((len(xq), k), -np.inf, "float32"), np.full((len(xq), k), -1, "int64")
+    if isinstance(index, VectorTable):  # faiss 미설치
+        return index.search(xq, k, ids=ids)
+    import faiss
+    bitmap = np.packbits(np.isin(np.arange(int(ids.max()) + 1), ids), bitorder="little")
+    sel = faiss.IDSelectorBitmap(bitmap.size, faiss.swig_ptr(bitmap))  # n = 바이트 수 (bitmap 은 검색이 끝날 때까지 유지)
+
+    def run(exhaustive=False):
+        if hasattr(index, "shards"):  # kb_shards.ShardedIndex: 샤드마다 같은 selector
+            return index.search(xq, k, params_fn=lambda shard: _params(shard, sel, exhaustive))
+        return index.search(xq, k, params=_params(index, sel, exhaustive))
+
+    D, I = run()
+    want = min(k, len(ids))
+    if ((I >= 0).sum(axis=1) < want).any():
+        D, I = run(exhaustive=True)
+    return D, I
@@ -0,0 +1,190 @@
+# file: kb_lexical.py
+"""
+로컬 BM25 역색인 (하이브리드 검색용 lexical 신호)
+
+Titan 벡터는 Lambda 이름, 에러 코드, 한국어 제품명 같은 정확한 식별자를 자주 놓친다.
+faiss_build.py 가 kb.index 옆에 kb_lexical.npz 를 만들고, 검색기는 벡터 검색과 BM25 를 동시에 돌려
+Reciprocal Rank Fusion(RRF) 으로 합친다.
+
+토크나이저 (tokenize)
+  - NFKC 정규화 + 소문자
+  - 영문/숫자 토큰은 통째로 (kb-rag-indexer, ThrottlingException, 429) + 구분자로 나눈 조각
+  - 한글 등 그 밖의 문자열은 글자 2-gram (조사가 붙어도 부분 일치) / 한 글자면 그대로
+
+색인 (kb_lexical.npz)
+  - terms: 용어의 64bit 해시 (정렬) → 문자열 사전 없이 searchsorted 로 조회
+  - offsets / rows / tfs: CSR 포스팅 (문서 행 int32, tf uint16)
+  - ids / lengths: 문서 행 → FAISS id, 토큰 수
+
+벤치마크: python kb_lexical.py --bench questions.jsonl  (벡터 단독 vs 하이브리드 검색 지연)
+"""
+
+import argparse, hashlib, os, re, time, unicodedata
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+K1, B = 1.2, 0.75
+RRF_K = 60
+_WORD = re.compile(r"[a-z0-9]+(?:[-_.:/][a-z0-9]+)*|[^\W\d_a-z]+")
+_PARTS = re.compile(r"[a-z0-9]+")
+_pool = None
+
+
+def tokenize(text):
+    out = []
+    for w in _WORD.findall(unicodedata.normalize("NFKC", text).lower()):
+        if w[0].isascii():
+            out.append(w)
+            parts = _PARTS.findall(w)
+            if len(parts) > 1:
+                out.extend(parts)
+        elif len(w) == 1:
+            out.append(w)
+        else:
+            out.extend(w[i:i + 2] for i in range(len(w) - 1))
+    return out
+
+
+def _term_hash(term):
+    return int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def write_lexical(store, path="kb_lexical.npz"):
+    """VectorStore 의 doc_id + 텍스트로 BM25 색인을 만들어 임시 파일 → rename"""
+    ids, lengths, hashes, rows, tfs = [], [], [], [], []
+    for row, (i, doc_id, text) in enumerate(store.iter_meta()):
+        counts = Counter(tokenize(f"{doc_id}\n{text}"))
+        ids.append(i)
+        lengths.append(sum(counts.values()))
+        for term, tf in counts.items():
+            hashes.append(_term_hash(term))
+            rows.append(row)
+            tfs.append(min(tf, 65535))
+    hashes = np.array(hashes, dtype="uint64")
+    order = np.argsort(hashes, kind="stable")  # 같은 용어 안에서는 문서 행 순서 유지
+    terms, starts = np.unique(hashes[order], return_index=True)
+    tmp = f"{path}.tmp.npz"
+    np.savez(tmp,
+             terms=terms,
+             offsets=np.append(starts, len(order)).astype("int64"),
+             rows=np.array(rows, dtype="int32")[order],
+             tfs=np.array(tfs, dtype="uint16")[order],
+             ids=np.array(ids, dtype="int64"),
+             lengths=np.array(lengths, dtype="int32"))
+    os.replace(tmp, path)
+
+
+class LexicalIndex:
+    def __init__(self, cols):
+        self.terms = cols["terms"]
+        self.offsets = cols["offsets"]
+        self.rows = cols["rows"]
+        self.tfs = cols["tfs"]
+        self.ids = cols["ids"]
+        self.lengths = cols["lengths"].astype("float32")
+        self.n = len(self.ids)
+        self.avgdl = float(self.lengths.mean()) if self.n else 1.0
+
+    @classmethod
+    def load(cls, path="kb_lexical.npz"):
+        with np.load(path) as z:
+            return cls({k: z[k] for k in z.files})
+
+    def search(self, query, k, ids=None):
+        """BM25 top-k → (scores float32[<=k], ids int64[<=k]). ids: 이 FAISS id 들 안에서만 (kb_filter)"""
+        scores = np.zeros(self.n, dtype="float32")
+        for term in set(tokenize(query)):
+            h = np.uint64(_term_hash(term))
+            t = int(np.searchsorted(self.terms, h))
+            if t >= len(self.terms) or self.terms[t] != h:
+                continue
+            s, e = self.offsets[t], self.offsets[t + 1]
+            rows, tf = self.rows[s:e], self.tfs[s:e].astype("float32")
+            idf = np.log(1 + (self.n - (e - s) + 0.5) / ((e - s) + 0.5))
+            scores[rows] += idf * tf * (K1 + 1) / (tf + K1 * (1 - B + B * self.lengths[rows] / self.avgdl))
+        if ids is not None:
+            scores[~np.isin(self.ids, ids)] = 0
+        cand = np.flatnonzero(scores > 0)
+        if len(cand) > k:
+            cand = cand[np.argpartition(-scores[cand], k - 1)[:k]]
+        cand = cand[np.argsort(-scores[cand])]
+        return scores[cand], self.ids[cand]
+
+
+def load_lexical(path="kb_lexical.npz"):
+    return LexicalIndex.load(path) if os.path.exists(path) else None
+
+
+def rrf(rankings, k=RRF_K):
+    """[[id, ...] (순위순), ...] → {id: Σ 1/(k + rank)}"""
+    fused = {}
+    for ranking in rankings:
+        for rank, i in enumerate(ranking, 1):
+            fused[i] = fused.get(i, 0.0) + 1.0 / (k + rank)
+    return fused
+
+
+def fuse(scores, ids, lexical_hits, k):
+    """벡터 결과 1행 (scores, ids) + BM25 결과 → [{"id", "score"(RRF), "vector_score", "bm25_score"}] (최대 k)"""
+    vec = {int(i): float(s) for s, i in zip(scores, ids) if i != -1}
+    lex = {int(i): float(s) for s, i in zip(*lexical_hits)}
+    top = sorted(rrf([list(vec), list(lex)]).items(), key=lambda x: -x[1])[:k]
+    return [{"id": i, "score": s, "vector_score": vec.get(i), "bm25_score": lex.get(i)} for i, s in top]
+
+
+def depth_for(k):
+    """융합 전 각 검색에서 가져올 후보 수"""
+    return max(k * 3, 20)
+
+
+def submit(lexical, query, depth, ids=None):
+    """BM25 검색을 스레드 풀에 넘긴다 (벡터 검색과 동시에 돌리기 위해). 반환: Future"""
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(int(os.getenv("KB_LEXICAL_WORKERS", "4")))
+    return _pool.submit(lexical.search, query, depth, ids)
+
+
+def hybrid_search(vector_fn, lexical, query, k, ids=None):
+    """vector_fn(depth) → faiss (D, I) 를 호출 스레드에서, BM25 는 스레드 풀에서 동시에 돌린 뒤 RRF 로 합친다"""
+    depth = depth_for(k)
+    fut = submit(lexical, query, depth, ids)
+    D, I = vector_fn(depth)
+    return fuse(D[0], I[0], fut.result(), k)
+
+
+def _pct(values, p):
+    return round(float(np.percentile(values, p)) * 1000, 3) if values else None
+
+
+def bench(path, k=5, index_path="kb.index", lexical_path="kb_lexical.npz"):
+    """질문마다 임베딩은 한 번만 하고, 검색 단계 지연만 비교 (벡터 단독 / BM25 단독 / 하이브리드)"""
+    import faiss_query
+    from kb_store import read_index
+    index = read_index(index_path)
+    lexical = LexicalIndex.load(lexical_path)
+    questions = [item["question"] for item in faiss_query._read_questions(path)]
+    vecs = [faiss_query.embed(q).reshape(1, -1) for q in questions]
+    lat = {"vector": [], "bm25": [], "hybrid": []}
+    for q, qv in zip(questions, vecs):
+        t = time.perf_counter()
+        index.search(qv, k)
+        lat["vector"].append(time.perf_counter() - t)
+        t = time.perf_counter()
+        lexical.search(q, k)
+        lat["bm25"].append(time.perf_counter() - t)
+        t = time.perf_counter()
+        hybrid_search(lambda n: index.search(qv, n), lexical, q, k)
+        lat["hybrid"].append(time.perf_counter() - t)
+    for name, v in lat.items():
+        print(f"[BENCH] {name:<6} queries={len(v)} p50_ms={_pct(v, 50)} p95_ms={_pct(v, 95)}")
+    print(f"[BENCH] ntotal={index.ntotal} vocab={len(lexical.terms)} postings={len(lexical.rows)}")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="BM25 색인 벤치마크 (벡터 단독 vs 하이브리드)")
+    ap.add_argument("--bench", required=True, help="questions.jsonl (faiss_query --batch 와 같은 형식)")
+    ap.add_argument("--k", type=int, default=5)
+    args = ap.parse_args()
+    bench(args.bench, k=args.k)
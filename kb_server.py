@@ -0,0 +1,324 @@
+# file: kb_server.py
+"""
+로컬 검색 데몬 (stdlib HTTP)
+
+kb.index / kb_meta.jsonl 과 Bedrock 클라이언트를 프로세스 수명 동안 한 번만 올려 두고
+faiss_query 의 embed / ask_with_context 를 그대로 사용한다. 요청은 스레드 풀에서 동시에 처리된다
+(FAISS 검색과 Bedrock 호출은 GIL 을 놓는다).
+
+  POST /search  {"query": "...", "k": 3, "min_score": 0.15, "where": {"source_prefix": "docs/aws"}, "hybrid": false}
+  POST /answer  {"question": "...", "k": 3, "min_score": 0.15, "where": {...}, "hybrid": false, "stream": false}
+stream=true 면 NDJSON 으로 답변 조각을 {"delta": "..."} 한 줄씩 바로 보내고, 마지막 줄에 전체 결과 ({"done": true, ...})
+where 는 선택 (kb_filter 속성 필터: source_prefix, source, doc_type, tenant, after, before)
+hybrid=true 면 BM25(kb_lexical.npz) 와 벡터 검색을 동시에 돌려 RRF 로 융합
+  POST /reload  (즉시 새 세대 확인)
+  GET  /stats
+
+faiss_build.py 가 새 인덱스를 게시하면(kb.index.gen 갱신) 새 세대를 읽어 참조만 바꾼다.
+처리 중인 요청은 시작할 때 잡은 이전 세대로 끝까지 처리된다 (os.replace 로 교체되므로 mmap 도 유효).
+
+실행: python kb_server.py --port 8765
+클라이언트: KB_SERVER=http://127.0.0.1:8765 python faiss_query.py "질문"
+"""
+
+import argparse, json, os, threading, time, urllib.request
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import faiss_query
+from kb_store import read_index, load_meta
+from kb_filter import filtered_search, load_attrs
+import kb_lexical
+
+
+def _generation_key(index_path):
+    """kb.index.gen 내용 (없으면 인덱스 파일 mtime/크기)"""
+    try:
+        return open(f"{index_path}.gen", encoding="utf-8").read()
+    except FileNotFoundError:
+        st = os.stat(index_path)
+        return f"{st.st_mtime_ns}:{st.st_size}"
+
+
+class Generation:
+    def __init__(self, index_path, meta_path, number, attrs_path="kb_attrs.npz", lexical_path="kb_lexical.npz"):
+        t = time.perf_counter()
+        self.key = _generation_key(index_path)
+        self.index = read_index(index_path)
+        self.docs = load_meta(meta_path)
+        self.attrs = load_attrs(attrs_path)
+        self.lexical = kb_lexical.load_lexical(lexical_path)
+        self.number = number
+        self.loaded_at = time.time()
+        self.load_ms = round((time.perf_counter() - t) * 1000, 1)
+
+
+def _pct(values, p):
+    if not values:
+        return None
+    s = sorted(values)
+    return round(s[min(len(s) - 1, int(len(s) * p))], 1)
+
+
+class Retriever:
+    def __init__(self, index_path="kb.index", meta_path="kb_meta.jsonl", watch_interval=2.0, attrs_path="kb_attrs.npz",
+                 lexical_path="kb_lexical.npz"):
+        self.index_path = index_path
+        self.meta_path = meta_path
+        self.attrs_path = attrs_path
+        self.lexical_path = lexical_path
+        self._reload_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._gen = Generation(index_path, meta_path, 1, attrs_path, lexical_path)
+        self._counts = {"reloads": 0, "reload_errors": 0}
+        self._latency = {}
+        if watch_interval:
+            threading.Thread(target=self._watch, args=(watch_interval,), daemon=True).start()
+
+    def current(self):
+        return self._gen
+
+    def reload(self):
+        """게시된 세대가 바뀌었으면 새로 읽고 교체. 반환: 교체 여부"""
+        with self._reload_lock:
+            try:
+                if _generation_key(self.index_path) == self._gen.key:
+                    return False
+                gen = Generation(self.index_path, self.meta_path, self._gen.number + 1, self.attrs_path,
+                                 self.lexical_path)
+            except Exception as e:
+                self._count("reload_errors")
+                print(f"[SERVER] reload failed, keeping generation {self._gen.number}: {e}")
+                return False
+            self._gen = gen  # 참조 교체만 — 이전 세대는 진행 중인 요청이 끝나면 해제
+            self._count("reloads")
+            print(f"[SERVER] generation {gen.number} loaded in {gen.load_ms} ms (ntotal={gen.index.ntotal})")
+            return True
+
+    def _watch(self, interval):
+        while True:
+            time.sleep(interval)
+            self.reload()
+
+    def _count(self, key):
+        with self._stats_lock:
+            self._counts[key] = self._counts.get(key, 0) + 1
+
+    def track(self, endpoint, ms, ok):
+        with self._stats_lock:
+            self._counts[f"{endpoint}_requests"] = self._counts.get(f"{endpoint}_requests", 0) + 1
+            if not ok:
+                self._counts[f"{endpoint}_errors"] = self._counts.get(f"{endpoint}_errors", 0) + 1
+            self._latency.setdefault(endpoint, deque(maxlen=1000)).append(ms)
+
+    def search(self, query, k=3, min_score=0.15, where=None, hybrid=False):
+        gen = self.current()
+        if where is not None and not isinstance(where, dict):
+            raise ValueError("where must be an object")
+        if hybrid and gen.lexical is None:
+            raise ValueError("hybrid search needs kb_lexical.npz (rebuild with faiss_build.py)")
+        t = time.perf_counter()
+        if hybrid:
+            ids = gen.attrs.eligible_ids(where) if where and gen.attrs is not None else None
+            depth = kb_lexical.depth_for(k)
+            fut = kb_lexical.submit(gen.lexical, query, depth, ids)  # 질의 임베딩과 동시에
+        qv = faiss_query.embed(query).reshape(1, -1)
+        t_embed = time.perf_counter()
+        if hybrid:
+            D, I = filtered_search(gen.index, gen.attrs, qv, depth, where)
+            hits = faiss_query._fused_hits(gen.docs, kb_lexical.fuse(D[0], I[0], fut.result(), k), min_score)
+        else:
+            D, I = filtered_search(gen.index, gen.attrs, qv, k, where)
+            hits = faiss_query._hits(gen.docs, D[0], I[0], min_score)
+        return {
+            "hits": hits,
+            "generation": gen.number,
+            "timing": {"embed_ms": round((t_embed - t) * 1000, 1),
+                       "search_ms": round((time.perf_counter() - t_embed) * 1000, 1)},
+        }
+
+    def answer(self, question, k=3, min_score=0.15, where=None, hybrid=False, on_delta=None):
+        res = self.search(question, k, min_score, where, hybrid)
+        if not res["hits"]:
+            return {"answer": "관련 컨텍스트가 없어 답변할 수 없습니다.", "contexts": [], "usage": None,
+                    "generation": res["generation"], "timing": res["timing"]}
+        t = time.perf_counter()
+        out = faiss_query.ask_with_context(question, res["hits"], on_delta)
+        res["timing"]["answer_ms"] = round((time.perf_counter() - t) * 1000, 1)
+        res["timing"].update(out.pop("timing", {}))  # 스트리밍이면 ttft_ms / generate_ms
+        out.update(generation=res["generation"], timing=res["timing"])
+        return out
+
+    def stats(self):
+        gen = self.current()
+        with self._stats_lock:
+            latency = {ep: {"p50_ms": _pct(list(v), 0.5), "p95_ms": _pct(list(v), 0.95)}
+                       for ep, v in self._latency.items()}
+            counts = dict(self._counts)
+        return {
+            "generation": {"number": gen.number, "ntotal": int(gen.index.ntotal),
+                           "loaded_at": gen.loaded_at, "load_ms": gen.load_ms},
+            "counts": counts,
+            "latency": latency,
+            "bedrock": faiss_query.br.stats(),
+        }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    retriever = None  # serve() 에서 주입
+
+    def log_message(self, fmt, *args):  # 요청마다 stderr 로그를 남기지 않음
+        pass
+
+    def _send(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self):
+        n = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(n) or b"{}")
+
+    def _handle(self, endpoint, fn):
+        t = time.perf_counter()
+        ok = False
+        try:
+            self._send(200, fn())
+            ok = True
+        except (KeyError, ValueError) as e:
+            self._send(400, {"error": f"bad request: {e}"})
+        except Exception as e:
+            self._send(500, {"error": str(e)})
+        finally:
+            self.retriever.track(endpoint, (time.perf_counter() - t) * 1000, ok)
+
+    def _handle_stream(self, endpoint, fn):
+        """fn(emit) 실행. emit(dict) 할 때마다 NDJSON 한 줄을 바로 보내고, fn 의 반환값을 마지막 줄로"""
+        t = time.perf_counter()
+        ok = False
+        started = False
+
+        def emit(body):
+            nonlocal started
+            if not started:
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson; charset=utf-8")
+                self.end_headers()  # Content-Length 없이 보내고 연결 종료로 끝을 알린다 (HTTP/1.0)
+                started = True
+            self.wfile.write((json.dumps(body, ensure_ascii=False) + "\n").encode("utf-8"))
+            self.wfile.flush()
+
+        try:
+            emit(dict(fn(emit), done=True))
+            ok = True
+        except (KeyError, ValueError) as e:
+            emit({"error": f"bad request: {e}"}) if started else self._send(400, {"error": f"bad request: {e}"})
+        except Exception as e:
+            emit({"error": str(e)}) if started else self._send(500, {"error": str(e)})
+        finally:
+            self.retriever.track(endpoint, (time.perf_counter() - t) * 1000, ok)
+
+    def do_GET(self):
+        if self.path == "/stats":
+            return self._send(200, self.retriever.stats())
+        self._send(404, {"error": "not found"})
+
+    def do_POST(self):
+        r = self.retriever
+        if self.path == "/search":
+            def fn():
+                b = self._body()
+                return r.search(b["query"], int(b.get("k", 3)), float(b.get("min_score", 0.15)), b.get("where"),
+                                bool(b.get("hybrid")))
+            return self._handle("search", fn)
+        if self.path == "/answer":
+            try:
+                b = self._body()
+            except ValueError as e:
+                return self._send(400, {"error": f"bad request: {e}"})
+
+            def fn(on_delta=None):
+                return r.answer(b["question"], int(b.get("k", 3)), float(b.get("min_score", 0.15)), b.get("where"),
+                                bool(b.get("hybrid")), on_delta)
+            if b.get("stream"):
+                return self._handle_stream("answer", lambda emit: fn(lambda d: emit({"delta": d})))
+            return self._handle("answer", fn)
+        if self.path == "/reload":
+            return self._send(200, {"reloaded": r.reload(), "generation": r.current().number})
+        self._send(404, {"error": "not found"})
+
+
+class PooledHTTPServer(HTTPServer):
+    """요청마다 스레드를 만들지 않고 고정 크기 스레드 풀에서 처리"""
+
+    def __init__(self, addr, handler, workers=16):
+        super().__init__(addr, handler)
+        self.pool = ThreadPoolExecutor(workers)
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self._process, request, client_address)
+
+    def _process(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+def serve(host="127.0.0.1", port=8765, workers=16, index_path="kb.index", meta_path="kb_meta.jsonl",
+          watch_interval=2.0, attrs_path="kb_attrs.npz", lexical_path="kb_lexical.npz"):
+    _Handler.retriever = Retriever(index_path, meta_path, watch_interval, attrs_path, lexical_path)
+    server = PooledHTTPServer((host, port), _Handler, workers)
+    print(f"[SERVER] listening on http://{host}:{port} (workers={workers})")
+    return server
+
+
+def call(base_url, path, payload=None, timeout=120):
+    """얇은 클라이언트: payload 가 있으면 POST, 없으면 GET"""
+    data = json.dumps(payload, ensure_ascii=False).encode("utf-8") if payload is not None else None
+    req = urllib.request.Request(base_url.rstrip("/") + path, data=data,
+                                 headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(req, timeout=timeout) as resp:
+        return json.loads(resp.read())
+
+
+def call_stream(base_url, path, payload, timeout=120):
+    """stream=true 요청용: NDJSON 줄을 dict 로 하나씩 yield ({"delta"} ... 마지막 {"done": true, ...})"""
+    data = json.dumps(dict(payload, stream=True), ensure_ascii=False).encode("utf-8")
+    req = urllib.request.Request(base_url.rstrip("/") + path, data=data,
+                                 headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(req, timeout=timeout) as resp:
+        for line in resp:
+            if line.strip():
+                yield json.loads(line)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="로컬 FAISS 검색 데몬")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--workers", type=int, default=16)
+    ap.add_argument("--index", default="kb.index")
+    ap.add_argument("--meta", default="kb_meta.jsonl")
+    ap.add_argument("--attrs", default="kb_attrs.npz", help="필터 검색용 속성 테이블")
+    ap.add_argument("--lexical", default="kb_lexical.npz", help="하이브리드 검색용 BM25 색인")
+    ap.add_argument("--watch-interval", type=float, default=2.0, help="새 인덱스 게시 확인 주기(초), 0 이면 /reload 로만")
+    args = ap.parse_args()
+    server = serve(args.host, args.port, args.workers, args.index, args.meta, args.watch_interval, args.attrs,
+                   args.lexical)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
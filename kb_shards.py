@@ -0,0 +1,233 @@
+# file: kb_shards.py
+"""
+샤드 FAISS 인덱스 (매니페스트 + N 개 샤드)
+
+kb.index 하나가 프로세스 하나의 RAM / 빌드 한 번에 들어가야 하는 한계를 넘기 위해
+kb_store.sqlite 의 id 구간 [no*shard_size, (no+1)*shard_size) 마다 샤드 인덱스를 따로 만든다.
+  - kb.index              : 매니페스트 (JSON) — factory, 검색 파라미터, 샤드 목록 (이름, 파일, id 구간, 체크섬)
+  - kb.index.shards/*.index: 샤드별 IndexIDMap2 (id 는 전역 저장소 id 그대로 → kb_meta.jsonl 공용)
+
+빌드 (faiss_build.py --shard-size N)
+  - 샤드별 (id, 해시) 체크섬이 매니페스트와 다른 샤드만 프로세스 풀에서 동시에 다시 만든다.
+  - id 는 재사용되지 않으므로 새 문서는 마지막/새 샤드에만 들어가고 앞 샤드는 그대로 남는다.
+
+검색 (ShardedIndex, kb_store.read_index 가 매니페스트를 보면 자동 사용)
+  - 질의를 모든 샤드에 스레드로 동시에 보내고 (faiss 검색은 GIL 을 놓는다)
+    샤드별 top-k (이미 점수순)를 heapq.merge 로 합쳐 전체 top-k.
+
+샤드 관리: python kb_shards.py list | remove shard-00003 | add shard-00003
+  remove 는 해당 샤드를 검색에서 빼고 다음 빌드에서도 다시 만들지 않는다. add 는 그 샤드만 저장소에서 다시 만든다.
+"""
+
+import argparse, heapq, itertools, json, multiprocessing, os, shutil, time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
+
+from kb_store import (VectorStore, new_index, rebuild_index, publish_index, publish_generation, read_index,
+                      apply_search_params, is_manifest)
+
+FORMAT = "kb-shards/1"
+
+
+def shard_name(no):
+    return f"shard-{no:05d}"
+
+
+def shard_dir(path):
+    return f"{path}.shards"
+
+
+def read_manifest(path="kb.index"):
+    return json.load(open(path, encoding="utf-8")) if is_manifest(path) else None
+
+
+def write_manifest(manifest, path="kb.index"):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def _build_shard(store_path, dim, factory, lo, hi, out_path, train_size, threads):
+    """프로세스 풀 작업: 저장소의 id 구간 [lo, hi) 로 샤드 하나를 만들어 게시. 반환: ntotal"""
+    import faiss
+    faiss.omp_set_num_threads(threads)  # 샤드끼리 코어를 나눠 쓴다
+    store = VectorStore(store_path, dim)
+    index = rebuild_index(store, new_index(dim, factory), train_size, lo, hi)
+    publish_index(index, out_path)
+    return int(index.ntotal)
+
+
+def build_shards(store_path="kb_store.sqlite", path="kb.index", dim=1536, factory="Flat", search_params=None,
+                 shard_size=500000, train_size=100000, workers=None, full=False, only=None):
+    """
+    저장소(커밋된 상태)로 샤드 인덱스를 만들거나 갱신하고 매니페스트를 쓴다.
+    체크섬이 같은 샤드는 건너뛴다 (full=True 면 전부 다시). only: 이 샤드 이름들만 다시 만든다 (kb_shards add).
+    반환: (manifest, 다시 만든 샤드 이름 목록)
+    """
+    old = read_manifest(path)
+    if old and (old.get("factory") != factory or old.get("shard_size") != shard_size or old.get("dim") != dim):
+        print("[SHARDS] factory/shard_size changed, rebuilding every shard")
+        full = True
+    removed = set((old or {}).get("removed", [])) - set(only or [])
+    known = {s["name"]: s for s in (old or {}).get("shards", [])}
+    sums = VectorStore(store_path, dim).range_checksums(shard_size)
+
+    os.makedirs(shard_dir(path), exist_ok=True)
+    shards, jobs = [], []
+    for no in sorted(sums):
+        name = shard_name(no)
+        if name in removed:
+            continue
+        n, checksum = sums[no]
+        entry = {"name": name, "path": f"{os.path.basename(shard_dir(path))}/{name}.index",
+                 "lo": no * shard_size, "hi": (no + 1) * shard_size, "ntotal": n, "checksum": checksum}
+        prev = known.get(name)
+        fresh = prev and prev["checksum"] == checksum and os.path.exists(_shard_path(path, prev))
+        if full or not fresh or (only is not None and name in only):
+            jobs.append(entry)
+        shards.append(entry)
+    # 문서가 모두 지워진 샤드는 파일도 정리
+    for name, prev in known.items():
+        if name not in {s["name"] for s in shards} and name not in removed:
+            _unlink(_shard_path(path, prev))
+
+    workers = workers or min(len(jobs), os.cpu_count() or 1) or 1
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    t0 = time.perf_counter()
+    if jobs:
+        # faiss/OpenMP 와 fork 를 섞지 않도록 spawn
+        ctx = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(workers, mp_context=ctx) as pool:
+            futs = {pool.submit(_build_shard, store_path, dim, factory, e["lo"], e["hi"],
+                                _shard_path(path, e), train_size, threads): e for e in jobs}
+            for fut, e in futs.items():
+                e["ntotal"] = fut.result()
+    manifest = {"format": FORMAT, "factory": factory, "metric": "inner_product", "dim": dim,
+                "shard_size": shard_size, "search_params": search_params or {},
+                "ntotal": sum(s["ntotal"] for s in shards), "shards": shards, "removed": sorted(removed)}
+    write_manifest(manifest, path)
+    print(f"[SHARDS] shards={len(shards)} rebuilt={len(jobs)} workers={workers} "
+          f"ntotal={manifest['ntotal']} in {time.perf_counter() - t0:.2f}s")
+    return manifest, [e["name"] for e in jobs]
+
+
+def remove_shard_dir(path="kb.index"):
+    """
+    단일 인덱스로 게시한 뒤 호출: 남은 kb.index.shards/ 를 지운다 (kb.index 매니페스트는 이미 인덱스로 교체됨).
+    이전 세대를 mmap 중인 kb_server 는 파일이 지워져도 다음 세대를 읽을 때까지 그대로 검색한다.
+    """
+    d = shard_dir(path)
+    if is_manifest(path) or not os.path.isdir(d):
+        return False
+    shutil.rmtree(d)
+    print(f"[SHARDS] removed {d} (index is no longer sharded)")
+    return True
+
+
+def _shard_path(path, entry):
+    return os.path.join(os.path.dirname(os.path.abspath(path)), entry["path"])
+
+
+def _unlink(p):
+    try:
+        os.remove(p)
+    except FileNotFoundError:
+        pass
+
+
+class ShardedIndex:
+    """
+    매니페스트의 샤드들을 faiss 인덱스처럼 검색 (search → (D, I), ntotal, d).
+    샤드는 read_index 로 mmap 해서 읽고 매니페스트의 search_params (nprobe/efSearch)를 적용한다.
+    """
+
+    def __init__(self, path="kb.index", mmap=True, workers=None):
+        self.manifest = read_manifest(path)
+        if self.manifest is None or self.manifest.get("format") != FORMAT:
+            raise RuntimeError(f"{path} is not a shard manifest")
+        self.d = self.manifest["dim"]
+        self.shards = [apply_search_params(read_index(_shard_path(path, s), mmap=mmap),
+                                           self.manifest.get("search_params"))
+                       for s in self.manifest["shards"]]
+        self.ntotal = sum(int(s.ntotal) for s in self.shards)
+        self._pool = ThreadPoolExecutor(workers or int(os.getenv("KB_SHARD_WORKERS", "0")) or max(1, len(self.shards)))
+
+    def search(self, xq, k, params_fn=None):
+        """params_fn(shard) → 샤드별 SearchParameters (kb_filter 의 IDSelector 필터)"""
+        xq = np.atleast_2d(np.asarray(xq, dtype="float32"))
+        m = len(xq)
+        D = np.full((m, k), -np.inf, dtype="float32")
+        I = np.full((m, k), -1, dtype="int64")
+        if not self.shards:
+            return D, I
+        if params_fn is None:
+            futs = [self._pool.submit(s.search, xq, k) for s in self.shards]
+        else:
+            futs = [self._pool.submit(lambda s: s.search(xq, k, params=params_fn(s)), s) for s in self.shards]
+        parts = [f.result() for f in futs]
+        for row in range(m):
+            # 샤드별 결과는 이미 점수 내림차순 → k-way merge 로 상위 k 만
+            rows = [zip(pd[row].tolist(), pi[row].tolist()) for pd, pi in parts]
+            merged = heapq.merge(*rows, key=lambda x: x[0], reverse=True)
+            top = list(itertools.islice(((s, i) for s, i in merged if i != -1), k))
+            if top:
+                D[row, :len(top)] = [s for s, _ in top]
+                I[row, :len(top)] = [i for _, i in top]
+        return D, I
+
+
+def remove_shard(name, path="kb.index"):
+    """샤드를 검색에서 빼고 파일 삭제. 다시 넣을 때까지 빌드에서도 건너뛴다"""
+    manifest = read_manifest(path)
+    if manifest is None:
+        raise RuntimeError(f"{path} is not a shard manifest")
+    entry = next((s for s in manifest["shards"] if s["name"] == name), None)
+    if entry is None:
+        raise RuntimeError(f"No such shard: {name}")
+    manifest["shards"].remove(entry)
+    manifest["removed"] = sorted(set(manifest.get("removed", [])) | {name})
+    manifest["ntotal"] = sum(s["ntotal"] for s in manifest["shards"])
+    write_manifest(manifest, path)
+    _unlink(_shard_path(path, entry))
+    publish_generation(path)
+    print(f"[SHARDS] removed {name} ({entry['ntotal']} vectors), shards={len(manifest['shards'])}")
+
+
+def add_shard(name, path="kb.index", store_path="kb_store.sqlite", train_size=100000):
+    """샤드 하나만 저장소에서 다시 만들어 매니페스트에 넣는다 (다른 샤드는 그대로)"""
+    manifest = read_manifest(path)
+    if manifest is None:
+        raise RuntimeError(f"{path} is not a shard manifest")
+    build_shards(store_path, path, manifest["dim"], manifest["factory"], manifest.get("search_params"),
+                 manifest["shard_size"], train_size, workers=1, only=[name])
+    publish_generation(path)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="샤드 인덱스 관리")
+    ap.add_argument("command", choices=["list", "add", "remove"])
+    ap.add_argument("name", nargs="?", help="샤드 이름 (예: shard-00003)")
+    ap.add_argument("--index", default="kb.index")
+    ap.add_argument("--store", default="kb_store.sqlite")
+    ap.add_argument("--train-size", type=int, default=100000)
+    args = ap.parse_args()
+    if args.command == "list":
+        manifest = read_manifest(args.index)
+        if manifest is None:
+            raise SystemExit(f"{args.index} is not a shard manifest")
+        for s in manifest["shards"]:
+            print(f"{s['name']}  ids=[{s['lo']}, {s['hi']})  ntotal={s['ntotal']}")
+        for name in manifest.get("removed", []):
+            print(f"{name}  (removed)")
+        return
+    if not args.name:
+        ap.error(f"{args.command} needs a shard name")
+    if args.command == "remove":
+        remove_shard(args.name, args.index)
+    else:
+        add_shard(args.name, args.index, args.store, args.train_size)
+
+
+if __name__ == "__main__":
+    main()
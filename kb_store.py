@@ -0,0 +1,311 @@
+# file: kb_store.py
+"""
+로컬 FAISS 지식베이스용 벡터 저장소 (faiss_build 증분 빌드)
+
+kb_store.sqlite 에 문서별로 (정수 id, doc_id, 콘텐츠 해시, 텍스트, float32 벡터)를 보관한다.
+FAISS 인덱스는 IndexIDMap2 로 감싸 이 정수 id 로 추가/삭제하므로,
+문서가 바뀌거나 지워져도 해당 행만 다시 임베딩/삭제하면 된다.
+인덱스 파일이 없거나 저장소와 맞지 않으면 저장된 벡터로 다시 만든다 (임베딩 호출 없음).
+필터 검색용 문서 속성(source, doc_type, timestamp, tenant)은 attrs 컬럼에 JSON 으로 두고
+faiss_build 가 kb_filter.write_attrs 로 kb_attrs.npz 컬럼 테이블을 만든다.
+
+인덱스 종류는 faiss index_factory 문자열 (Flat, HNSW32, IVF1024,Flat, IVF1024,PQ64, SQ8, OPQ64,IVF1024,PQ64 ...).
+kb.index 옆의 kb.index.json 에 factory 와 검색 파라미터(nprobe, efSearch)를 기록하고,
+read_index 가 읽을 때 그대로 적용한다.
+
+kb.index 가 JSON 매니페스트면 샤드 인덱스 (kb_shards.py) — read_index 가 ShardedIndex 로 읽는다.
+
+메타데이터는 kb_meta.jsonl (줄마다 {"id":.., "doc_id":.., "text":..}, id 순) +
+kb_meta.jsonl.idx.npy ([id, offset, length] int64 행). 둘 다 mmap 해서 검색 결과 top-k 의 줄만 디코딩하므로
+코퍼스가 커져도 질의 시작 시간/RSS 가 거의 늘지 않는다.
+예전 kb_meta.json ([{"id",..}] 또는 [["doc1","text"], ...], 위치 = FAISS 행 번호)도 load_meta 로 읽을 수 있다.
+"""
+
+import hashlib, json, mmap, os, sqlite3, time
+import numpy as np
+
+
+class VectorStore:
+    def __init__(self, path="kb_store.sqlite", dim=1536):
+        self.dim = dim
+        self._db = sqlite3.connect(path)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS docs ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " doc_id TEXT NOT NULL UNIQUE,"
+            " hash TEXT NOT NULL,"
+            " text TEXT NOT NULL,"
+            " vec BLOB NOT NULL,"
+            " attrs TEXT NOT NULL DEFAULT '{}')"
+        )
+        cols = {r[1] for r in self._db.execute("PRAGMA table_info(docs)")}
+        if "attrs" not in cols:  # 속성 컬럼 이전에 만든 저장소
+            self._db.execute("ALTER TABLE docs ADD COLUMN attrs TEXT NOT NULL DEFAULT '{}'")
+        self._db.commit()
+
+    def rows(self):
+        """{doc_id: (id, hash)}"""
+        return {d: (i, h) for i, d, h in self._db.execute("SELECT id, doc_id, hash FROM docs")}
+
+    def _range(self, lo, hi):
+        """id 구간 [lo, hi) 조건 (샤드 빌드용). 둘 다 None 이면 전체"""
+        return " WHERE id >= ? AND id < ?" if lo is not None else "", (lo, hi) if lo is not None else ()
+
+    def count(self, lo=None, hi=None):
+        where, args = self._range(lo, hi)
+        return self._db.execute(f"SELECT COUNT(*) FROM docs{where}", args).fetchone()[0]
+
+    def range_checksums(self, size):
+        """{샤드 번호 (= id // size): (문서 수, (id, 해시) 체크섬)} — 바뀐 샤드만 다시 빌드하기 위해"""
+        out = {}
+        for i, h in self._db.execute("SELECT id, hash FROM docs ORDER BY id"):
+            c = out.setdefault(i // size, [0, hashlib.sha1()])
+            c[0] += 1
+            c[1].update(f"{i}:{h};".encode())
+        return {no: (n, digest.hexdigest()) for no, (n, digest) in out.items()}
+
+    def attrs(self):
+        """{doc_id: attrs dict}"""
+        return {d: json.loads(a) for d, a in self._db.execute("SELECT doc_id, attrs FROM docs")}
+
+    def upsert(self, doc_id, hash_, text, vec, attrs=None):
+        """내용이 바뀐 문서는 id 를 유지한 채 덮어쓴다. 반환: id"""
+        vec = np.asarray(vec, dtype="float32")
+        if vec.shape != (self.dim,):
+            raise RuntimeError(f"Vector dim mismatch for {doc_id}: {vec.shape} (expected {self.dim})")
+        self._db.execute(
+            "INSERT INTO docs (doc_id, hash, text, vec, attrs) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(doc_id) DO UPDATE SET hash = excluded.hash, text = excluded.text, vec = excluded.vec,"
+            " attrs = excluded.attrs",
+            (doc_id, hash_, text, vec.tobytes(), json.dumps(attrs or {}, ensure_ascii=False, sort_keys=True)),
+        )
+        return self._db.execute("SELECT id FROM docs WHERE doc_id = ?", (doc_id,)).fetchone()[0]
+
+    def set_attrs(self, doc_id, attrs):
+        """속성만 바뀐 문서 (재임베딩 없음)"""
+        self._db.execute("UPDATE docs SET attrs = ? WHERE doc_id = ?",
+                         (json.dumps(attrs, ensure_ascii=False, sort_keys=True), doc_id))
+
+    def delete(self, doc_ids):
+        """반환: 지워진 행의 id 목록"""
+        ids = []
+        for doc_id in doc_ids:
+            row = self._db.execute("SELECT id FROM docs WHERE doc_id = ?", (doc_id,)).fetchone()
+            if row:
+                ids.append(row[0])
+                self._db.execute("DELETE FROM docs WHERE id = ?", (row[0],))
+        return ids
+
+    def commit(self):
+        self._db.commit()
+
+    def rollback(self):
+        self._db.rollback()
+
+    def iter_vectors(self, batch=10000, lo=None, hi=None):
+        """(ids int64[n], vecs float32[n, dim]) 묶음 단위로. lo/hi: id 구간 [lo, hi) 만"""
+        where, args = self._range(lo, hi)
+        cur = self._db.execute(f"SELECT id, vec FROM docs{where} ORDER BY id", args)
+        while True:
+            rows = cur.fetchmany(batch)
+            if not rows:
+                return
+            ids = np.array([r[0] for r in rows], dtype="int64")
+            vecs = np.frombuffer(b"".join(r[1] for r in rows), dtype="float32").reshape(len(rows), self.dim)
+            yield ids, vecs
+
+    def iter_meta(self):
+        yield from self._db.execute("SELECT id, doc_id, text FROM docs ORDER BY id")
+
+    def iter_attrs(self):
+        for i, a in self._db.execute("SELECT id, attrs FROM docs ORDER BY id"):
+            yield i, json.loads(a)
+
+
+def new_index(dim, factory="Flat"):
+    import faiss
+    return faiss.index_factory(dim, f"IDMap2,{factory}", faiss.METRIC_INNER_PRODUCT)
+
+
+def sample_vectors(store, n, seed=0, lo=None, hi=None):
+    """학습용 무작위 표본 (저장소가 n 보다 작으면 전체)"""
+    total = store.count(lo, hi)
+    if total <= n:
+        return np.vstack([v for _, v in store.iter_vectors(lo=lo, hi=hi)]) if total else np.zeros((0, store.dim), "float32")
+    keep = np.sort(np.random.default_rng(seed).choice(total, n, replace=False))
+    out, pos = [], 0
+    for _, vecs in store.iter_vectors(lo=lo, hi=hi):
+        sel = keep[(keep >= pos) & (keep < pos + len(vecs))] - pos
+        out.append(vecs[sel])
+        pos += len(vecs)
+    return np.vstack(out)
+
+
+def rebuild_index(store, index=None, train_size=100000, lo=None, hi=None):
+    """저장된 벡터로 인덱스를 처음부터 채운다 (임베딩 호출 없음). IVF/PQ 는 표본으로 먼저 학습. lo/hi: id 구간만 (샤드)"""
+    index = index if index is not None else new_index(store.dim)
+    if not index.is_trained:
+        xt = sample_vectors(store, train_size, lo=lo, hi=hi)
+        try:
+            index.train(xt)
+        except RuntimeError as e:
+            raise RuntimeError(f"Index training failed with {len(xt)} vectors (too few for this factory?): {e}")
+    for ids, vecs in store.iter_vectors(lo=lo, hi=hi):
+        index.add_with_ids(vecs, ids)
+    return index
+
+
+def info_path(path):
+    return f"{path}.json"
+
+
+def read_info(path="kb.index"):
+    try:
+        return json.load(open(info_path(path), encoding="utf-8"))
+    except FileNotFoundError:
+        return {"factory": "Flat", "search_params": {}}
+
+
+def apply_search_params(index, params):
+    """nprobe / efSearch 등. 해당 인덱스에 없는 파라미터는 건너뛴다"""
+    import faiss
+    ps = faiss.ParameterSpace()
+    for name, value in (params or {}).items():
+        try:
+            ps.set_index_parameter(index, name, value)
+        except RuntimeError:
+            print(f"[INDEX] search parameter {name} does not apply to this index, skipped")
+    return index
+
+
+def is_manifest(path):
+    """kb.index 자리에 샤드 매니페스트(JSON)가 있는지 — faiss 인덱스 파일은 '{' 로 시작하지 않는다"""
+    try:
+        with open(path, "rb") as f:
+            return f.read(1) == b"{"
+    except FileNotFoundError:
+        return False
+
+
+def read_index(path="kb.index", mmap=True, store_path="kb_store.sqlite"):
+    """
+    인덱스를 읽고 kb.index.json 의 검색 파라미터를 적용.
+    mmap=True 면 벡터/코드를 메모리 매핑 (IO_FLAG_MMAP_IFC, 없으면 IO_FLAG_MMAP) — 검색 전용, 수정 불가.
+    매핑을 지원하지 않는 인덱스는 일반 read 로 읽는다. 샤드 매니페스트면 kb_shards.ShardedIndex.
+    faiss-cpu 가 없으면 kb_store.sqlite 의 벡터로 만든 VectorTable(NumPy exact 검색)을 대신 돌려준다.
+    """
+    try:
+        import faiss
+    except ImportError:
+        from vector_table import VectorTable
+        print(f"[INDEX] faiss is not installed, searching {store_path} with NumPy (vector_table)")
+        return VectorTable.from_store(VectorStore(store_path))
+    if is_manifest(path):
+        from kb_shards import ShardedIndex
+        return ShardedIndex(path, mmap=mmap)
+    index = None
+    if mmap:
+        flag = getattr(faiss, "IO_FLAG_MMAP_IFC", None) or faiss.IO_FLAG_MMAP
+        try:
+            index = faiss.read_index(path, flag | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError as e:
+            print(f"[INDEX] {path} cannot be memory-mapped ({str(e).splitlines()[0]}), loading into RAM")
+    if index is None:
+        index = faiss.read_index(path)
+    return apply_search_params(index, read_info(path).get("search_params"))
+
+
+def publish_index(index, path="kb.index", info=None):
+    """임시 파일에 쓴 뒤 rename → 읽는 쪽은 항상 완전한 파일만 본다"""
+    import faiss
+    if info is not None:
+        tmp = f"{info_path(path)}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(info, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, info_path(path))
+    tmp = f"{path}.tmp"
+    faiss.write_index(index, tmp)
+    os.replace(tmp, path)
+
+
+def publish_generation(path="kb.index"):
+    """인덱스와 메타데이터를 모두 쓴 뒤 마지막에 호출. kb_server 는 이 파일이 바뀔 때만 새 세대를 읽는다"""
+    tmp = f"{path}.gen.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"generation": time.time_ns()}, f)
+    os.replace(tmp, f"{path}.gen")
+
+
+def write_meta(store, path="kb_meta.jsonl"):
+    """kb_meta.jsonl + kb_meta.jsonl.idx.npy 를 임시 파일에 쓴 뒤 교체"""
+    rows = []
+    with open(f"{path}.tmp", "wb") as f:
+        for i, d, t in store.iter_meta():
+            line = json.dumps({"id": i, "doc_id": d, "text": t}, ensure_ascii=False).encode("utf-8") + b"\n"
+            rows.append((i, f.tell(), len(line)))
+            f.write(line)
+    np.save(f"{path}.idx.tmp.npy", np.array(rows, dtype="int64").reshape(-1, 3))
+    os.replace(f"{path}.tmp", path)
+    os.replace(f"{path}.idx.tmp.npy", f"{path}.idx.npy")
+
+
+class MetaReader:
+    """
+    kb_meta.jsonl 을 mmap 한 읽기 전용 {FAISS id: doc} 매핑.
+    조회할 때만 해당 줄을 json 디코딩한다.
+    """
+
+    def __init__(self, path="kb_meta.jsonl"):
+        self.path = path
+        self._rows = np.load(f"{path}.idx.npy", mmap_mode="r")
+        self._ids = self._rows[:, 0]
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b""
+
+    def _pos(self, doc_key):
+        i = int(np.searchsorted(self._ids, doc_key))
+        return i if i < len(self._ids) and self._ids[i] == doc_key else -1
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, doc_key):
+        return self._pos(doc_key) >= 0
+
+    def __getitem__(self, doc_key):
+        i = self._pos(doc_key)
+        if i < 0:
+            raise KeyError(doc_key)
+        _, off, n = self._rows[i]
+        return json.loads(self._mm[off:off + n])
+
+    def get(self, doc_key, default=None):
+        return self[doc_key] if doc_key in self else default
+
+    def __iter__(self):
+        return (int(i) for i in self._ids)
+
+    def values(self):
+        return (self[i] for i in self)
+
+
+def load_meta(path="kb_meta.jsonl"):
+    """
+    {FAISS id: {"id","doc_id","text"}}
+    .jsonl(+ .idx.npy) 이면 MetaReader, 없으면 같은 이름의 예전 .json 을 읽는다 (위치를 id 로 사용).
+    """
+    base, ext = os.path.splitext(path)
+    if ext == ".jsonl" and os.path.exists(f"{path}.idx.npy"):
+        return MetaReader(path)
+    if ext == ".jsonl":
+        path = f"{base}.json"
+    raw = json.load(open(path, encoding="utf-8"))
+    docs = {}
+    for pos, item in enumerate(raw):
+        if isinstance(item, dict):
+            doc = dict(item)
+            doc.setdefault("id", pos)
+        else:
+            doc = {"id": pos, "doc_id": item[0], "text": item[1]}
+        docs[doc["id"]] = doc
+    return docs
@@ -0,0 +1,176 @@
+# file: aoss_bulk.py
+"""
+AOSS/OpenSearch _bulk 버퍼 writer
+
+문서를 NDJSON으로 모아 문서 수/바이트 한도에 도달하면 한 번에 전송하고,
+응답의 item별 결과를 확인해 실패한(재시도 가능한) 문서만 다시 보낸다.
+여러 스레드에서 동시에 add() 해도 되며, 가득 찬 배치는 add()를 호출한 스레드가 전송한다.
+"""
+
+import json, threading, time
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class BulkRequestError(RuntimeError):
+    """_bulk 요청 자체가 실패한 경우 (HTTP 상태 코드 포함)"""
+
+    def __init__(self, status, text=""):
+        super().__init__(f"AOSS bulk error {status}: {text[:500]}")
+        self.status = status
+
+
+def requests_sender(http, url, auth, headers):
+    """
+    requests / requests.Session / AOSSTransport 로 _bulk 를 POST 하는 send 함수 생성.
+    url 예: f"{AOSS_ENDPOINT}/_bulk" (AOSSTransport 면 "/_bulk", auth=None)
+    """
+    hdrs = dict(headers)
+    hdrs["Content-Type"] = "application/x-ndjson"
+
+    def send(body: bytes) -> dict:
+        r = http.post(url, auth=auth, headers=hdrs, data=body)
+        if r.status_code >= 300:
+            raise BulkRequestError(r.status_code, r.text)
+        return r.json()
+
+    return send
+
+
+def _status_of(exc):
+    # BulkRequestError.status / opensearch-py TransportError.status_code
+    for attr in ("status", "status_code"):
+        v = getattr(exc, attr, None)
+        if isinstance(v, int):
+            return v
+    return None
+
+
+class BulkWriter:
+    """
+    사용 예:
+        with BulkWriter(send, "kb-rag") as w:
+            w.add({"content": "...", "embedding": [...]})
+        print(w.stats, w.failed)
+    """
+
+    def __init__(self, send, index, max_docs=500, max_bytes=5 * 1024 * 1024,
+                 max_retries=3, backoff=0.5):
+        self.send = send
+        self.index = index
+        self.max_docs = max_docs
+        self.max_bytes = max_bytes
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._lock = threading.Lock()
+        self._buf = []      # [(action_line, source_line, ref_id)]
+        self._buf_bytes = 0
+        self.failed = []    # [{"id":..., "status":..., "error":...}]
+        self.written = {}   # 적재에 성공한 index item: 식별자(ref) → AOSS _id (실패한 레코드 되돌리기용)
+        self.stats = {"requests": 0, "indexed": 0, "retried": 0, "failed": 0}  # indexed: 성공한 item 수(delete 포함)
+
+    def add(self, source: dict, doc_id: str = None, op: str = "index"):
+        meta = {"_index": self.index}
+        if doc_id is not None:
+            meta["_id"] = doc_id
+        action = json.dumps({op: meta}, ensure_ascii=False).encode("utf-8") + b"\n"
+        line = json.dumps(source, ensure_ascii=False).encode("utf-8") + b"\n"
+        size = len(action) + len(line)
+        # 실패 리포트용 식별자: _id 가 없으면 본문의 id 필드
+        self._append((action, line, doc_id if doc_id is not None else source.get("id")), size)
+
+    def delete(self, doc_id: str):
+        """_id 로 문서 삭제 (본문 줄 없음). 이미 없는 문서(404)도 성공으로 본다."""
+        action = json.dumps({"delete": {"_index": self.index, "_id": doc_id}}).encode("utf-8") + b"\n"
+        self._append((action, b"", doc_id), len(action))
+
+    def _append(self, entry, size):
+        batches = []
+        with self._lock:
+            if self._buf and self._buf_bytes + size > self.max_bytes:
+                batches.append(self._take())
+            self._buf.append(entry)
+            self._buf_bytes += size
+            if len(self._buf) >= self.max_docs:
+                batches.append(self._take())
+        for batch in batches:
+            self._send_batch(batch)
+
+    def _take(self):
+        pending, self._buf, self._buf_bytes = self._buf, [], 0
+        return pending
+
+    def flush(self):
+        with self._lock:
+            pending = self._take()
+        self._send_batch(pending)
+
+    def _send_batch(self, pending):
+        attempt = 0
+        while pending:
+            if attempt:
+                self._count("retried", len(pending))
+                time.sleep(self.backoff * (2 ** (attempt - 1)))
+            pending = self._send_once(pending, last=attempt >= self.max_retries)
+            attempt += 1
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self.stats[key] += n
+
+    def _send_once(self, pending, last):
+        body = b"".join(a + s for a, s, _ in pending)
+        self._count("requests")
+        try:
+            resp = self.send(body)
+        except Exception as e:
+            status = _status_of(e)
+            if not last and (status is None or status in RETRYABLE_STATUS):
+                print(f"[BULK] request failed ({status}), retrying {len(pending)} docs: {e}")
+                return pending
+            self._fail_all(pending, status, str(e))
+            return []
+
+        retry = []
+        items = resp.get("items", [])
+        for entry, item in zip(pending, items):
+            op, res = next(iter(item.items()))
+            status = res.get("status", 500)
+            if status < 300 or (op == "delete" and status == 404):
+                self._count("indexed")
+                if op == "index" and res.get("_id") is not None:
+                    with self._lock:
+                        self.written[entry[2]] = res["_id"]
+            elif status in RETRYABLE_STATUS and not last:
+                retry.append(entry)
+            else:
+                self._fail(entry, status, res.get("error"))
+        if len(items) < len(pending):
+            # 응답 item 수가 모자라면 누락분은 실패로 간주해 재시도
+            missing = pending[len(items):]
+            if last:
+                self._fail_all(missing, None, "missing item in bulk response")
+            else:
+                retry.extend(missing)
+        return retry
+
+    def _fail(self, entry, status, error):
+        with self._lock:
+            self.stats["failed"] += 1
+            self.failed.append({"id": entry[2], "status": status, "error": error})
+
+    def _fail_all(self, pending, status, error):
+        for entry in pending:
+            self._fail(entry, status, error)
+
+    def close(self):
+        self.flush()
+        return self.failed
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        return False
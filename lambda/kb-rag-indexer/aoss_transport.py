@@ -0,0 +1,104 @@
+# file: aoss_transport.py
+"""
+AOSS HTTP transport (keep-alive 커넥션 풀 + 자동 갱신 SigV4 서명)
+
+- requests.Session + HTTPAdapter 로 커넥션을 재사용 (pool_size 조정 가능)
+- 요청마다 botocore 자격 증명에서 최신 frozen credentials 를 꺼내 서명하므로
+  warm 컨테이너/장시간 실행 중 세션 토큰이 바뀌어도 403 이 나지 않는다
+- 그래도 만료 토큰으로 403 이 나면 자격 증명을 다시 읽어 1회 재시도
+"""
+
+import json, threading
+import boto3, requests
+from requests.adapters import HTTPAdapter
+from requests_aws4auth import AWS4Auth
+
+
+class RefreshableAWS4Auth(requests.auth.AuthBase):
+    """AWS4Auth 를 자격 증명이 바뀔 때만 다시 만들어 쓰는 스레드 안전 래퍼"""
+
+    def __init__(self, session, region, service="aoss"):
+        self.session = session
+        self.region = region
+        self.service = service
+        self._lock = threading.Lock()
+        self._credentials = session.get_credentials()
+        self._key = None
+        self._auth = None
+
+    def reset(self):
+        """자격 증명 공급자를 처음부터 다시 조회 (만료 토큰으로 403 을 받은 경우)"""
+        with self._lock:
+            self.session = boto3.Session(region_name=self.region)
+            self._credentials = self.session.get_credentials()
+            self._key = None
+
+    def __call__(self, req):
+        with self._lock:
+            # RefreshableCredentials 는 만료 전에 스스로 갱신한다
+            creds = self._credentials.get_frozen_credentials()
+            key = (creds.access_key, creds.secret_key, creds.token)
+            if key != self._key:
+                self._auth = AWS4Auth(creds.access_key, creds.secret_key, self.region,
+                                      self.service, session_token=creds.token)
+                self._key = key
+            return self._auth(req)
+
+
+def _is_expired_token(resp):
+    text = resp.text or ""
+    return resp.status_code == 403 and ("expired" in text.lower() or "security token" in text.lower())
+
+
+class AOSSTransport:
+    """
+    사용 예:
+        aoss = AOSSTransport(endpoint, "kb-rag")
+        r = aoss.get("/kb-rag/_mapping")
+    path 는 엔드포인트 기준 경로 또는 전체 URL.
+    """
+
+    def __init__(self, endpoint, collection, region="us-east-1", session=None,
+                 pool_size=10, timeout=30):
+        self.endpoint = endpoint.rstrip("/")
+        self.collection = collection
+        self.timeout = timeout
+        self.auth = RefreshableAWS4Auth(session or boto3.Session(region_name=region), region)
+        self.http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.http.mount("https://", adapter)
+        self.http.mount("http://", adapter)
+
+    def url(self, path):
+        if path.startswith("http://") or path.startswith("https://"):
+            return path
+        return f"{self.endpoint}/{path.lstrip('/')}"
+
+    def request(self, method, path, data=None, headers=None, **kwargs):
+        hdrs = {"x-amz-collection-name": self.collection}
+        if data is not None:
+            hdrs["Content-Type"] = "application/json"
+            if not isinstance(data, (bytes, str)):
+                data = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        hdrs.update(headers or {})
+        if kwargs.get("auth") is None:
+            kwargs["auth"] = self.auth
+        kwargs.setdefault("timeout", self.timeout)
+        r = self.http.request(method, self.url(path), data=data, headers=hdrs, **kwargs)
+        if _is_expired_token(r) and kwargs["auth"] is self.auth:
+            print("[AOSS] credentials expired, reloading and retrying once")
+            self.auth.reset()
+            r = self.http.request(method, self.url(path), data=data, headers=hdrs, **kwargs)
+        return r
+
+    def get(self, path, **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def put(self, path, data=None, **kwargs):
+        return self.request("PUT", path, data=data, **kwargs)
+
+    def post(self, path, data=None, **kwargs):
+        return self.request("POST", path, data=data, **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.request("DELETE", path, **kwargs)
@@ -1,10 +1,28 @@
-import os, json, urllib.parse
-import boto3, requests
-from requests_aws4auth import AWS4Auth
+import time
+_INIT_T0 = time.perf_counter()
+_INIT_PHASES = []  # [(phase, ms)] 콜드 스타트 시 import 단계별 소요 시간
 
-# WHOAMI 로그 (★ 순서 중요)
-sts = boto3.client("sts")
-print("[WHOAMI]", json.dumps(sts.get_caller_identity()))
+def _mark(phase):
+    global _INIT_T0
+    now = time.perf_counter()
+    _INIT_PHASES.append((phase, round((now - _INIT_T0) * 1000, 1)))
+    _INIT_T0 = now
+
+import os, json, queue, threading, urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+_mark("stdlib")
+import boto3
+from botocore.config import Config
+_mark("boto3")
+from aoss_transport import AOSSTransport  # requests + requests_aws4auth
+_mark("requests")
+from chunker import iter_chunks
+from s3_stream import iter_s3_text, ObjectTooLarge, ObjectChanged
+from text_decode import BinaryContent
+from aoss_bulk import BulkWriter, requests_sender
+from embed_cache import EmbeddingCache, LRUCache, S3Cache
+from bedrock_invoker import get_invoker
+_mark("local_modules")
 
 # 환경변수에서 설정
 REGION = os.environ.get("AWS_REGION", "us-east-1")
@@ -12,30 +30,109 @@ AOSS_ENDPOINT = os.environ["AOSS_ENDPOINT"].rstrip("/")
 INDEX_NAME = os.environ.get("INDEX_NAME", "kb-rag")
 EMBEDDING_MODEL = os.environ.get("EMBEDDING_MODEL", "amazon.titan-embed-text-v2:0")
 COLLECTION_NAME = os.environ["COLLECTION_NAME"]
+# WHOAMI 로그는 STS 왕복이 필요하므로 디버깅할 때만 켠다 (WHOAMI_LOG=1)
+WHOAMI_LOG = os.environ.get("WHOAMI_LOG", "0") == "1"
+BULK_MAX_DOCS = int(os.environ.get("BULK_MAX_DOCS", "200"))
+BULK_MAX_BYTES = int(os.environ.get("BULK_MAX_BYTES", str(5 * 1024 * 1024)))
+# 파이프라인 단계별 동시성: S3 읽기 → Bedrock 임베딩 → AOSS 쓰기
+READ_CONCURRENCY = int(os.environ.get("READ_CONCURRENCY", "4"))
+EMBED_CONCURRENCY = int(os.environ.get("EMBED_CONCURRENCY", "8"))
+WRITE_CONCURRENCY = int(os.environ.get("WRITE_CONCURRENCY", "2"))
+# AOSS keep-alive 커넥션 풀 크기 (쓰기 + 업서트 조회 스레드 수 이상)
+AOSS_POOL_SIZE = int(os.environ.get("AOSS_POOL_SIZE", str(max(10, READ_CONCURRENCY + WRITE_CONCURRENCY))))
+MAX_CHUNKS_PER_DOC = int(os.environ.get("MAX_CHUNKS_PER_DOC", "10000"))
+# S3 스트리밍 읽기: range 크기, 문서 크기 상한과 초과 시 정책 (truncate | stream | reject)
+S3_RANGE_KB = int(os.environ.get("S3_RANGE_KB", "256"))
+MAX_DOC_MB = float(os.environ.get("MAX_DOC_MB", "5"))
+OVERSIZE_POLICY = os.environ.get("OVERSIZE_POLICY", "truncate")
+# 임베딩/쓰기 대기 중인 청크 최대 수 (메모리 상한)
+MAX_INFLIGHT_CHUNKS = int(os.environ.get("MAX_INFLIGHT_CHUNKS", str(EMBED_CONCURRENCY * 4)))
+EMBED_DIM = 1536
+# 임베딩 캐시 백엔드: "lru", "lru,s3", "off"
+EMBED_CACHE = os.environ.get("EMBED_CACHE", "lru")
+EMBED_CACHE_MB = int(os.environ.get("EMBED_CACHE_MB", "64"))
+EMBED_CACHE_S3_BUCKET = os.environ.get("EMBED_CACHE_S3_BUCKET")
+EMBED_CACHE_S3_PREFIX = os.environ.get("EMBED_CACHE_S3_PREFIX", "embed-cache/")
+_mark("config")
+
+# 클라이언트/인증/캐시는 import 시점이 아니라 첫 사용 시 만들고 컨테이너 수명 동안 재사용
+_lazy_lock = threading.Lock()
+_lazy_objs = {}
+_cold = True
+
+def _lazy(name, factory):
+    if name not in _lazy_objs:
+        with _lazy_lock:
+            if name not in _lazy_objs:
+                _lazy_objs[name] = factory()
+    return _lazy_objs[name]
+
+def _s3():
+    return _lazy("s3", lambda: boto3.client("s3", config=Config(max_pool_connections=max(10, READ_CONCURRENCY))))
 
-s3 = boto3.client("s3")
-bedrock = boto3.client("bedrock-runtime", region_name=REGION)
+def _bedrock():
+    # 모델별 속도/AIMD 동시성 제한 + 스로틀링 인지 재시도 (botocore 재시도는 끔)
+    return _lazy("bedrock", lambda: get_invoker(REGION, client=boto3.client(
+        "bedrock-runtime", region_name=REGION,
+        config=Config(max_pool_connections=max(10, EMBED_CONCURRENCY), retries={"total_max_attempts": 1}),
+    ), concurrency=EMBED_CONCURRENCY, max_concurrency=EMBED_CONCURRENCY))
 
-session = boto3.Session()
-creds = session.get_credentials().get_frozen_credentials()  # ← 얼려서 사용하면 안전
-awsauth = AWS4Auth(
-    creds.access_key, creds.secret_key, REGION, "aoss", session_token=creds.token
-)
+def _aoss():
+    # 풀링된 keep-alive 세션 + 요청마다 최신 자격 증명으로 SigV4 서명
+    return _lazy("aoss", lambda: AOSSTransport(AOSS_ENDPOINT, COLLECTION_NAME, region=REGION,
+                                               pool_size=AOSS_POOL_SIZE))
 
-def _read_s3_text(bucket, key, max_mb=5):
-    obj = s3.get_object(Bucket=bucket, Key=key)
-    body = obj["Body"].read()
-    if len(body) > max_mb * 1024 * 1024:
-        body = body[: max_mb * 1024 * 1024]
-    return body.decode("utf-8", errors="ignore")
+def _embed_cache():
+    return _lazy("embed_cache", _make_cache)
+
+def _log_cold_start():
+    """첫 호출(콜드 스타트)에서만 import 단계별 시간과 (옵션) WHOAMI 를 출력"""
+    global _cold
+    if not _cold:
+        return
+    _cold = False
+    total = sum(ms for _, ms in _INIT_PHASES)
+    phases = " ".join(f"{name}={ms}ms" for name, ms in _INIT_PHASES)
+    print(f"[INIT] Init Duration: {total:.1f} ms ({phases})")
+    if WHOAMI_LOG:
+        print("[WHOAMI]", json.dumps(boto3.client("sts").get_caller_identity()))
+
+def _make_cache():
+    backends = []
+    for name in [n.strip() for n in EMBED_CACHE.split(",") if n.strip()]:
+        if name == "off":
+            return None
+        if name == "lru":
+            backends.append(LRUCache(EMBED_CACHE_MB * 1024 * 1024))
+        elif name == "s3":
+            if not EMBED_CACHE_S3_BUCKET:
+                raise RuntimeError("EMBED_CACHE=s3 requires EMBED_CACHE_S3_BUCKET")
+            backends.append(S3Cache(_s3(), EMBED_CACHE_S3_BUCKET, EMBED_CACHE_S3_PREFIX))
+        else:
+            raise RuntimeError(f"Unknown EMBED_CACHE backend: {name}")
+    return EmbeddingCache(backends, EMBEDDING_MODEL, EMBED_DIM) if backends else None
+
+def _iter_s3_text(bucket, key, info=None, version_id=None, etag=None):
+    # 전체를 read() 하지 않고 range 단위로 읽으며 증분 디코딩 (인코딩은 info 에 기록)
+    # 모든 range 를 이벤트가 가리키는 버전(versionId, 없으면 eTag)에 고정해 두 버전이 섞이지 않게 한다
+    return iter_s3_text(
+        _s3(), bucket, key,
+        range_bytes=S3_RANGE_KB * 1024,
+        max_bytes=int(MAX_DOC_MB * 1024 * 1024),
+        policy=OVERSIZE_POLICY,
+        info=info,
+        version_id=version_id,
+        etag=etag,
+    )
 
 def _embed(text: str):
     # Titan v2 모델을 명시적으로 사용하여 1536 차원 임베딩 생성
-    payload = {"inputText": text[:4000]}
+    # 입력 길이는 chunker(CHUNK_SIZE / CHUNK_MAX_TOKENS)에서 이미 제한됨
+    payload = {"inputText": text}
     print(f"[DEBUG] Using embedding model: {EMBEDDING_MODEL}")
     print(f"[DEBUG] Input text length: {len(text)}")
     
-    resp = bedrock.invoke_model(
+    resp = _bedrock().invoke_model(
         modelId=EMBEDDING_MODEL,  # amazon.titan-embed-text-v2:0
         contentType="application/json",
         accept="application/json",
@@ -50,53 +147,242 @@ def _embed(text: str):
     print(f"[DEBUG] Embedding dimension: {len(vector)}")
     
     # 차원 검증 (1536차원으로 변경 - 실제 Titan 출력)
-    if len(vector) != 1536:
-        raise RuntimeError(f"Expected 1536 dimensions, got {len(vector)}. Check embedding model configuration.")
+    if len(vector) != EMBED_DIM:
+        raise RuntimeError(f"Expected {EMBED_DIM} dimensions, got {len(vector)}. Check embedding model configuration.")
     
     return vector
 
-def _index_doc(doc_id: str, text: str, vector):
-    # AOSS Serverless에서는 POST를 사용하고 Document ID를 body에만 포함
-    url = f"{AOSS_ENDPOINT}/{INDEX_NAME}/_doc"
-    body = {"id": doc_id, "content": text, "embedding": vector}
-    
-    # 디버그: 환경변수와 헤더 값 확인
-    collection_name = os.environ.get("COLLECTION_NAME", "kb-rag")
-    print(f"[DEBUG] COLLECTION_NAME env var: '{collection_name}'")
-    print(f"[DEBUG] URL: {url}")
-    print(f"[DEBUG] Headers will include x-amz-collection-name: '{collection_name}'")
-    
-    headers = {
-        "Content-Type": "application/json",
-        "x-amz-collection-name": collection_name,
+def _embed_cached(text: str):
+    # 같은 내용(정규화 텍스트 + 모델 + 차원)은 캐시에서 꺼내고 Bedrock 호출 생략
+    cache = _embed_cache()
+    if cache is None:
+        return _embed(text)
+    return cache.get_or_embed(text, _embed)
+
+def _bulk_writer():
+    # 문서별 POST 대신 _bulk 로 모아서 전송 (문서 수/바이트 한도 도달 시 flush)
+    send = requests_sender(_aoss(), "/_bulk", None, {})
+    return BulkWriter(send, INDEX_NAME, max_docs=BULK_MAX_DOCS, max_bytes=BULK_MAX_BYTES)
+
+def _existing_ids(parent_id: str):
+    """
+    parent_id 에 속한 기존 문서들의 AOSS 내부 _id 목록.
+    VECTORSEARCH 컬렉션은 사용자 지정 _id 를 받지 않으므로, 업서트는
+    '기존 _id 조회 → 새 청크 적재 → 기존 _id 삭제' 순서로 처리한다.
+    (청크 도입 전 문서는 parent_id 없이 id == parent_id 로 저장돼 있어 함께 조회)
+    """
+    body = {
+        "size": MAX_CHUNKS_PER_DOC,
+        "_source": False,
+        "query": {"bool": {"should": [
+            {"term": {"parent_id": parent_id}},
+            {"term": {"id": parent_id}},
+        ]}},
     }
-    
-    # PUT 대신 POST 사용 (AOSS Serverless 요구사항)
-    r = requests.post(url, auth=awsauth, headers=headers, data=json.dumps(body))
-    
-    print(f"[DEBUG] Response status: {r.status_code}")
-    print(f"[DEBUG] Response headers: {dict(r.headers)}")
-    
+    r = _aoss().post(f"/{INDEX_NAME}/_search", data=body)
+    if r.status_code == 404:
+        return []  # 인덱스가 아직 없음
     if r.status_code >= 300:
-        raise RuntimeError(f"AOSS index error {r.status_code}: {r.text}")
+        raise RuntimeError(f"AOSS search error {r.status_code}: {r.text}")
+    return [h["_id"] for h in r.json().get("hits", {}).get("hits", [])]
+
+def _index_doc(writer, doc_id: str, text: str, vector, chunk=None, parent_id=None):
+    # AOSS Serverless에서는 Document ID를 body에만 포함 (_bulk index 액션에 _id 없음)
+    # doc_id 는 s3::bucket/key#chunk_no 로 결정적이며, 이전 버전은 _existing_ids 로 찾아 삭제
+    body = {"id": doc_id, "content": text, "embedding": vector}
+    if chunk is not None:
+        body.update({
+            "parent_id": parent_id,
+            "chunk_no": chunk["chunk_no"],
+            "chunk_start": chunk["start"],
+            "chunk_end": chunk["end"],
+        })
+    writer.add(body)
+
+class _Pipeline:
+    """
+    단계별 스레드 풀 작업의 완료 이벤트를 하나의 큐로 모은다.
+    읽기 스레드가 청크를 만들어 내는 도중에도 임베딩/쓰기 작업을 추가할 수 있다.
+    """
+
+    def __init__(self):
+        self.events = queue.Queue()
+        self._lock = threading.Lock()
+        self._outstanding = 0
+        # 청크 단위 in-flight 상한: 읽기 스레드가 임베딩보다 너무 앞서 나가지 않도록
+        self.slots = threading.BoundedSemaphore(MAX_INFLIGHT_CHUNKS)
+
+    def submit(self, pool, tag, fn, *args):
+        with self._lock:
+            self._outstanding += 1
+        fut = pool.submit(fn, *args)
+        fut.add_done_callback(lambda f: self.events.put((tag, f)))
+
+    def next(self):
+        tag, fut = self.events.get()
+        with self._lock:
+            self._outstanding -= 1
+        return tag, fut
+
+    def busy(self):
+        with self._lock:
+            return self._outstanding > 0
+
+def _read_record(st, on_chunk):
+    """
+    S3 읽기 단계: 기존 _id 를 조회한 뒤 객체를 스트리밍하며 청크가 확정될 때마다 on_chunk 호출.
+    반환: 청크 수 (처리 대상이 아니면 None)
+    """
+    bucket = st["rec"]["s3"]["bucket"]["name"]
+    key = urllib.parse.unquote_plus(st["rec"]["s3"]["object"]["key"])
+
+    if not (key.endswith(".txt") or key.endswith(".md")):
+        print(f"skip non-text {key}")
+        return None
+
+    # 새 청크를 쓰기 전에 조회해야 이번에 쓴 문서가 섞이지 않는다
+    st["stale_ids"] = _existing_ids(st["parent_id"])
+    n = 0
+    obj = st["rec"]["s3"]["object"]
+    for ch in iter_chunks(_iter_s3_text(bucket, key, info=st["encoding"],
+                                        version_id=obj.get("versionId"), etag=obj.get("eTag"))):
+        on_chunk(st, ch)
+        n += 1
+    if st["encoding"]:
+        enc = st["encoding"]
+        print(f"[ENCODING] {st['parent_id']}: {enc['encoding']} (via {enc['method']}, {enc['bytes']} bytes)")
+    if n == 0:
+        print(f"empty text: {key}")
+        return None
+    return n
 
 def lambda_handler(event, context):
+    """
+    레코드별로 S3 스트리밍 읽기 → 청킹/임베딩 → AOSS 쓰기를 단계별 스레드 풀에서 겹쳐 실행.
+    청크는 읽히는 대로 임베딩/쓰기로 흘려보내며, 한 레코드의 실패는 해당 레코드만 error 로
+    기록하고 나머지 배치는 계속 처리한다.
+    """
+    _log_cold_start()
+    writer = _bulk_writer()
+    pipe = _Pipeline()
+    states = []
+    # 같은 객체의 이벤트가 한 배치에 여러 번 오면 마지막(sequencer 가 가장 큰) 것만 처리
+    # (동시에 처리하면 서로의 새 청크를 이전 버전으로 보고 지우거나 중복이 남는다)
+    latest = {}
     for rec in event.get("Records", []):
         bucket = rec["s3"]["bucket"]["name"]
         key = urllib.parse.unquote_plus(rec["s3"]["object"]["key"])
+        parent_id = f"s3::{bucket}/{key}"
+        seq = rec["s3"]["object"].get("sequencer") or ""
+        prev = latest.get(parent_id)
+        if prev is not None:
+            print(f"[DEDUP] {parent_id}: duplicate event in batch, keeping the latest")
+            if (len(seq), seq) < (len(prev[0]), prev[0]):
+                continue
+        latest[parent_id] = (seq, rec)
+    for parent_id, (_, rec) in latest.items():
+        states.append({"rec": rec, "parent_id": parent_id, "status": "pending",
+                       "stale_ids": [], "n_chunks": None, "written": 0, "encoding": {}})
+
+    with ThreadPoolExecutor(READ_CONCURRENCY) as read_pool, \
+         ThreadPoolExecutor(EMBED_CONCURRENCY) as embed_pool, \
+         ThreadPoolExecutor(WRITE_CONCURRENCY) as write_pool:
+
+        def on_chunk(st, ch):
+            # 읽기 스레드에서 호출: in-flight 슬롯을 얻은 뒤 임베딩 단계로 넘김
+            pipe.slots.acquire()
+            pipe.submit(embed_pool, ("embed", st, ch), _embed_cached, ch["text"])
+
+        def finish_if_done(st):
+            if st["status"] == "pending" and st["n_chunks"] is not None and st["written"] == st["n_chunks"]:
+                st["status"] = "queued"
+                print(f"Queued: {st['parent_id']} ({st['n_chunks']} chunks)")
+
+        for st in states:
+            pipe.submit(read_pool, ("read", st, None), _read_record, st, on_chunk)
 
-        if not (key.endswith(".txt") or key.endswith(".md")):
-            print(f"skip non-text {key}")
-            continue
+        while pipe.busy():
+            (stage, st, ch), fut = pipe.next()
+            try:
+                result = fut.result()
+            except Exception as e:
+                if stage != "read":
+                    pipe.slots.release()
+                if st["status"] == "pending":
+                    if isinstance(e, (ObjectTooLarge, BinaryContent)):
+                        st["status"], st["error"] = "rejected", str(e)
+                        print(f"[WARN] {st['parent_id']} rejected: {e}")
+                    elif isinstance(e, ObjectChanged):
+                        # 새 버전의 이벤트가 뒤따르므로 그때 다시 처리된다 (이번에 쓴 청크는 아래에서 되돌림)
+                        st["status"], st["error"], st["retryable"] = "error", f"{stage}: {e}", True
+                        print(f"[RETRY] {st['parent_id']} {stage}: {e}")
+                    else:
+                        st["status"], st["error"] = "error", f"{stage}: {e}"
+                        print(f"[ERROR] {st['parent_id']} {stage} failed: {e}")
+                continue
 
-        text = _read_s3_text(bucket, key)
-        if not text.strip():
-            print(f"empty text: {key}")
-            continue
+            if stage == "read":
+                if result is None:
+                    if st["status"] == "pending":
+                        st["status"] = "skipped"
+                    continue
+                st["n_chunks"] = result
+                print(f"[DEBUG] {st['parent_id']}: {result} chunks read")
+            elif stage == "embed":
+                if st["status"] != "pending":
+                    pipe.slots.release()  # 같은 레코드가 이미 실패: 쓰지 않고 버림
+                    continue
+                pipe.submit(write_pool, ("write", st, ch), _index_doc, writer,
+                            f"{st['parent_id']}#{ch['chunk_no']}", ch["text"], result, ch, st["parent_id"])
+            else:
+                pipe.slots.release()
+                st["written"] += 1
+            finish_if_done(st)
 
-        vec = _embed(text)
-        doc_id = f"s3::{bucket}/{key}"
-        _index_doc(doc_id, text, vec)
-        print(f"Indexed: {doc_id}")
+    failed = writer.close()
+    print(f"[BULK] {json.dumps(writer.stats)}")
+    if _embed_cache() is not None:
+        _embed_cache().log("[CACHE] (container lifetime)")
+    _bedrock().log("[BEDROCK] (container lifetime)")
+    # bulk 실패 item 을 원본 레코드로 되돌려 매핑 (doc_id = parent_id#chunk_no)
+    failed_parents = {}
+    for f in failed:
+        failed_parents.setdefault(str(f["id"]).rsplit("#", 1)[0], f)
+    results = []
+    for st in states:
+        if st["status"] == "queued":
+            f = failed_parents.get(st["parent_id"])
+            if f:
+                err = f"{f['status']} {json.dumps(f['error'], ensure_ascii=False)}"
+                st["status"], st["error"] = "error", f"write: {err}"
+                print(f"[ERROR] {st['parent_id']} write failed: {err}")
+            else:
+                st["status"] = "indexed"
+                print(f"Indexed: {st['parent_id']} ({st['n_chunks']} chunks)")
+        results.append({"id": st["parent_id"], "status": st["status"], "error": st.get("error"),
+                        "retryable": st.get("retryable", False), "encoding": st["encoding"].get("encoding")})
+    # 도중에 실패한 레코드는 이번에 이미 적재된 새 청크를 지워 이전 버전만 남긴다
+    # (핸들러가 예외 없이 반환하므로 S3 비동기 호출은 재시도하지 않는다 → 중복이 그대로 남지 않게)
+    failed_ids = {st["parent_id"] for st in states if st["status"] != "indexed"}
+    partial = [_id for ref, _id in writer.written.items() if str(ref).rsplit("#", 1)[0] in failed_ids]
+    # 새 청크가 모두 적재된 레코드만 이전 버전 청크 삭제 (문서가 줄어든 경우 남는 청크 포함)
+    stale = [(st["parent_id"], _id) for st in states if st["status"] == "indexed" for _id in st["stale_ids"]]
+    if partial:
+        rollback = _bulk_writer()
+        for _id in partial:
+            rollback.delete(_id)
+        failed = rollback.close()
+        print(f"[ROLLBACK] removed {rollback.stats['indexed']} partially written chunks, failed {len(failed)}")
+        for f in failed:
+            print(f"[WARN] partial chunk not removed: {f}")
+    if stale:
+        deleter = _bulk_writer()
+        for _, _id in stale:
+            deleter.delete(_id)
+        failed = deleter.close()
+        print(f"[UPSERT] removed {deleter.stats['indexed']} stale docs, failed {len(failed)}")
+        for f in failed:
+            print(f"[WARN] stale doc not removed: {f}")
 
-    return {"ok": True}
+    errors = [r for r in results if r["status"] == "error"]
+    return {"ok": not errors, "results": results}
@@ -0,0 +1,299 @@
+# file: bedrock_invoker.py
+"""
+Bedrock invoke_model 공용 호출기 (스로틀링 인지)
+
+- 모델 ID별 토큰 버킷으로 초당 요청 수 제한. 버킷이 병목이면 성공마다 +1 rps, 스로틀되면 절반 (AIMD)
+- 모델 ID별 AIMD 동시성 제한: 성공하면 조금씩(+1/limit) 늘리고, 스로틀되면 절반으로 줄인다
+- 지터를 준 지수 백오프 재시도 + 호출기 전체 재시도 예산(성공할 때마다 조금씩 충전)
+- 모델별 호출/스로틀/재시도/지연 시간 카운터
+
+invoke_model(...) / invoke_model_with_response_stream(...) 은 boto3 클라이언트와 같은 시그니처라 기존 `br.invoke_model(...)` 자리에 그대로 쓸 수 있다.
+botocore 자체 재시도는 끄고(total_max_attempts=1) 여기서만 재시도한다.
+"""
+
+import os, random, threading, time
+from collections import deque
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError, ConnectionError as BotoConnectionError, ReadTimeoutError
+
+THROTTLE_CODES = {"ThrottlingException", "TooManyRequestsException"}
+TRANSIENT_CODES = {"ServiceUnavailableException", "InternalServerException", "ModelNotReadyException",
+                   "ModelTimeoutException"}
+# 할당량 자체를 넘은 것 — 기다려도 풀리지 않으므로 속도를 낮추거나 재시도하지 않고 바로 실패
+FATAL_CODES = {"ServiceQuotaExceededException"}
+
+
+def _classify(exc):
+    """"throttle" | "transient" | None(재시도 불가)"""
+    if isinstance(exc, ClientError):
+        err = exc.response.get("Error", {})
+        status = exc.response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+        if err.get("Code") in FATAL_CODES:
+            return None
+        if err.get("Code") in THROTTLE_CODES or status == 429:
+            return "throttle"
+        if err.get("Code") in TRANSIENT_CODES or (status or 0) >= 500:
+            return "transient"
+        return None
+    if isinstance(exc, (BotoConnectionError, ReadTimeoutError)):
+        return "transient"
+    return None
+
+
+class TokenBucket:
+    """
+    초당 요청 수 제한. rate 도 AIMD 로 움직인다:
+    버킷 때문에 기다린 뒤 성공하면 +step, 스로틀되면 ×decrease (min_rate ~ max_rate)
+    """
+
+    def __init__(self, rate, burst=None, max_rate=None, min_rate=0.5, step=1.0, decrease=0.5):
+        self.rate = float(rate)
+        self.burst = burst
+        self.max_rate = float(max(max_rate or rate, rate))
+        self.min_rate = min(min_rate, self.rate)
+        self.step = step
+        self.decrease = decrease
+        self._tokens = self._capacity()
+        self._limited = False  # 마지막 조정 이후 버킷 때문에 기다린 적이 있는지
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _capacity(self):
+        return float(self.burst or max(1.0, self.rate))
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self._capacity(), self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                self._limited = True
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def on_success(self):
+        # 버킷이 병목일 때만 올린다 (동시성이 병목이면 rate 가 끝없이 커지지 않게)
+        with self._lock:
+            if self._limited:
+                self.rate = min(self.max_rate, self.rate + self.step)
+                self._limited = False
+
+    def on_throttle(self):
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            self._tokens = min(self._tokens, self._capacity())
+
+
+class AIMDLimiter:
+    def __init__(self, initial, min_limit=1, max_limit=64, decrease=0.5):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease = decrease
+        self._inflight = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self._inflight >= max(1, int(self.limit)):
+                self._cond.wait()
+            self._inflight += 1
+
+    def release(self, outcome="ok"):
+        """outcome: "ok" → 가산 증가, "throttle" → 승산 감소, 그 외 오류 → 그대로"""
+        with self._cond:
+            self._inflight -= 1
+            if outcome == "throttle":
+                self.limit = max(self.min_limit, self.limit * self.decrease)
+            elif outcome == "ok":
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            self._cond.notify_all()
+
+
+class RetryBudget:
+    """재시도 1회마다 토큰 1개 소비, 성공 1회마다 refill 만큼 충전 (재시도 폭주 방지)"""
+
+    def __init__(self, max_tokens=50, refill=0.1):
+        self.max_tokens = float(max_tokens)
+        self.refill = refill
+        self._tokens = float(max_tokens)
+        self._lock = threading.Lock()
+
+    def withdraw(self):
+        with self._lock:
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+    def deposit(self):
+        with self._lock:
+            self._tokens = min(self.max_tokens, self._tokens + self.refill)
+
+
+class _ModelState:
+    def __init__(self, rate, burst, concurrency, max_concurrency, max_rate=None):
+        self.bucket = TokenBucket(rate, burst, max_rate) if rate else None
+        self.limiter = AIMDLimiter(concurrency, max_limit=max_concurrency)
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=1000)
+        self.counts = {"calls": 0, "ok": 0, "throttles": 0, "retries": 0, "errors": 0}
+
+    def count(self, key, latency=None):
+        with self.lock:
+            self.counts[key] += 1
+            if latency is not None:
+                self.latencies.append(latency)
+
+
+def _pct(values, p):
+    if not values:
+        return None
+    s = sorted(values)
+    return round(s[min(len(s) - 1, int(len(s) * p))] * 1000, 1)
+
+
+class BedrockInvoker:
+    def __init__(self, client, rate=10.0, burst=None, rates=None, concurrency=8, max_concurrency=32,
+                 max_attempts=6, base_delay=0.25, max_delay=20.0, retry_budget=50, max_rate=200.0):
+        self.client = client
+        self.rate = rate                  # 초기 초당 요청 수 (성공하면 max_rate 까지 늘고 스로틀되면 줄어든다)
+        self.max_rate = max_rate
+        self.burst = burst
+        self.rates = rates or {}          # 모델별 초기 초당 요청 수 override
+        self.concurrency = concurrency
+        self.max_concurrency = max_concurrency
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = RetryBudget(retry_budget)
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def _state(self, model_id):
+        with self._lock:
+            st = self._models.get(model_id)
+            if st is None:
+                st = self._models[model_id] = _ModelState(
+                    self.rates.get(model_id, self.rate), self.burst, self.concurrency, self.max_concurrency,
+                    self.max_rate)
+            return st
+
+    def tune(self, model_id, concurrency, rate=None):
+        """
+        대량 작업용: model_id 의 동시성 제한을 concurrency 로 맞추고 (상한도 최소 concurrency)
+        초기 초당 요청 수를 rate (기본: concurrency * 4, 호출당 ~250ms 가정) 이상으로 올린다. 이후는 AIMD 가 조정.
+        """
+        st = self._state(model_id)
+        with st.limiter._cond:
+            st.limiter.max_limit = max(st.limiter.max_limit, concurrency)
+            st.limiter.limit = float(concurrency)
+            st.limiter._cond.notify_all()
+        if st.bucket:
+            with st.bucket._lock:
+                st.bucket.max_rate = max(st.bucket.max_rate, rate or concurrency * 4.0)
+                st.bucket.rate = max(st.bucket.rate, min(st.bucket.max_rate, rate or concurrency * 4.0))
+
+    def call(self, model_id, fn, *args, **kwargs):
+        """fn(*args, **kwargs) 를 model_id 의 속도/동시성 제한과 재시도 정책 아래에서 실행"""
+        st = self._state(model_id)
+        attempt = 0
+        while True:
+            if st.bucket:
+                st.bucket.acquire()
+            st.limiter.acquire()
+            st.count("calls")
+            t0 = time.perf_counter()
+            try:
+                res = fn(*args, **kwargs)
+            except Exception as e:
+                kind = _classify(e)
+                st.limiter.release(kind or "error")
+                if kind == "throttle" and st.bucket:
+                    st.bucket.on_throttle()
+                st.count("throttles" if kind == "throttle" else "errors")
+                attempt += 1
+                if kind is None or attempt >= self.max_attempts or not self.budget.withdraw():
+                    raise
+                st.count("retries")
+                # full jitter: 0 ~ min(max_delay, base * 2^attempt)
+                time.sleep(random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt))))
+                continue
+            st.limiter.release("ok")
+            if st.bucket:
+                st.bucket.on_success()
+            st.count("ok", time.perf_counter() - t0)
+            self.budget.deposit()
+            return res
+
+    def invoke_model(self, **kwargs):
+        return self.call(kwargs["modelId"], self.client.invoke_model, **kwargs)
+
+    def invoke_model_with_response_stream(self, **kwargs):
+        """
+        스트리밍 호출. 제한/재시도는 스트림을 여는 요청까지만 적용되고
+        (res["body"] 이벤트를 읽는 도중의 오류는 재시도하지 않는다) 동시성 슬롯도 그때 반납된다.
+        """
+        return self.call(kwargs["modelId"], self.client.invoke_model_with_response_stream, **kwargs)
+
+    def stats(self):
+        out = {}
+        with self._lock:
+            models = dict(self._models)
+        for model_id, st in models.items():
+            with st.lock:
+                lat = list(st.latencies)
+                out[model_id] = dict(st.counts, p50_ms=_pct(lat, 0.5), p95_ms=_pct(lat, 0.95),
+                                     concurrency_limit=round(st.limiter.limit, 2),
+                                     rate_limit=round(st.bucket.rate, 1) if st.bucket else None)
+        return out
+
+    def log(self, prefix="[BEDROCK]", file=None):
+        for model_id, s in self.stats().items():
+            print(f"{prefix} {model_id} {s}", file=file)
+
+
+def _env_rates():
+    # BEDROCK_RATES="amazon.titan-embed-text-v1=20,anthropic.claude-3-sonnet-20240229-v1:0=1"
+    rates = {}
+    for item in os.environ.get("BEDROCK_RATES", "").split(","):
+        if "=" in item:
+            model_id, rps = item.rsplit("=", 1)
+            rates[model_id.strip()] = float(rps)
+    return rates
+
+
+_invokers = {}
+_invokers_lock = threading.Lock()
+
+
+def get_invoker(region="us-east-1", client=None, **kwargs):
+    """
+    리전별 공유 호출기. 같은 프로세스의 모듈들(agent_plan/act/observe, embed ...)이
+    모델별 속도 제한과 재시도 예산을 공유한다. 설정은 첫 호출 시 kwargs 또는 환경 변수로.
+    """
+    with _invokers_lock:
+        inv = _invokers.get(region)
+        if inv is None:
+            concurrency = int(os.environ.get("BEDROCK_CONCURRENCY", "8"))
+            if client is None:
+                client = boto3.client("bedrock-runtime", region_name=region, config=Config(
+                    retries={"total_max_attempts": 1},
+                    max_pool_connections=max(10, concurrency * 2),
+                ))
+            opts = {
+                "rate": float(os.environ.get("BEDROCK_RPS", "10")),
+                "max_rate": float(os.environ.get("BEDROCK_MAX_RPS", "200")),
+                "rates": _env_rates(),
+                "concurrency": concurrency,
+                "max_concurrency": int(os.environ.get("BEDROCK_MAX_CONCURRENCY", "32")),
+                "max_attempts": int(os.environ.get("BEDROCK_MAX_ATTEMPTS", "6")),
+                "retry_budget": int(os.environ.get("BEDROCK_RETRY_BUDGET", "50")),
+            }
+            opts.update(kwargs)
+            inv = _invokers[region] = BedrockInvoker(client, **opts)
+        return inv
@@ -0,0 +1,149 @@
+# file: chunker.py
+"""
+문서 청킹 (Markdown 헤딩 → 문단 → 문장 → 고정 길이 순으로 분할)
+
+긴 문서를 임베딩 모델 입력 한도 안에 들어가는 조각으로 나누고,
+각 조각의 원문 오프셋(start, end)을 함께 돌려준다.
+"""
+
+import os, re
+
+CHUNK_SIZE = int(os.environ.get("CHUNK_SIZE", "1500"))            # 청크 최대 글자 수
+CHUNK_OVERLAP = int(os.environ.get("CHUNK_OVERLAP", "150"))       # 이전 청크와 겹칠 최대 글자 수
+CHUNK_MAX_TOKENS = int(os.environ.get("CHUNK_MAX_TOKENS", "1024"))  # 청크당 추정 토큰 상한
+
+_HEADING = re.compile(r"^#{1,6}[ \t]+\S", re.MULTILINE)
+# 분할 단계: 문단(빈 줄) → 문장(한/영 문장부호, 줄바꿈)
+_SPLITTERS = [
+    re.compile(r"\n[ \t]*\n\s*"),
+    re.compile(r"(?<=[.!?。！？])\s+|\n+"),
+]
+_WIDE = re.compile(r"[ᄀ-ᇿ぀-ヿ㄰-㆏㐀-鿿가-힯]")
+
+
+def estimate_tokens(text: str) -> int:
+    """한글/CJK 문자는 1자≈1토큰, 그 외는 4자≈1토큰으로 어림잡는다."""
+    wide = len(_WIDE.findall(text))
+    return wide + (len(text) - wide + 3) // 4
+
+
+def _fits(text, size, max_tokens):
+    return len(text) <= size and estimate_tokens(text) <= max_tokens
+
+
+def _pieces(text, s, e, pattern):
+    """[s, e) 구간을 구분자 뒤에서 잘라 빈틈없이 이어지는 하위 구간으로 나눈다."""
+    out, cur = [], s
+    for m in pattern.finditer(text, s, e):
+        if m.end() > cur and m.start() > s:
+            out.append((cur, m.end()))
+            cur = m.end()
+    if cur < e:
+        out.append((cur, e))
+    return out
+
+
+def _hard_split(text, s, e, size, max_tokens, out):
+    while s < e:
+        end = min(e, s + size)
+        while end > s + 1 and not _fits(text[s:end], size, max_tokens):
+            end = s + (end - s) // 2 if end - s > 64 else end - 1
+        if end < e:
+            # 가능하면 공백에서 자른다
+            ws = text.rfind(" ", s + (end - s) // 2, end)
+            if ws > s:
+                end = ws + 1
+        out.append((s, end))
+        s = end
+
+
+def _split_span(text, s, e, size, max_tokens, level, out):
+    if _fits(text[s:e], size, max_tokens):
+        out.append((s, e))
+    elif level < len(_SPLITTERS):
+        for ps, pe in _pieces(text, s, e, _SPLITTERS[level]):
+            _split_span(text, ps, pe, size, max_tokens, level + 1, out)
+    else:
+        _hard_split(text, s, e, size, max_tokens, out)
+
+
+def _units(text, size, max_tokens):
+    starts = [m.start() for m in _HEADING.finditer(text)]
+    bounds = sorted(set([0] + starts + [len(text)]))
+    units = []
+    for s, e in zip(bounds, bounds[1:]):
+        _split_span(text, s, e, size, max_tokens, 0, units)
+    return units
+
+
+def _trim(text, s, e):
+    while s < e and text[s].isspace():
+        s += 1
+    while e > s and text[e - 1].isspace():
+        e -= 1
+    return s, e
+
+
+def chunk_text(text: str, size: int = None, overlap: int = None, max_tokens: int = None):
+    """
+    text를 청크 리스트로 변환.
+    반환: [{"chunk_no": 0, "start": 0, "end": 1234, "text": "..."}, ...]
+    start/end는 원문 text 기준 오프셋이며 text[start:end] == chunk["text"].
+    """
+    size = size or CHUNK_SIZE
+    overlap = CHUNK_OVERLAP if overlap is None else overlap
+    max_tokens = max_tokens or CHUNK_MAX_TOKENS
+    if overlap >= size:
+        raise ValueError(f"overlap({overlap}) must be smaller than size({size})")
+
+    units = _units(text, size, max_tokens)
+    spans = []
+    cur = []  # 현재 청크를 구성하는 unit 목록
+    for u in units:
+        if cur and not _fits(text[cur[0][0]:u[1]], size, max_tokens):
+            spans.append((cur[0][0], cur[-1][1]))
+            # 직전 청크 꼬리에서 overlap 이내의 unit들을 다음 청크 앞에 다시 싣는다
+            tail = []
+            for t in reversed(cur):
+                if cur[-1][1] - t[0] > overlap or not _fits(text[t[0]:u[1]], size, max_tokens):
+                    break
+                tail.insert(0, t)
+            cur = tail
+        cur.append(u)
+    if cur:
+        spans.append((cur[0][0], cur[-1][1]))
+
+    chunks = []
+    for s, e in spans:
+        s, e = _trim(text, s, e)
+        if s == e:
+            continue
+        chunks.append({"chunk_no": len(chunks), "start": s, "end": e, "text": text[s:e]})
+    return chunks
+
+
+def iter_chunks(pieces, size: int = None, overlap: int = None, max_tokens: int = None):
+    """
+    텍스트 조각(iterable)을 받아 도착하는 대로 청크를 내보내는 스트리밍 버전.
+    버퍼 끝쪽 size 글자 안에 걸친 청크는 다음 조각에 따라 바뀔 수 있어 보류하고,
+    나머지는 확정해 yield 한다. 오프셋은 전체 스트림 기준.
+    """
+    size = size or CHUNK_SIZE
+    buf, base, n = "", 0, 0
+    for piece in pieces:
+        buf += piece
+        if len(buf) < 4 * size:
+            continue
+        safe = len(buf) - size
+        keep_from = len(buf)
+        for ch in chunk_text(buf, size, overlap, max_tokens):
+            if ch["end"] > safe:
+                keep_from = ch["start"]  # overlap 포함 시작점부터 다시 청킹
+                break
+            yield {"chunk_no": n, "start": base + ch["start"], "end": base + ch["end"], "text": ch["text"]}
+            n += 1
+        base += keep_from
+        buf = buf[keep_from:]
+    for ch in chunk_text(buf, size, overlap, max_tokens):
+        yield {"chunk_no": n, "start": base + ch["start"], "end": base + ch["end"], "text": ch["text"]}
+        n += 1
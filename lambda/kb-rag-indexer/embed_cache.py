@@ -0,0 +1,167 @@
+# file: embed_cache.py
+"""
+콘텐츠 해시 기반 임베딩 캐시
+
+키 = sha256(정규화된 텍스트 + 모델 ID + 차원). 같은 내용이 다시 업로드되면 Bedrock 호출 없이
+캐시된 벡터를 돌려준다. 백엔드는 앞에서부터 조회하고, 뒤쪽에서 찾으면 앞쪽 백엔드에 채워 넣는다.
+  - LRUCache:    프로세스 메모리 (warm Lambda 컨테이너 재사용)
+  - SQLiteCache: 로컬 파일 (CLI 도구)
+  - S3Cache:     S3 객체 (Lambda 컨테이너 간 공유)
+"""
+
+import hashlib, sqlite3, threading, unicodedata
+from array import array
+from collections import OrderedDict
+
+
+def normalize_text(text: str) -> str:
+    """NFC 정규화 + 줄바꿈 통일 + 줄 끝 공백 제거 (내용이 같으면 같은 키가 되도록)"""
+    text = unicodedata.normalize("NFC", text).replace("\r\n", "\n").replace("\r", "\n")
+    return "\n".join(line.rstrip() for line in text.split("\n")).strip()
+
+
+def _pack(vec) -> bytes:
+    return array("f", vec).tobytes()
+
+
+def _unpack(data: bytes):
+    a = array("f")
+    a.frombytes(data)
+    return a.tolist()
+
+
+class LRUCache:
+    """벡터를 float32 bytes 로 보관하고, 합계가 max_bytes 를 넘으면 오래된 것부터 버린다"""
+    name = "lru"
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._bytes = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            data = self._data.get(key)
+            if data is None:
+                return None
+            self._data.move_to_end(key)
+        return _unpack(data)
+
+    def put(self, key, vec):
+        data = _pack(vec)
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._data[key] = data
+            self._bytes += len(data)
+            while self._bytes > self.max_bytes and len(self._data) > 1:
+                self._bytes -= len(self._data.popitem(last=False)[1])
+
+
+class SQLiteCache:
+    name = "sqlite"
+
+    def __init__(self, path=".embed_cache.sqlite"):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vec BLOB NOT NULL)")
+        self._db.commit()
+
+    def get(self, key):
+        with self._lock:
+            row = self._db.execute("SELECT vec FROM embeddings WHERE key = ?", (key,)).fetchone()
+        return _unpack(row[0]) if row else None
+
+    def put(self, key, vec):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO embeddings (key, vec) VALUES (?, ?)", (key, _pack(vec)))
+            self._db.commit()
+
+
+class S3Cache:
+    name = "s3"
+
+    def __init__(self, s3, bucket, prefix="embed-cache/"):
+        self.s3 = s3
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def _key(self, key):
+        return f"{self.prefix}{key[:2]}/{key}.f32"
+
+    def get(self, key):
+        try:
+            obj = self.s3.get_object(Bucket=self.bucket, Key=self._key(key))
+        except self.s3.exceptions.ClientError as e:
+            # s3:ListBucket 이 없으면 없는 키도 404 대신 403 → 둘 다 캐시 미스
+            if e.response.get("Error", {}).get("Code") in ("NoSuchKey", "404", "AccessDenied", "403"):
+                return None
+            raise
+        return _unpack(obj["Body"].read())
+
+    def put(self, key, vec):
+        self.s3.put_object(Bucket=self.bucket, Key=self._key(key), Body=_pack(vec))
+
+
+class EmbeddingCache:
+    def __init__(self, backends, model_id, dim):
+        self.backends = list(backends)
+        self.model_id = model_id
+        self.dim = dim
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0}
+        for b in self.backends:
+            self.stats[f"hits_{b.name}"] = 0
+
+    def key(self, text: str) -> str:
+        h = hashlib.sha256()
+        h.update(normalize_text(text).encode("utf-8"))
+        h.update(f"\0{self.model_id}\0{self.dim}".encode("utf-8"))
+        return h.hexdigest()
+
+    def _count(self, *keys):
+        with self._lock:
+            for k in keys:
+                self.stats[k] += 1
+
+    def get(self, text: str):
+        k = self.key(text)
+        for i, b in enumerate(self.backends):
+            try:
+                vec = b.get(k)
+            except Exception as e:
+                print(f"[CACHE] {b.name} get failed: {e}")
+                continue
+            if vec is not None:
+                self._count("hits", f"hits_{b.name}")
+                for upper in self.backends[:i]:
+                    self._safe_put(upper, k, vec)
+                return vec
+        self._count("misses")
+        return None
+
+    def put(self, text: str, vec):
+        k = self.key(text)
+        for b in self.backends:
+            self._safe_put(b, k, vec)
+
+    def _safe_put(self, backend, key, vec):
+        # 캐시 저장 실패는 인덱싱을 막지 않는다
+        try:
+            backend.put(key, vec)
+        except Exception as e:
+            print(f"[CACHE] {backend.name} put failed: {e}")
+
+    def get_or_embed(self, text: str, embed_fn):
+        vec = self.get(text)
+        if vec is None:
+            vec = embed_fn(text)
+            self.put(text, vec)
+        return vec
+
+    def log(self, prefix="[CACHE]"):
+        total = self.stats["hits"] + self.stats["misses"]
+        rate = self.stats["hits"] / total if total else 0.0
+        print(f"{prefix} {self.stats} hit_rate={rate:.2%}")
@@ -0,0 +1,101 @@
+# file: embed_parallel.py
+"""
+로컬 빌더(faiss_build, aoss_index_docs)용 순서 보존 병렬 임베딩
+
+Titan 호출은 대부분 네트워크 대기(100~300ms)이므로 스레드 풀로 동시에 보내고,
+결과는 입력 순서대로 batch_size 개씩 묶어 흘려보낸다 (쓰기 쪽은 받은 묶음부터 바로 처리).
+미리 보내 두는 요청은 concurrency * 4 개까지 — 문서가 많아도 벡터가 메모리에 쌓이지 않는다.
+스로틀은 embed_fn 이 쓰는 bedrock_invoker 가 처리한다 (AIMD 동시성 + 재시도 예산).
+
+    for start, vecs in embed_ordered(texts, embed, concurrency=8, batch_size=256):
+        writer(texts[start:start + len(vecs)], vecs)
+"""
+
+import sys, time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class EmbedProgress:
+    """처리량(docs/s), 임베딩 지연 p95, 남은 시간. interval 초마다 한 줄 출력"""
+
+    def __init__(self, total=None, prefix="[EMBED]", interval=5.0, file=None):
+        self.total = total
+        self.prefix = prefix
+        self.interval = interval
+        self.file = file
+        self.done = 0
+        self._lat = deque(maxlen=10000)
+        self._t0 = self._last = time.perf_counter()
+
+    def add(self, seconds):
+        self.done += 1
+        self._lat.append(seconds)
+        now = time.perf_counter()
+        if self.interval and now - self._last >= self.interval:
+            self._last = now
+            self.log()
+
+    def stats(self):
+        elapsed = time.perf_counter() - self._t0
+        lat = sorted(self._lat)
+        rate = self.done / elapsed if elapsed else 0.0
+        out = {"done": self.done, "elapsed_s": round(elapsed, 1), "docs_per_s": round(rate, 1),
+               "p95_ms": round(lat[min(len(lat) - 1, int(len(lat) * 0.95))] * 1000, 1) if lat else None}
+        if self.total:
+            out["total"] = self.total
+            out["eta_s"] = round((self.total - self.done) / rate, 1) if rate else None
+        return out
+
+    def log(self):
+        s = self.stats()
+        count = f"{s['done']}/{s['total']}" if self.total else str(s["done"])
+        eta = f" eta={s['eta_s']}s" if s.get("eta_s") is not None else ""
+        print(f"{self.prefix} {count} docs {s['docs_per_s']} docs/s p95={s['p95_ms']}ms "
+              f"elapsed={s['elapsed_s']}s{eta}", file=self.file or sys.stdout, flush=True)
+
+
+def _timed(fn, text):
+    t = time.perf_counter()
+    vec = fn(text)
+    return vec, time.perf_counter() - t
+
+
+def embed_ordered(texts, embed_fn, concurrency=8, batch_size=256, progress=None):
+    """
+    texts 를 concurrency 개 스레드로 임베딩해 입력 순서대로 (start, [vec, ...]) 묶음을 yield.
+    하나라도 실패하면 (invoker 재시도 후) 남은 요청을 취소하고 예외를 그대로 올린다.
+    """
+    it = iter(texts)
+    window = max(1, concurrency) * 4
+    pending = deque()
+    pool = ThreadPoolExecutor(max(1, concurrency))
+
+    def fill():
+        while len(pending) < window:
+            try:
+                text = next(it)
+            except StopIteration:
+                return
+            pending.append(pool.submit(_timed, embed_fn, text))
+
+    try:
+        fill()
+        start, batch = 0, []
+        while pending:
+            vec, seconds = pending.popleft().result()
+            fill()
+            if progress is not None:
+                progress.add(seconds)
+            batch.append(vec)
+            if len(batch) >= batch_size:
+                yield start, batch
+                start, batch = start + len(batch), []
+        if batch:
+            yield start, batch
+    finally:
+        for fut in pending:
+            fut.cancel()
+        pool.shutdown(wait=True)
+        if progress is not None:
+            progress.log()
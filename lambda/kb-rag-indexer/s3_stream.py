@@ -0,0 +1,85 @@
+# file: s3_stream.py
+"""
+S3 객체를 Range GET 으로 나눠 읽으며 증분 디코딩한 텍스트 조각을 흘려보낸다.
+인코딩은 첫 range 로 판별한다 (text_decode.detect_encoding).
+
+객체 전체를 메모리에 올리지 않으므로 피크 메모리는 range 크기(+청크 버퍼)로 제한된다.
+크기 상한(max_bytes)을 넘는 객체는 policy 에 따라 처리:
+  - "truncate": 앞 max_bytes 만 읽음 (나머지는 다운로드하지 않음)
+  - "stream":   상한 없이 끝까지 스트리밍 (청크는 도착하는 대로 파이프라인으로 흘려보냄. 예전 이름 "fanout")
+  - "reject":   ObjectTooLarge 예외
+
+range 들이 같은 객체 버전을 읽도록 version_id 가 있으면 VersionId 로, 없으면 첫 응답(또는 이벤트)의
+ETag 를 IfMatch 로 고정한다. 읽는 도중 객체가 덮어써지면 ObjectChanged (412).
+"""
+
+import re
+from botocore.exceptions import ClientError
+from text_decode import incremental_decoder
+
+POLICIES = ("truncate", "stream", "reject")
+
+
+class ObjectTooLarge(RuntimeError):
+    pass
+
+
+class ObjectChanged(RuntimeError):
+    """읽는 도중 객체가 새 버전으로 바뀜 — 레코드를 다시 처리하면 된다"""
+
+
+def _total_size(obj):
+    # ContentRange: "bytes 0-262143/5242880"
+    m = re.search(r"/(\d+)$", obj.get("ContentRange") or "")
+    return int(m.group(1)) if m else obj["ContentLength"]
+
+
+def iter_s3_text(s3, bucket, key, range_bytes=256 * 1024, max_bytes=None, policy="truncate", info=None,
+                 version_id=None, etag=None):
+    """
+    info 에 dict 를 넘기면 판별된 인코딩을 {"encoding":..., "method":..., "bytes":...} 로 채운다.
+    version_id / etag: S3 이벤트의 object.versionId / eTag (있으면 그 버전만 읽음)
+    """
+    info = {} if info is None else info
+    policy = "stream" if policy == "fanout" else policy
+    if policy not in POLICIES:
+        raise ValueError(f"Unknown oversize policy: {policy}")
+    start, total, decoder = 0, None, None
+    while total is None or start < total:
+        end = start + range_bytes - 1
+        if max_bytes and policy == "truncate":
+            end = min(end, max_bytes - 1)
+        pin = {"VersionId": version_id} if version_id else {"IfMatch": etag} if etag else {}
+        try:
+            obj = s3.get_object(Bucket=bucket, Key=key, Range=f"bytes={start}-{end}", **pin)
+        except ClientError as e:
+            code = e.response.get("Error", {}).get("Code")
+            if code == "InvalidRange":
+                return  # 빈 객체
+            if code in ("PreconditionFailed", "412"):
+                raise ObjectChanged(f"s3://{bucket}/{key} changed while reading (ETag {etag})") from e
+            raise
+        etag = etag or obj.get("ETag")
+        if total is None:
+            total = _total_size(obj)
+            if max_bytes and total > max_bytes:
+                if policy == "reject":
+                    raise ObjectTooLarge(f"s3://{bucket}/{key} is {total} bytes (limit {max_bytes})")
+                if policy == "truncate":
+                    print(f"[WARN] s3://{bucket}/{key} is {total} bytes, truncating to {max_bytes}")
+                    total = max_bytes
+        data = obj["Body"].read()
+        if not data:
+            break
+        if decoder is None:
+            decoder, info["encoding"], info["method"] = incremental_decoder(data)
+        start += len(data)
+        info["bytes"] = start
+        text = decoder.decode(data, final=start >= total)
+        if text:
+            yield text
+
+
+def read_s3_text(s3, bucket, key, **kwargs):
+    """전체 텍스트가 필요한 곳(작은 객체)용"""
+    return "".join(iter_s3_text(s3, bucket, key, **kwargs))
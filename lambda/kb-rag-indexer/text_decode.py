@@ -0,0 +1,81 @@
+# file: text_decode.py
+"""
+업로드 문서 인코딩 판별
+
+1) BOM 이 있으면 즉시 결정 (UTF-8-SIG / UTF-16 / UTF-32)
+2) BOM 없는 UTF-16 은 짝수/홀수 바이트 위치의 NUL 비율로 판별
+3) 앞부분이 UTF-8 로 엄격하게 디코딩되면 UTF-8
+4) 그래도 애매할 때만 charset_normalizer 사용 (예: CP949 로 저장된 한글 문서)
+NUL 이 섞여 있는데 UTF-16 패턴도 아니면 바이너리로 보고 거부한다.
+"""
+
+import codecs
+
+# 판별에 쓰는 앞부분 바이트 수
+SNIFF_BYTES = 64 * 1024
+
+_BOMS = [
+    (codecs.BOM_UTF32_LE, "utf-32"),
+    (codecs.BOM_UTF32_BE, "utf-32"),
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+]
+
+
+class BinaryContent(ValueError):
+    pass
+
+
+def _utf16_without_bom(head: bytes):
+    if len(head) < 4:
+        return None
+    even = head[0::2].count(0) / len(head[0::2])
+    odd = head[1::2].count(0) / len(head[1::2])
+    # ASCII 위주 UTF-16LE 는 홀수 위치가, UTF-16BE 는 짝수 위치가 대부분 NUL
+    if odd > 0.3 and even < 0.05:
+        return "utf-16-le"
+    if even > 0.3 and odd < 0.05:
+        return "utf-16-be"
+    return None
+
+
+def _is_utf8(head: bytes) -> bool:
+    try:
+        # 잘린 마지막 멀티바이트 문자는 허용 (final=False)
+        codecs.getincrementaldecoder("utf-8")(errors="strict").decode(head, final=False)
+        return True
+    except UnicodeDecodeError:
+        return False
+
+
+def detect_encoding(head: bytes):
+    """
+    반환: (encoding, method)  method ∈ {"bom", "heuristic", "charset_normalizer", "default"}
+    바이너리로 보이면 BinaryContent 예외.
+    """
+    head = head[:SNIFF_BYTES]
+    for bom, enc in _BOMS:
+        if head.startswith(bom):
+            return enc, "bom"
+
+    enc = _utf16_without_bom(head)
+    if enc:
+        return enc, "heuristic"
+    if b"\x00" in head:
+        raise BinaryContent(f"NUL bytes without UTF-16 pattern ({head.count(0)} in {len(head)} bytes)")
+    if _is_utf8(head):
+        return "utf-8", "heuristic"
+
+    # 애매한 경우에만 (import 비용 포함) charset_normalizer 사용
+    from charset_normalizer import from_bytes
+    best = from_bytes(head).best()
+    if best is not None:
+        return best.encoding, "charset_normalizer"
+    return "utf-8", "default"
+
+
+def incremental_decoder(head: bytes):
+    """(decoder, encoding, method) — decoder 는 codecs IncrementalDecoder"""
+    enc, method = detect_encoding(head)
+    return codecs.getincrementaldecoder(enc)(errors="ignore"), enc, method
@@ -1,6 +1,7 @@
 # list_indices.py
-import os, argparse, requests, boto3
-from requests_aws4auth import AWS4Auth
+import os, argparse, boto3
+import indexer_path  # noqa: F401
+from aoss_transport import AOSSTransport
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--endpoint", required=True)     # e.g. https://<id>.us-east-1.aoss.amazonaws.com
@@ -12,13 +13,9 @@ args = parser.parse_args()
 session = boto3.Session(profile_name=args.profile, region_name=args.region) if args.profile \
     else boto3.Session(region_name=args.region)
 
-creds = session.get_credentials().get_frozen_credentials()
-awsauth = AWS4Auth(creds.access_key, creds.secret_key, args.region, "aoss", session_token=creds.token)
+aoss = AOSSTransport(args.endpoint, args.collection, region=args.region, session=session)
 
-url = f"{args.endpoint.rstrip('/')}/_cat/indices?v"
-headers = {"x-amz-collection-name": args.collection}
-
-r = requests.get(url, auth=awsauth, headers=headers)
+r = aoss.get("/_cat/indices?v")
 print(r.status_code)
 print(r.text)
 if r.status_code == 403:
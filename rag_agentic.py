@@ -1,44 +1,130 @@
 # file: rag_agentic.py
-import argparse
+import argparse, os, sys, time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from agent_plan import plan
-from agent_act import load_index, search, answer_with_context
-from agent_observe import observe
+from agent_act import load_index, search_many, merge_rrf, doc_key, answer_with_context
+from kb_lexical import LexicalIndex
+from agent_observe import observe_gated, GATE_STATS
+import agent_router
 from embed_titan_basic import embed  # 이미 만든 임베딩 함수 재사용
 
 MAX_ITERS = 3
+# 설정하면 kb_server.py 데몬에서 검색 (인덱스를 매번 읽지 않음). 예: http://127.0.0.1:8765
+KB_SERVER = os.getenv("KB_SERVER")
+# 계획된 질의들을 동시에 임베딩/원격 검색할 스레드 수
+_query_pool = ThreadPoolExecutor(int(os.getenv("AGENT_QUERY_CONCURRENCY", "4")))
+# plan() 을 기다리는 동안 질문 원문을 미리 임베딩/검색 (0 이면 끔)
+SPECULATE = os.getenv("AGENT_SPECULATE", "1") != "0"
+# 투기 검색 결과: sufficient(계획 질의를 새로 검색할 필요 없음) / partial(일부만 재사용) / wasted / failed
+SPEC_STATS = Counter()
 
-def run_agentic_qa(question: str, k=4, min_score=0.2):
-    index, docs = load_index()
+def _remote_search(query: str, k: int, min_score: float, hybrid=False):
+    from kb_server import call
+    res = call(KB_SERVER, "/search", {"query": query, "k": k, "min_score": min_score, "hybrid": hybrid})
+    return [(h["score"], {"doc_id": h["doc_id"], "text": h["text"]}) for h in res["hits"]]
+
+def _norm_query(q: str) -> str:
+    # 텍스트가 같으면 임베딩 없이 바로 재사용 (앞뒤 공백만 무시)
+    return q.strip()
+
+def _fan(fn, items):
+    """items 가 여럿이면 _query_pool 로 동시에 (투기 작업 안에서 불러도 풀을 기다리며 막히지 않도록 1개면 직접)"""
+    return list(_query_pool.map(fn, items)) if len(items) > 1 else [fn(x) for x in items]
+
+def _speculate(question, index, docs, k, min_score, lexical=None, hybrid=False):
+    """투기 검색: {"text", "hits"}"""
+    if KB_SERVER:
+        return {"text": _norm_query(question), "hits": _remote_search(question, k, min_score, hybrid)}
+    hits = search_many(index, docs, [embed(question)], k=k, min_score=min_score,
+                       query_texts=[question], lexical=lexical)[0]
+    return {"text": _norm_query(question), "hits": hits}
+
+def retrieve_all(queries, index, docs, k, min_score, lexical=None, hybrid=False, spec=None):
+    """
+    질의들을 동시에 임베딩 → 질의 행렬로 index.search 1회 → 질의별 결과를 RRF 로 합쳐 상위 k.
+    KB_SERVER 면 질의별 /search 를 동시에 보낸다.
+    spec: _speculate 결과. 질문과 텍스트가 같은 질의는 임베딩/검색 없이 투기 결과를 쓴다 (결과 동일).
+    반환: ([(score, doc)], {"retrieve_ms", "queries", "searched", "reused", "scores"})
+    순서는 RRF 지만 score 는 질의별 결과 중 그 문서의 최고 코사인 (하이브리드면 비교할 코사인이 없어 None).
+    scores: 같은 값 목록 — 충분성 게이트 입력
+    """
+    t = time.perf_counter()
+    lists = [spec["hits"] if spec and _norm_query(q) == spec["text"] else None for q in queries]
+    reused = sum(x is not None for x in lists)
+    rest = [i for i, x in enumerate(lists) if x is None]
+    if rest and KB_SERVER:
+        for i, hits in zip(rest, _fan(lambda q: _remote_search(q, k, min_score, hybrid), [queries[i] for i in rest])):
+            lists[i] = hits
+        rest = []
+    if rest:
+        vecs = _fan(embed, [queries[i] for i in rest])  # each: length 1536
+        found = search_many(index, docs, vecs, k=k, min_score=min_score,
+                            query_texts=[queries[i] for i in rest], lexical=lexical)
+        for i, hits in zip(rest, found):
+            lists[i] = hits
+    merged = merge_rrf(lists, k)
+    scores = None
+    if not hybrid:
+        best = {}
+        for hits in lists:
+            for s, d in hits:
+                best[doc_key(d)] = max(s, best.get(doc_key(d), s))
+        scores = [round(best[doc_key(d)], 4) for _, d in merged]
+    merged = [(scores[i] if scores else None, d) for i, (_, d) in enumerate(merged)]
+    return merged, {"retrieve_ms": round((time.perf_counter() - t) * 1000, 1),
+                    "queries": len(queries), "searched": len(queries) - reused, "reused": reused, "scores": scores}
+
+def _spec_result(fut):
+    try:
+        return fut.result()
+    except Exception as e:
+        SPEC_STATS["failed"] += 1
+        print(f"[SPECULATE] failed: {e}")
+        return None
+
+def _spec_outcome(timing):
+    """sufficient: 계획 질의 전부 투기 결과로 충분 / partial: 일부 / wasted: 하나도 못 씀"""
+    reused, n = timing["reused"], timing["queries"]
+    outcome = "wasted" if not reused else "sufficient" if reused == n else "partial"
+    SPEC_STATS[outcome] += 1
+    return outcome
+
+def run_agentic_qa(question: str, k=4, min_score=0.2, hybrid=False, speculate=None, on_delta=None,
+                   gate_threshold=None):
+    index, docs = (None, None) if KB_SERVER else load_index()
+    # hybrid: BM25(kb_lexical.npz) 와 벡터 검색을 RRF 로 융합 — 식별자/에러 코드 질의에 강함
+    lexical = LexicalIndex.load() if hybrid and not KB_SERVER else None
+    speculate = SPECULATE if speculate is None else speculate
     it = 0
     history = []
 
     while it < MAX_ITERS:
         it += 1
+        # 계획 질의는 대개 질문을 바꿔 쓴 것 → 질문 원문 검색을 plan() 과 동시에 시작
+        spec = _query_pool.submit(_speculate, question, index, docs, k, min_score, lexical, hybrid) \
+            if speculate else None
         p = plan(question)
         history.append(("plan", p))
 
         # 임베딩: Plan 단계에서 제안된 쿼리 있으면 우선 사용, 없으면 사용자 질문을 벡터화
         queries = p.get("queries") or [question]
-        retrieved = []
-        for q in queries:
-            vec = embed(q)  # returns List[float] length 1536
-            retrieved += search(index, docs, vec, k=k, min_score=min_score)
-
-        # 중복 제거(문서 ID 기준)
-        seen = set()
-        uniq = []
-        for s, d in sorted(retrieved, key=lambda x: -x[0]):
-            key = d.get("doc_id") or d.get("id") or d.get("text")[:32]
-            if key in seen: 
-                continue
-            seen.add(key)
-            uniq.append((s, d))
-        retrieved = uniq[:k]
-
-        answer = answer_with_context(question, retrieved)
+        spec_res = _spec_result(spec) if spec else None
+        # 질의들을 한 번에 검색하고 RRF 로 합침 (문서 ID 기준 중복 제거 포함). 질문과 같은 질의는 투기 결과 재사용
+        retrieved, timing = retrieve_all(queries, index, docs, k, min_score, lexical, hybrid, spec_res)
+        if spec_res:
+            timing["speculation"] = _spec_outcome(timing)
+        history.append(("retrieve", timing))
+
+        # on_delta: 답변을 스트리밍으로 받아 조각마다 전달 (generate 에 ttft_ms / total_ms / usage)
+        gen = {}
+        answer = answer_with_context(question, retrieved, on_delta, gen)
+        history.append(("generate", gen))
         history.append(("answer", answer))
 
-        obs = observe(question, answer)
+        # 검색 점수/질문 커버리지/인용으로 로컬 판정 → 확신이 없을 때만 observe(LLM)
+        obs, est = observe_gated(question, answer, retrieved, timing["scores"], gate_threshold)
+        history.append(("gate", est))
         history.append(("observe", obs))
 
         if obs.get("sufficient", False):
@@ -53,17 +139,37 @@ def run_agentic_qa(question: str, k=4, min_score=0.2):
             # 더 할 게 없으면 종료
             return {"answer": answer, "iterations": it, "history": history}
 
-    return {"answer": history[-2][1] if history else "", "iterations": it, "history": history}
+    return {"answer": next((v for name, v in reversed(history) if name == "answer"), ""),
+            "iterations": it, "history": history}
 
 if __name__ == "__main__":
     ap = argparse.ArgumentParser()
     ap.add_argument("question", type=str, help="질문")
     ap.add_argument("--k", type=int, default=4)
     ap.add_argument("--min-score", type=float, default=0.2)
+    ap.add_argument("--hybrid", action="store_true", help="BM25 + 벡터 하이브리드 검색")
+    ap.add_argument("--stream", action="store_true", help="답변을 생성되는 대로 stderr 에 출력")
+    ap.add_argument("--gate-threshold", type=float, default=None,
+                    help="로컬 충분성 판정 임계값 (기본 AGENT_GATE_THRESHOLD=0.75, 1 초과면 항상 observe LLM 호출)")
+    ap.add_argument("--no-speculate", action="store_true", help="plan() 과 동시에 질문 원문을 미리 검색하지 않음")
     args = ap.parse_args()
 
-    result = run_agentic_qa(args.question, k=args.k, min_score=args.min_score)
+    result = run_agentic_qa(args.question, k=args.k, min_score=args.min_score, hybrid=args.hybrid,
+                            speculate=False if args.no_speculate else None,
+                            on_delta=(lambda d: print(d, end="", file=sys.stderr, flush=True)) if args.stream else None,
+                            gate_threshold=args.gate_threshold)
     print("\n=== FINAL ANSWER ===\n")
     print(result["answer"])
     print("\n--- meta ---")
     print(f"iterations={result['iterations']}")
+    for name, gen in result["history"]:
+        if name == "generate":
+            print(f"generate: ttft_ms={gen.get('ttft_ms')} total_ms={gen.get('total_ms')} usage={gen.get('usage')}")
+    for name, est in result["history"]:
+        if name == "gate":
+            print(f"gate: {est['gate']} confidence={est['confidence']} signals={est['signals']}")
+    if GATE_STATS:
+        print("gate=" + " ".join(f"{k}={v}" for k, v in sorted(GATE_STATS.items())))
+    if SPEC_STATS:
+        print("speculation=" + " ".join(f"{k}={v}" for k, v in sorted(SPEC_STATS.items())))
+    agent_router.log()  # 단계별 모델/호출/승격/지연/토큰
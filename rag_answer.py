@@ -1,6 +1,7 @@
 # file: rag_answer.py
-import os, json, argparse, boto3
+import os, sys, json, argparse, boto3
 from opensearchpy import OpenSearch, RequestsHttpConnection, AWSV4SignerAuth
+import claude_stream
 
 REGION="us-east-1"; SERVICE="aoss"; INDEX="kb-rag"; HOST=os.environ["AOSS_HOST"]
 
@@ -41,7 +42,8 @@ def search(vec, k=4, num_candidates=100):
         body2 = {"size":k,"query":{"knn":{"embedding":{"vector":vec,"k":k}}}}
         return os_client.search(index=INDEX, body=body2)
 
-def answer_with_claude(question:str, contexts:list):
+def answer_with_claude(question:str, contexts:list, on_delta=None, stats=None):
+    # on_delta(text): 스트리밍으로 받아 조각마다 호출 / stats: usage, ttft_ms, total_ms 를 채움
     br = boto3.client("bedrock-runtime", region_name=REGION)
     sys = (
         "You are a helpful assistant. Use ONLY the provided context. "
@@ -61,18 +63,27 @@ def answer_with_claude(question:str, contexts:list):
             {"role":"user","content":[{"type":"text","text": msg}]}
         ]
     }
+    if on_delta is not None:
+        res = claude_stream.complete(br, "anthropic.claude-3-sonnet-20240229-v1:0", payload, on_delta)
+        if stats is not None:
+            stats.update(usage=res["usage"], ttft_ms=res["ttft_ms"], total_ms=res["total_ms"])
+        return res["text"]
     r = br.invoke_model(
         modelId="anthropic.claude-3-sonnet-20240229-v1:0",
         contentType="application/json", accept="application/json",
         body=json.dumps(payload)
     )
-    return json.loads(r["body"].read())["content"][0]["text"]
+    out = json.loads(r["body"].read())
+    if stats is not None:
+        stats.update(usage=out.get("usage"))
+    return out["content"][0]["text"]
 
 if __name__ == "__main__":
     ap = argparse.ArgumentParser()
     ap.add_argument("question")
     ap.add_argument("--k", type=int, default=3)
     ap.add_argument("--min-score", type=float, default=0.2)
+    ap.add_argument("--stream", action="store_true", help="답변을 생성되는 대로 stderr 에 출력")
     args = ap.parse_args()
 
     vec = embed_text(args.question)
@@ -87,5 +98,9 @@ if __name__ == "__main__":
     if not contexts:
         print(json.dumps({"answer":"관련 컨텍스트가 없습니다.","contexts":[]}, ensure_ascii=False, indent=2))
     else:
-        out = answer_with_claude(args.question, contexts)
-        print(json.dumps({"answer": out, "contexts": contexts}, ensure_ascii=False, indent=2))
+        stats = {}
+        on_delta = (lambda d: print(d, end="", file=sys.stderr, flush=True)) if args.stream else None
+        out = answer_with_claude(args.question, contexts, on_delta, stats)
+        if args.stream:
+            print(file=sys.stderr)
+        print(json.dumps({"answer": out, "contexts": contexts, **stats}, ensure_ascii=False, indent=2))
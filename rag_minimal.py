@@ -1,11 +1,14 @@
 # file: rag_minimal.py
-import json, math, boto3
+import json
+import indexer_path  # noqa: F401
+from bedrock_invoker import get_invoker
+from vector_table import VectorTable
 
 REGION = "us-east-1"
 EMBED_MODEL = "amazon.titan-embed-text-v1"               # 방금 성공한 모델
 LLM_MODEL   = "anthropic.claude-3-sonnet-20240229-v1:0"  # Claude 3 Sonnet
 
-br = boto3.client("bedrock-runtime", region_name=REGION)
+br = get_invoker(REGION)
 
 def embed(text: str):
     payload = {"inputText": text}
@@ -17,12 +20,6 @@ def embed(text: str):
     )
     return json.loads(res["body"].read().decode())["embedding"]
 
-def cos(a, b):
-    dot = sum(x*y for x, y in zip(a, b))
-    na  = math.sqrt(sum(x*x for x in a))
-    nb  = math.sqrt(sum(y*y for y in b))
-    return dot / (na * nb + 1e-12)
-
 # 1) 지식베이스(예시 문서)
 docs = [
     ("doc1", "Agentic AI 루프는 Plan-Act-Observe로 구성된다."),
@@ -31,13 +28,18 @@ docs = [
     ("doc4", "SeSAC 프로젝트에서는 Petstagram을 AWS에 배포했고, ALB+EKS+RDS 구성을 사용했다."),
 ]
 
-# 2) 문서 임베딩 미리 생성
-kb = [(doc_id, text, embed(text)) for doc_id, text in docs]
+# 2) 문서 임베딩: rag_minimal_kb.npy 에 저장해 두고 바뀐 문서만 다시 임베딩
+#    (float32 행렬 + 미리 계산한 norm → 코사인 유사도는 행렬곱 1번)
+kb = VectorTable.build([text for _, text in docs], embed, prefix="rag_minimal_kb")
 
 def retrieve(query, topk=2):
     qv = embed(query)
-    scored = sorted(((cos(qv, v), doc_id, text) for doc_id, text, v in kb), reverse=True)
-    return scored[:topk]
+    return [(score, docs[i][0], text) for score, i, text in kb.query(qv, topk)]
+
+def retrieve_batch(queries, topk=2):
+    """여러 질의를 질의 행렬 하나로 검색"""
+    D, I = kb.search([embed(q) for q in queries], topk)
+    return [[(float(s), docs[i][0], docs[i][1]) for s, i in zip(d, ids) if i != -1] for d, ids in zip(D, I)]
 
 def ask_with_context(question):
     hits = retrieve(question, topk=2)
@@ -3,10 +3,9 @@
 AOSS 인덱스 재생성 스크립트
 """
 
-import boto3
-import requests
 import json
-from requests_aws4auth import AWS4Auth
+import indexer_path  # noqa: F401
+from aoss_transport import AOSSTransport
 
 # 설정
 REGION = "us-east-1"
@@ -14,21 +13,13 @@ AOSS_ENDPOINT = "https://iwvt29rkcwesncyf8sw8.us-east-1.aoss.amazonaws.com"
 INDEX_NAME = "kb-rag"
 COLLECTION_NAME = "kb-rag"
 
-# AWS 인증
-session = boto3.Session()
-creds = session.get_credentials().get_frozen_credentials()
-awsauth = AWS4Auth(creds.access_key, creds.secret_key, REGION, "aoss", session_token=creds.token)
+# AWS 인증 (keep-alive 세션 + 자동 갱신 SigV4)
+aoss = AOSSTransport(AOSS_ENDPOINT, COLLECTION_NAME, region=REGION)
 
 def delete_index():
     """기존 인덱스 삭제"""
-    url = f"{AOSS_ENDPOINT}/{INDEX_NAME}"
-    headers = {
-        "Content-Type": "application/json",
-        "x-amz-collection-name": COLLECTION_NAME,
-    }
-    
     print(f"🗑️ 기존 인덱스 삭제 시도: {INDEX_NAME}")
-    response = requests.delete(url, auth=awsauth, headers=headers)
+    response = aoss.delete(f"/{INDEX_NAME}")
     print(f"삭제 응답 상태: {response.status_code}")
     
     if response.status_code == 200:
@@ -40,12 +31,6 @@ def delete_index():
 
 def create_index():
     """새 인덱스 생성"""
-    url = f"{AOSS_ENDPOINT}/{INDEX_NAME}"
-    headers = {
-        "Content-Type": "application/json",
-        "x-amz-collection-name": COLLECTION_NAME,
-    }
-    
     # 인덱스 매핑 (실제 Titan 임베딩 1536차원)
     mapping = {
         "settings": {
@@ -57,6 +42,10 @@ def create_index():
         "mappings": {
             "properties": {
                 "id": {"type": "keyword"},
+                "parent_id": {"type": "keyword"},
+                "chunk_no": {"type": "integer"},
+                "chunk_start": {"type": "integer"},
+                "chunk_end": {"type": "integer"},
                 "content": {"type": "text"},
                 "embedding": {
                     "type": "knn_vector",
@@ -72,7 +61,7 @@ def create_index():
     }
     
     print(f"🔨 새 인덱스 생성 시도: {INDEX_NAME}")
-    response = requests.put(url, auth=awsauth, headers=headers, data=json.dumps(mapping))
+    response = aoss.put(f"/{INDEX_NAME}", data=mapping)
     print(f"생성 응답 상태: {response.status_code}")
     
     if response.status_code in [200, 201]:
@@ -87,14 +76,8 @@ def create_index():
 
 def test_index_access():
     """인덱스 접근 테스트"""
-    url = f"{AOSS_ENDPOINT}/{INDEX_NAME}/_mapping"
-    headers = {
-        "Content-Type": "application/json",
-        "x-amz-collection-name": COLLECTION_NAME,
-    }
-    
     print(f"🧪 인덱스 접근 테스트...")
-    response = requests.get(url, auth=awsauth, headers=headers)
+    response = aoss.get(f"/{INDEX_NAME}/_mapping")
     print(f"테스트 응답 상태: {response.status_code}")
     
     if response.status_code == 200:
@@ -0,0 +1,108 @@
+# file: test_aoss_bulk.py
+"""
+aoss_bulk.BulkWriter 를 로컬 http.server 스텁(_bulk)에 대고 확인
+
+스텁은 문서 id 접두어로 item 상태를 정한다: ok → 201, bad → 400,
+busy → 처음 한 번 429 후 201, hot → 항상 429.
+실행: python -m unittest test_aoss_bulk
+"""
+
+import json, threading, unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+import indexer_path  # noqa: F401
+from aoss_bulk import BulkWriter, requests_sender
+
+
+class _BulkStub(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        lines = body.decode("utf-8").splitlines()
+        items, i = [], 0
+        while i < len(lines):
+            op, meta = next(iter(json.loads(lines[i]).items()))
+            i += 1 if op == "delete" else 2
+            doc_id = meta["_id"]
+            with self.server.lock:
+                self.server.seen[doc_id] = self.server.seen.get(doc_id, 0) + 1
+                first = self.server.seen[doc_id] == 1
+            status = (201 if doc_id.startswith("ok") else 400 if doc_id.startswith("bad")
+                      else 429 if doc_id.startswith("hot") or first else 201)
+            res = {"_index": meta["_index"], "_id": doc_id, "status": status}
+            if status >= 300:
+                res["error"] = {"type": "mapper_parsing_exception" if status == 400 else "es_rejected_execution_exception"}
+            items.append({op: res})
+        with self.server.lock:
+            self.server.requests.append({"bytes": len(body), "ids": [it[next(iter(it))]["_id"] for it in items]})
+        out = json.dumps({"took": 1, "errors": any(r[next(iter(r))]["status"] >= 300 for r in items),
+                          "items": items}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(out)))
+        self.end_headers()
+        self.wfile.write(out)
+
+    def log_message(self, *args):
+        pass
+
+
+class BulkWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _BulkStub)
+        self.server.lock, self.server.seen, self.server.requests = threading.Lock(), {}, []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.http = requests.Session()
+        self.send = requests_sender(self.http, f"http://127.0.0.1:{self.server.server_port}/_bulk", None, {})
+
+    def tearDown(self):
+        self.http.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def writer(self, **kw):
+        return BulkWriter(self.send, "kb-test", backoff=0, **kw)
+
+    def test_flush_at_max_docs(self):
+        w = self.writer(max_docs=3)
+        for n in range(7):
+            w.add({"content": f"c{n}"}, doc_id=f"ok{n}")
+        self.assertEqual([r["ids"] for r in self.server.requests], [["ok0", "ok1", "ok2"], ["ok3", "ok4", "ok5"]])
+        self.assertEqual(w.close(), [])
+        self.assertEqual(self.server.requests[-1]["ids"], ["ok6"])
+        self.assertEqual(w.stats, {"requests": 3, "indexed": 7, "retried": 0, "failed": 0})
+
+    def test_flush_at_max_bytes(self):
+        doc = {"content": "x" * 200}
+        one = len(json.dumps({"index": {"_index": "kb-test", "_id": "ok0"}})) + len(json.dumps(doc)) + 2
+        w = self.writer(max_docs=100, max_bytes=one * 2 + 10)
+        for n in range(5):
+            w.add(doc, doc_id=f"ok{n}")
+        w.close()
+        self.assertEqual([len(r["ids"]) for r in self.server.requests], [2, 2, 1])
+        self.assertTrue(all(r["bytes"] <= w.max_bytes for r in self.server.requests))
+        self.assertEqual(w.stats["indexed"], 5)
+
+    def test_retry_only_429_and_report_400(self):
+        w = self.writer(max_docs=10)
+        for doc_id in ("ok0", "busy0", "bad0", "ok1", "busy1"):
+            w.add({"content": doc_id}, doc_id=doc_id)
+        failed = w.close()
+        self.assertEqual([r["ids"] for r in self.server.requests],
+                         [["ok0", "busy0", "bad0", "ok1", "busy1"], ["busy0", "busy1"]])
+        self.assertEqual(self.server.seen["bad0"], 1)
+        self.assertEqual([(f["id"], f["status"]) for f in failed], [("bad0", 400)])
+        self.assertEqual(w.stats, {"requests": 2, "indexed": 4, "retried": 2, "failed": 1})
+        self.assertEqual(sorted(w.written), ["busy0", "busy1", "ok0", "ok1"])
+
+    def test_429_gives_up_after_max_retries(self):
+        w = self.writer(max_retries=2)
+        w.add({"content": "x"}, doc_id="hot0")
+        w.add({"content": "y"}, doc_id="ok0")
+        failed = w.close()
+        self.assertEqual(self.server.seen["hot0"], 3)
+        self.assertEqual(self.server.seen["ok0"], 1)
+        self.assertEqual([(f["id"], f["status"]) for f in failed], [("hot0", 429)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,163 @@
+# file: vector_table.py
+"""
+NumPy 인메모리 벡터 테이블 (faiss 없이 쓰는 검색기)
+
+- 연속 float32 행렬 + 미리 계산한 L2 norm → 코사인 유사도 = 행렬곱 1번
+- top-k 는 argpartition 으로 O(n) 선택 후 k 개만 정렬
+- 여러 질의를 한 번에 (질의 행렬) 검색
+- <prefix>.npy / <prefix>.norms.npy / <prefix>.json(ids, texts, 해시) 로 저장해 재시작 시 재임베딩하지 않음
+
+search(xq, k) 는 faiss 인덱스와 같은 (D, I) 를 돌려주므로 faiss-cpu 를 설치할 수 없는 환경에서
+kb_store.read_index 가 이 테이블로 대신 검색한다.
+
+벤치마크: python vector_table.py --bench 10000 100000
+"""
+
+import argparse, hashlib, json, math, os, time
+import numpy as np
+
+
+def _hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class VectorTable:
+    def __init__(self, ids, texts, vecs, hashes=None):
+        self.ids = np.asarray(ids, dtype="int64")
+        self.texts = list(texts)
+        self.hashes = list(hashes) if hashes is not None else [_hash(t) for t in self.texts]
+        self.vecs = np.ascontiguousarray(vecs, dtype="float32").reshape(len(self.texts), -1)
+        self.norms = np.linalg.norm(self.vecs, axis=1).astype("float32")
+        self.norms[self.norms == 0] = 1e-12
+
+    @property
+    def ntotal(self):
+        return len(self.texts)
+
+    @property
+    def d(self):
+        return self.vecs.shape[1]
+
+    def search(self, xq, k, ids=None):
+        """
+        xq: (m, d) → (D (m, k) 코사인 유사도, I (m, k) id). 결과가 부족한 자리는 -1 (faiss 와 동일)
+        ids: 이 id 들 안에서만 검색 (kb_filter 속성 필터)
+        """
+        xq = np.atleast_2d(np.asarray(xq, dtype="float32"))
+        rows = None if ids is None else np.flatnonzero(np.isin(self.ids, ids))
+        vecs, norms, table_ids = (self.vecs, self.norms, self.ids) if rows is None else \
+            (self.vecs[rows], self.norms[rows], self.ids[rows])
+        m, n = len(xq), len(table_ids)
+        D = np.full((m, k), -np.inf, dtype="float32")
+        I = np.full((m, k), -1, dtype="int64")
+        if n == 0:
+            return D, I
+        qn = np.linalg.norm(xq, axis=1, keepdims=True)
+        qn[qn == 0] = 1e-12
+        scores = (xq @ vecs.T) / qn / norms  # (m, n)
+        kk = min(k, n)
+        top = np.argpartition(-scores, kk - 1, axis=1)[:, :kk] if kk < n else np.tile(np.arange(n), (m, 1))
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        D[:, :kk] = np.take_along_axis(top_scores, order, axis=1)
+        I[:, :kk] = table_ids[top]
+        return D, I
+
+    def query(self, qv, topk=2):
+        """rag_minimal 형식: [(score, id, text)]"""
+        D, I = self.search(qv, topk)
+        pos = np.searchsorted(self.ids, I[0])  # ids 는 오름차순
+        return [(float(s), int(i), self.texts[p]) for s, i, p in zip(D[0], I[0], pos) if i != -1]
+
+    def save(self, prefix):
+        np.save(f"{prefix}.npy", self.vecs)
+        np.save(f"{prefix}.norms.npy", self.norms)
+        with open(f"{prefix}.json", "w", encoding="utf-8") as f:
+            json.dump({"ids": self.ids.tolist(), "texts": self.texts, "hashes": self.hashes}, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, prefix, mmap=False):
+        meta = json.load(open(f"{prefix}.json", encoding="utf-8"))
+        table = cls.__new__(cls)
+        table.ids = np.asarray(meta["ids"], dtype="int64")
+        table.texts = meta["texts"]
+        table.hashes = meta["hashes"]
+        table.vecs = np.load(f"{prefix}.npy", mmap_mode="r" if mmap else None)
+        table.norms = np.load(f"{prefix}.norms.npy")
+        return table
+
+    @classmethod
+    def build(cls, texts, embed_fn, prefix=None):
+        """
+        texts 를 임베딩해 테이블 생성. prefix 에 저장된 테이블이 있으면 내용(해시)이 같은 텍스트는
+        저장된 벡터를 재사용하고 바뀐 것만 embed_fn 으로 임베딩한 뒤 다시 저장한다.
+        id 는 texts 의 위치.
+        """
+        old = {}
+        if prefix and os.path.exists(f"{prefix}.json"):
+            saved = cls.load(prefix)
+            old = {h: saved.vecs[i] for i, h in enumerate(saved.hashes)}
+        hashes = [_hash(t) for t in texts]
+        vecs = [old[h] if h in old else np.asarray(embed_fn(t), dtype="float32") for t, h in zip(texts, hashes)]
+        table = cls(range(len(texts)), texts, np.vstack(vecs) if vecs else np.zeros((0, 1), "float32"), hashes)
+        if prefix and (len(old) != len(texts) or any(h not in old for h in hashes)):
+            table.save(prefix)
+        return table
+
+    @classmethod
+    def from_store(cls, store):
+        """kb_store.VectorStore → 테이블 (id = FAISS id 와 같음)"""
+        ids, vecs = [], []
+        for i, v in store.iter_vectors():
+            ids.append(i)
+            vecs.append(v)
+        texts = {i: t for i, _, t in store.iter_meta()}
+        ids = np.concatenate(ids) if ids else np.zeros(0, "int64")
+        vecs = np.vstack(vecs) if vecs else np.zeros((0, store.dim), "float32")
+        return cls(ids, [texts[int(i)] for i in ids], vecs)
+
+
+def _py_cos(a, b):
+    # rag_minimal 의 예전 구현 (비교용)
+    dot = sum(x*y for x, y in zip(a, b))
+    na  = math.sqrt(sum(x*x for x in a))
+    nb  = math.sqrt(sum(y*y for y in b))
+    return dot / (na * nb + 1e-12)
+
+
+def bench(rows_list=(10000, 100000), dim=1536, k=5, batch=32, py_rows=1000):
+    """순수 Python 코사인 루프 대비 속도. Python 루프는 py_rows 행으로 재고 선형 외삽"""
+    rng = np.random.default_rng(0)
+    for rows in rows_list:
+        vecs = rng.standard_normal((rows, dim)).astype("float32")
+        table = VectorTable(range(rows), [""] * rows, vecs)
+        xq = rng.standard_normal((batch, dim)).astype("float32")
+
+        sub = min(rows, py_rows)
+        kb = vecs[:sub].tolist()
+        qv = xq[0].tolist()
+        t = time.perf_counter()
+        sorted((_py_cos(qv, v), i) for i, v in enumerate(kb))[:k]
+        py_ms = (time.perf_counter() - t) * 1000 * rows / sub
+
+        t = time.perf_counter()
+        table.search(xq[:1], k)
+        one_ms = (time.perf_counter() - t) * 1000
+
+        t = time.perf_counter()
+        table.search(xq, k)
+        batch_ms = (time.perf_counter() - t) * 1000
+
+        print(f"[BENCH] rows={rows} dim={dim} python_loop={py_ms:.1f}ms/query (extrapolated from {sub} rows) "
+              f"numpy={one_ms:.2f}ms/query ({py_ms / one_ms:.0f}x) "
+              f"numpy_batch{batch}={batch_ms / batch:.2f}ms/query ({py_ms / (batch_ms / batch):.0f}x)")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="VectorTable 벤치마크")
+    ap.add_argument("--bench", type=int, nargs="+", default=[10000, 100000], help="행 수 목록")
+    ap.add_argument("--dim", type=int, default=1536)
+    ap.add_argument("--batch", type=int, default=32)
+    args = ap.parse_args()
+    bench(args.bench, dim=args.dim, batch=args.batch)
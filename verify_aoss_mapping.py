@@ -5,9 +5,8 @@ embedding 필드가 knn_vector dim=1536인지 검증
 """
 
 import json
-import boto3
-import requests
-from requests_aws4auth import AWS4Auth
+import indexer_path  # noqa: F401
+from aoss_transport import AOSSTransport
 
 # 설정
 REGION = "us-east-1"
@@ -15,21 +14,13 @@ AOSS_ENDPOINT = "https://iwvt29rkcwesncyf8sw8.us-east-1.aoss.amazonaws.com"
 INDEX_NAME = "kb-rag"
 COLLECTION_NAME = "kb-rag"
 
-# AWS 인증 설정
-session = boto3.Session()
-creds = session.get_credentials().get_frozen_credentials()
-awsauth = AWS4Auth(creds.access_key, creds.secret_key, REGION, "aoss", session_token=creds.token)
+# AWS 인증 설정 (keep-alive 세션 + 자동 갱신 SigV4)
+aoss = AOSSTransport(AOSS_ENDPOINT, COLLECTION_NAME, region=REGION)
 
 def check_mapping():
     """인덱스 매핑 확인"""
-    url = f"{AOSS_ENDPOINT}/{INDEX_NAME}/_mapping"
-    headers = {
-        "Content-Type": "application/json",
-        "x-amz-collection-name": COLLECTION_NAME,
-    }
-    
     try:
-        response = requests.get(url, auth=awsauth, headers=headers)
+        response = aoss.get(f"/{INDEX_NAME}/_mapping")
         print(f"Status: {response.status_code}")
         
         if response.status_code == 200: